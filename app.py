@@ -1,3 +1,5 @@
+import os
+
 from flask import Flask
 from flask_smorest import Api
 
@@ -7,6 +9,11 @@ from routes.users.users_controller import users, sign_in, sign_up
 from routes.stories.stories_controller import stories
 from routes.pages.pages_controller import pages
 from routes.choices.choices_controller import choices, choice_send_to
+from utils.database import metrics as database_metrics
+from routes.stories.story_graph import story_graphs
+from routes.pages.pdf_exports import pdf_renders
+from utils.indexes import ensure_indexes
+from utils.commands import register_commands
 
 
 server = Flask(__name__)
@@ -29,6 +36,8 @@ class APIConfig:
   OPENAPI_REDOC_UI_URL = "https://cdn.jsdelivr.net/npm/redoc@latest/bundles/redoc.standalone.js"
 
 server.config.from_object(APIConfig)
+# Largest request body read by werkzeug, the uploads being checked against their own limit before they are read
+server.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_CONTENT_LENGTH", 1024 * 1024 * 1024))
 
 api = Api(server)
 
@@ -40,10 +49,23 @@ api.register_blueprint(pages)
 api.register_blueprint(choices)
 api.register_blueprint(choice_send_to)
 
+register_commands(server)
+
+# Create the missing indexes at startup, set MONGODB_ENSURE_INDEXES=0 to only use `flask ensure-indexes`
+if os.environ.get("MONGODB_ENSURE_INDEXES", "1") == "1":
+  try:
+    ensure_indexes()
+  except Exception as e:
+    print(f"Failed to ensure indexes: {e}")
+
 @server.route("/")
 def index():
   return {"message": "Hello, Ariane!"}
 
+@server.route("/metrics")
+def metrics():
+  return {"database": database_metrics.snapshot(), "storyCache": story_graphs.stats(), "pdfCache": pdf_renders.stats()}
+
 if __name__ == "__main__":
   server.run(debug=True, port=8080, host="0.0.0.0")
 
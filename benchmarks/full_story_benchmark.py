@@ -0,0 +1,163 @@
+"""
+Compare the legacy $lookup/$unwind/$group aggregation of get_full_story_by_id
+with the two-query loader of story_graph on synthetic stories.
+
+Usage: python benchmarks/full_story_benchmark.py [sizes...]
+
+The stories are written to the "ariane_benchmark" database, which is dropped at the end.
+"""
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import time
+
+from bson.objectid import ObjectId
+
+from utils.database import get_client
+from utils.indexes import repositories
+from routes.stories.story_graph import load_story_graph
+
+DATABASE_NAME = "ariane_benchmark"
+CHOICES_PER_PAGE = 2
+RUNS = 3
+
+def legacy_full_story(db, story_id):
+  """
+  The aggregation used by get_full_story_by_id before the story_graph loader.
+  """
+  pipeline = [
+    {"$match": {"_id": story_id}},
+    {"$lookup": {
+      "from": "pages",
+      "localField": "_id",
+      "foreignField": "storyId",
+      "as": "pages"
+    }},
+    {"$unwind": {"path": "$pages", "preserveNullAndEmptyArrays": True}},
+    {"$lookup": {
+      "from": "choices",
+      "localField": "pages._id",
+      "foreignField": "pageId",
+      "as": "pages.choices"
+    }},
+    {"$group": {
+      "_id": "$_id",
+      "title": {"$first": "$title"},
+      "summary": {"$first": "$summary"},
+      "userId": {"$first": "$userId"},
+      "cover": {"$first": "$cover"},
+      "createdAt":{"$first": "$createdAt"},
+      "updatedAt":{"$first": "$updatedAt"},
+      "totalCharacters":{"$first": "$totalCharacters"},
+      "totalEnd":{"$first": "$totalEnd"},
+      "totalPages":{"$first": "$totalPages"},
+      "totalOpenNode":{"$first": "$totalOpenNode"},
+      "pages": {"$push": "$pages"}
+    }},
+    {"$project": {
+      "_id": 1,
+      "title": 1,
+      "summary": 1,
+      "cover":1,
+      "createdAt":1,
+      "updatedAt":1,
+      "totalCharacters":1,
+      "totalEnd":1,
+      "totalPages":1,
+      "totalOpenNode":1,
+      "userId": 1,
+      "pages": {
+        "$map": {
+          "input": "$pages",
+          "as": "page",
+          "in": {
+            "_id": "$$page._id",
+            "title": "$$page.title",
+            "text": "$$page.text",
+            "end": "$$page.end",
+            "first": "$$page.first",
+            "totalCharacters": "$$page.totalCharacters", 
+            "previousPageId": "$$page.previousPageId",
+            "image":"$$page.image",
+            "choices": {
+              "$map": {
+                "input": "$$page.choices",
+                "as": "choice",
+                "in": {
+                  "_id": "$$choice._id",
+                  "title": "$$choice.title",
+                  "pageId": "$$choice.pageId",
+                  "sendToPageId": "$$choice.sendToPageId",
+                }
+              }
+            }
+          }
+        }
+      }
+    }}
+  ]
+  return list(db["stories"].aggregate(pipeline, allowDiskUse=False))[0]
+
+def seed_story(db, total_pages:int) -> ObjectId:
+  """
+  Insert a story with total_pages pages, each page linking to the next ones.
+  """
+  story_id = db["stories"].insert_one({"title": f"benchmark {total_pages}", "userId": ObjectId()}).inserted_id
+  page_ids = [ObjectId() for _ in range(total_pages)]
+  pages = [{
+    "_id": page_id,
+    "storyId": story_id,
+    "title": f"page {index}",
+    "text": "Lorem ipsum dolor sit amet. " * 40,
+    "first": index == 0,
+    "end": index == total_pages - 1,
+    "previousPageId": page_ids[index - 1] if index else None,
+  } for index, page_id in enumerate(page_ids)]
+  choices = [{
+    "storyId": story_id,
+    "pageId": page_id,
+    "sendToPageId": page_ids[min(index + offset, total_pages - 1)],
+    "title": f"choice {offset}",
+  } for index, page_id in enumerate(page_ids[:-1]) for offset in range(1, CHOICES_PER_PAGE + 1)]
+  db["pages"].insert_many(pages)
+  if choices:
+    db["choices"].insert_many(choices)
+  return story_id
+
+def timed(function, *args) -> tuple:
+  """
+  Return the best time of RUNS calls, or the error raised by the call.
+  """
+  best = None
+  for _ in range(RUNS):
+    start = time.perf_counter()
+    try:
+      function(*args)
+    except Exception as e:
+      return None, str(e).splitlines()[0][:80]
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best, ""
+
+def main(sizes:list[int]) -> None:
+  client = get_client()
+  db = client[DATABASE_NAME]
+  try:
+    for repository in repositories:
+      if repository.indexes:
+        db[repository().collection_name].create_indexes(repository.indexes)
+
+    print(f"{'pages':>8} {'aggregation':>14} {'story_graph':>14}")
+    for size in sizes:
+      story_id = seed_story(db, size)
+      legacy, legacy_error = timed(legacy_full_story, db, story_id)
+      graph, graph_error = timed(load_story_graph, story_id, db)
+      def show(value, error):
+        return f"{value * 1000:>12.1f}ms" if value is not None else f"{'failed':>14} ({error})"
+      print(f"{size:>8} {show(legacy, legacy_error)} {show(graph, graph_error)}")
+  finally:
+    client.drop_database(DATABASE_NAME)
+
+if __name__ == "__main__":
+  main([int(size) for size in sys.argv[1:]] or [100, 1000, 10000])
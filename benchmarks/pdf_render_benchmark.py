@@ -0,0 +1,73 @@
+"""
+Measure the PDF render time of synthetic stories to check it grows linearly with their size,
+and the peak memory of the process to check it does not.
+
+Usage: python benchmarks/pdf_render_benchmark.py [sizes...]
+
+No database is needed, the stories are built in memory without images.
+"""
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import time
+import resource
+import tempfile
+
+from bson.objectid import ObjectId
+
+from routes.pages.page_mapper import to_entity as page_to_entity
+from routes.pages.pages_pdf import pages_pdf
+
+CHOICES_PER_PAGE = 3
+
+def synthetic_pages(total_pages:int) -> list:
+  """
+  Build a story whose pages each lead to the next CHOICES_PER_PAGE pages.
+  """
+  page_ids = [ObjectId() for _ in range(total_pages)]
+  pages = []
+  for index, page_id in enumerate(page_ids):
+    targets = [page_ids[target] for target in range(index + 1, min(index + 1 + CHOICES_PER_PAGE, total_pages))]
+    pages.append(page_to_entity({
+      "_id": page_id,
+      "storyId": ObjectId(),
+      "title": f"Page {index}",
+      "text": "Vous avancez prudemment dans le couloir sombre. " * 6,
+      "first": index == 0,
+      "end": not targets,
+      "choiceTitle": f"Choix menant a la page {index}" if index else "",
+      "choices": [{"_id": ObjectId(), "pageId": page_id, "sendToPageId": target, "title": "Continuer"} for target in targets],
+    }))
+  for section, page in enumerate(pages):
+    page.section = section
+  return pages
+
+def render(pages:list) -> None:
+  """
+  Render the pages the way the generate_pdf endpoint does, without cover nor adventure pages.
+  """
+  pdf = pages_pdf(orientation = 'P', unit = 'mm', format='A5')
+  pdf.set_title("Benchmark")
+  pdf.set_author('Artist Unknown')
+  pdf.set_subject("Benchmark")
+  pdf.index_sections(pages)
+  pdf.add_page()
+  pdf.draw_page(pages, pages[0])
+  pdf.draw_pages(pages)
+  with tempfile.TemporaryDirectory() as directory:
+    pdf.output_file(os.path.join(directory, "benchmark.pdf"))
+
+def main(sizes:list[int]) -> None:
+  print(f"{'pages':>8} {'render':>12} {'per page':>12} {'peak rss':>12}")
+  for size in sizes:
+    pages = synthetic_pages(size)
+    start = time.perf_counter()
+    render(pages)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{size:>8} {elapsed * 1000:>10.0f}ms {elapsed / size * 1000:>10.3f}ms {peak_rss:>10.0f}MB")
+
+if __name__ == "__main__":
+  main([int(size) for size in sys.argv[1:]] or [250, 500, 1000, 2000, 4000])
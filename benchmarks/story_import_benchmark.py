@@ -0,0 +1,92 @@
+"""
+Import synthetic .ariane archives whose choices converge on the same pages, and
+check the import time and stored page count grow linearly with the archive.
+
+Each story is a ladder of layers of LAYER_WIDTH pages, every page leading to
+all the pages of the next layer, and the last layer looping back to the first
+page. The page inserts of the former recursive importer, which created a
+page once per path reaching it and never ended on the loop, are counted
+alongside without the loop.
+
+Usage: python benchmarks/story_import_benchmark.py [layers...]
+
+The stories are written to the "ariane_benchmark" database, which is dropped at the end.
+"""
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import json
+import time
+import tempfile
+import zipfile
+
+from bson.objectid import ObjectId
+
+import utils.database
+from utils.database import get_client
+from routes.stories.story_import import story_archive, import_story
+
+DATABASE_NAME = "ariane_benchmark"
+LAYER_WIDTH = 2
+# The recursive count is abandoned beyond this number of inserts
+LEGACY_LIMIT = 10 ** 6
+
+def synthetic_story(layers:int) -> dict:
+  """
+  Build the story.json of a ladder of layers, the last layer leading back to the first page.
+  """
+  first_id = str(ObjectId())
+  grid = [[first_id]] + [[str(ObjectId()) for _ in range(LAYER_WIDTH)] for _ in range(layers)]
+  pages = []
+  for depth, layer in enumerate(grid):
+    targets = grid[depth + 1] if depth + 1 < len(grid) else [first_id]
+    for page_id in layer:
+      pages.append({
+        "id": page_id,
+        "title": f"page {depth}",
+        "text": "Lorem ipsum dolor sit amet. " * 20,
+        "first": page_id == first_id,
+        "image": "",
+        "choices": [{"title": f"to {target}", "sendToPageId": target} for target in targets],
+      })
+  return {"title": f"benchmark {layers}", "userId": str(ObjectId()), "pages": pages}
+
+def legacy_inserts(story:dict) -> int:
+  """
+  Count the create_page calls of the former importer, which recursed into every choice target, ignoring the loop.
+  """
+  pages = {page["id"]: page for page in story["pages"]}
+  first = next(page for page in story["pages"] if page["first"])
+  count = 0
+  stack = [first]
+  while stack and count < LEGACY_LIMIT:
+    page = stack.pop()
+    count += 1
+    stack.extend(pages[choice["sendToPageId"]] for choice in page["choices"] if choice["sendToPageId"] != first["id"])
+  return count
+
+def main(sizes:list[int]) -> None:
+  utils.database.DATABASE_NAME = DATABASE_NAME
+  client = get_client()
+  try:
+    print(f"{'layers':>8} {'pages':>8} {'choices':>8} {'legacy inserts':>16} {'stored pages':>13} {'import':>10}")
+    for layers in sizes:
+      story = synthetic_story(layers)
+      with tempfile.NamedTemporaryFile(suffix=".ariane") as f:
+        with zipfile.ZipFile(f.name, "w", zipfile.ZIP_DEFLATED) as zf:
+          zf.writestr("story.json", json.dumps(story))
+        start = time.perf_counter()
+        with story_archive(f.name) as archive:
+          imported, counts = import_story(archive)
+        elapsed = time.perf_counter() - start
+      legacy = legacy_inserts(story)
+      stored = client[DATABASE_NAME]["pages"].count_documents({"storyId": ObjectId(imported.id)})
+      legacy = f"{legacy}" if legacy < LEGACY_LIMIT else f">{LEGACY_LIMIT}"
+      choices = sum(len(page["choices"]) for page in story["pages"])
+      print(f"{layers:>8} {len(story['pages']):>8} {choices:>8} {legacy:>16} {stored:>13} {elapsed * 1000:>8.1f}ms")
+  finally:
+    client.drop_database(DATABASE_NAME)
+
+if __name__ == "__main__":
+  main([int(size) for size in sys.argv[1:]] or [10, 100, 1000, 10000])
@@ -1,6 +1,7 @@
 class Choice:
-  def __init__(self, id: str="", page_id: str="", send_to_page_id: str="", title: str="") -> None:
+  def __init__(self, id: str="", story_id: str="", page_id: str="", send_to_page_id: str="", title: str="") -> None:
     self.id = id
+    self.story_id = story_id
     self.page_id = page_id
     self.send_to_page_id = send_to_page_id
     self.title = title
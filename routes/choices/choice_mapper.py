@@ -17,6 +17,11 @@ def to_entity(choice_data: dict) -> Choice:
     if choice_data.get("_id") and isinstance(choice_data.get("_id"), ObjectId):
       c.id = str(choice_data.get("_id"))
 
+    if choice_data.get("storyId") and isinstance(choice_data.get("storyId"), ObjectId):
+      c.story_id = str(choice_data.get("storyId"))
+    if choice_data.get("storyId") and type(choice_data.get("storyId")) == str:
+      c.story_id = choice_data.get("storyId")
+
     if choice_data.get("pageId") and isinstance(choice_data.get("pageId"), ObjectId):
       c.page_id = str(choice_data.get("pageId"))
     if choice_data.get("pageId") and type(choice_data.get("pageId")) == str:
@@ -46,6 +51,9 @@ def to_dict(c: Choice) -> dict:
     if c.id:
       choice_dict["id"] = str(c.id)
 
+    if c.story_id:
+      choice_dict["storyId"] = str(c.story_id)
+
     if c.page_id:
       choice_dict["pageId"] = str(c.page_id)
 
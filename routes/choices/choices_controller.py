@@ -3,6 +3,7 @@ from flask import jsonify
 from flask_smorest import Blueprint
 
 from utils.jwt_decorator import jwt_required
+from utils.pagination import pagination_args, paginated
 
 from .choices_service import choices_service
 
@@ -23,26 +24,28 @@ class choice_controller(MethodView):
 
     This controller provides endpoints for retrieving, creating, updating, and deleting choices.
   """
+  @choices.arguments(pagination_args, location="query")
   @choices.response(200, choices_response)
   @jwt_required
-  def get(self, page_id:str):
+  def get(self, args:dict, page_id:str):
     """
-      Retrieve all choices associated with a page_id.
+      Retrieve a page of the choices associated with a page_id.
 
       Args:
+          args (dict): The "limit" and the "after" cursor of the page.
           page_id (str): The identifier of the page whose choices are to be retrieved.
 
       Returns:
-          dict: A dictionary containing the list of choices associated with the specified page_id.
+          dict: A dictionary containing the requested choices, the "nextCursor" and the "next" url.
       
       Raises:
           Exception: If an error occurs while retrieving the choices.
     """
     try:
-      choices = choices_service.get_all(page_id)
+      choices, cursor = choices_service.get_all(page_id, args["limit"], args["after"])
       
       choices = [to_dict(choice) for choice in choices]
-      return {"choices": choices}
+      return paginated("choices", choices, cursor, args["limit"])
     except Exception as e:
       return jsonify({"error": str(e)}), 500
   
@@ -3,16 +3,14 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
 
 from bson.objectid import ObjectId
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
+from pymongo import ASCENDING, IndexModel, UpdateMany
 
-from configs.config_database import mongodb_uri 
+from utils.database import get_db
+from utils.pagination import PAGE_DEFAULT_LIMIT, KEYSET_SORT, find_page, keyset_filter, slice_page
+from utils.queries import by_id, choices_of_page, choices_of_pages, choices_of_story, choice_leading_to, choices_leading_to
 from .choice import Choice
 from .choice_mapper import to_entity, to_dict
-
-# Create a new client and connect to the MongoDB server
-client = MongoClient(mongodb_uri, server_api=ServerApi('1'))
-db = client["ariane"]
+from routes.stories.story_graph import story_graphs
 
 class choices_repository:
   """
@@ -21,40 +19,110 @@ class choices_repository:
   This repository provides methods for interacting with the database
   to perform CRUD (Create, Read, Update, Delete) operations on choice.
   """
+  indexes = [
+    IndexModel([("pageId", ASCENDING), ("_id", ASCENDING)], name="pageId_id"),
+    IndexModel([("sendToPageId", ASCENDING)], name="sendToPageId"),
+    IndexModel([("storyId", ASCENDING), ("_id", ASCENDING)], name="storyId_id"),
+  ]
+  # Queries issued by this repository, the story graph loader and the $lookup stages joining on choices,
+  # built with the same utils.queries filters and checked with explain() by utils.indexes
+  queries = [
+    {"filter": choices_of_page(ObjectId())},
+    {"filter": keyset_filter(choices_of_page(ObjectId()), ObjectId()), "sort": KEYSET_SORT},
+    {"filter": choices_of_pages([ObjectId(), ObjectId()])},
+    {"filter": choice_leading_to(ObjectId())},
+    {"filter": choices_leading_to([ObjectId(), ObjectId()]), "sort": KEYSET_SORT},
+    {"filter": choices_of_story(ObjectId()), "sort": KEYSET_SORT},
+    {"filter": by_id(ObjectId())},
+  ]
+
   def __init__(self):
     """
     Initialize a new choices_repository object.
 
-    This constructor creates an instance of MongoClient to connect to the MongoDB server
-    and selects the database named "ariane".
+    The collection is resolved through the shared MongoDB client on every access,
+    so a repository created before a fork keeps working in the worker processes.
+    """
+    self.collection_name = "choices"
+
+  @property
+  def collection(self):
+    """
+    Return the choices collection of the shared MongoDB client.
     """
-    self.collection = db["choices"]
+    return get_db()[self.collection_name]
   
-  def get_all(self, page_id:str) -> list[Choice]:
+  def get_all(self, page_id:str, limit:int=PAGE_DEFAULT_LIMIT, after:str=None) -> tuple[list[Choice], str]:
     """
-    Retrieve all choice associated with a page_id.
+    Retrieve a page of the choices associated with a page_id, in creation order.
 
     Args:
         page_id (str): The identifier of the page whose choices are to be retrieved.
+        limit (int): The maximum number of choices returned.
+        after (str, optional): The cursor returned with the previous page.
 
     Returns:
-        list[Choice]: A list containing the Choices objects associated with the specified page.
-    
+        tuple[list[Choice], str]: The Choice objects, and the cursor of the next page or None on the last page.
+
     Raises:
         Exception: If an error occurs while retrieving the choice.
     """
     try:
-      choices_collection = self.collection.find({"pageId": ObjectId(page_id)})
-      return [to_entity(choice) for choice in choices_collection]
+      cached_page = story_graphs.get_page(page_id)
+      if cached_page:
+        choices_collection, cursor = slice_page(cached_page["choices"], limit, after)
+      else:
+        choices_collection, cursor = find_page(self.collection, choices_of_page(page_id), limit, after)
+      return [to_entity(choice) for choice in choices_collection], cursor
     except Exception as e:
       raise Exception(f"Failed to get choice: {e}") from e
   
-  def delete_all(self, page_id:str) ->int:
+  def get_all_by_story_id(self, story_id:str) -> list[Choice]:
+    """
+    Retrieve all choices of a story with a single indexed query.
+
+    Args:
+        story_id (str): The identifier of the story whose choices are to be retrieved.
+
+    Returns:
+        list[Choice]: A list containing the Choices objects of every page of the story.
+    
+    Raises:
+        Exception: If an error occurs while retrieving the choices.
+    """
+    try:
+      choices_collection = self.collection.find(choices_of_story(story_id))
+      return [to_entity(choice) for choice in choices_collection]
+    except Exception as e:
+      raise Exception(f"Failed to get choices of story {story_id}: {e}") from e
+
+  def count_by_page(self, page_id:str, limit:int=0, session=None) -> int:
+    """
+    Count the choices of a page.
+
+    Args:
+        page_id (str): The identifier of the page.
+        limit (int): The count to stop at, 0 to count them all.
+        session (ClientSession, optional): The session of the current transaction.
+
+    Returns:
+        int: The number of choices of the page, at most limit.
+
+    Raises:
+        Exception: If an error occurs while counting the choices.
+    """
+    try:
+      return self.collection.count_documents(choices_of_page(page_id), limit=limit, session=session)
+    except Exception as e:
+      raise Exception(f"Failed to count the choices of page {page_id}: {e}") from e
+
+  def delete_all(self, page_id:str, session=None) ->int:
     """
     Delete all choices associated with a page.
 
     Args:
         page_id (str): The identifier of the page.
+        session (ClientSession, optional): The session of the current transaction.
 
     Returns:
         int: the number of choice deleted
@@ -63,11 +131,36 @@ class choices_repository:
         Exception: If an error occurs while deleting the choices.
     """
     try:
-      result = self.collection.delete_many({"pageId": ObjectId(page_id)})
+      result = self.collection.delete_many(choices_of_page(page_id), session=session)
       return result.deleted_count
     except Exception as e:
       raise Exception(f"An error occurred while delete choices whit page_id {page_id}: {e}") from e
   
+  def delete_all_by_page_ids(self, page_ids:list[str], session=None, batch_size:int=5000) ->int:
+    """
+    Delete all choices associated with any of the given pages.
+
+    Args:
+        page_ids (list[str]): The identifiers of the pages.
+        session (ClientSession, optional): The session of the current transaction.
+        batch_size (int): The maximum number of page ids sent in a single query.
+
+    Returns:
+        int: the number of choice deleted
+    
+    Raises:
+        Exception: If an error occurs while deleting the choices.
+    """
+    try:
+      page_ids = [ObjectId(page_id) for page_id in page_ids]
+      deleted = 0
+      for start in range(0, len(page_ids), batch_size):
+        result = self.collection.delete_many(choices_of_pages(page_ids[start:start + batch_size]), session=session)
+        deleted += result.deleted_count
+      return deleted
+    except Exception as e:
+      raise Exception(f"An error occurred while delete choices of {len(page_ids)} pages: {e}") from e
+
   def get_choice_by_id(self, choice_id:str) ->Choice:
     """
     Retrieve a choice by its identifier.
@@ -83,7 +176,7 @@ class choices_repository:
         Exception: If an error occurs while retrieving the choice.
     """
     try:
-      choice = self.collection.find_one({"_id": ObjectId(choice_id)})
+      choice = self.collection.find_one(by_id(choice_id))
       if not choice:
         raise ValueError(f"choice not found.")
       return to_entity(choice)
@@ -105,7 +198,7 @@ class choices_repository:
         Exception: If an error occurs while retrieving the choice.
     """
     try:
-      choice = self.collection.find_one({"sendToPageId": ObjectId(send_to_page_id)})
+      choice = self.collection.find_one(choice_leading_to(send_to_page_id))
       if not choice:
         raise ValueError(f"choice not found.")
       return to_entity(choice)
@@ -113,12 +206,13 @@ class choices_repository:
       raise Exception(f"An error occurred while geting choice whit the send_to_page_id {send_to_page_id}: {e}") from e
 
 
-  def delete_choice(self, choice_id:str) ->bool:
+  def delete_choice(self, choice_id:str, session=None) ->bool:
     """
     Delete a choice by its identifier.
 
     Args:
         choice_id (str): The identifier of the choice to delete.
+        session (ClientSession, optional): The session of the current transaction.
 
     Returns:
         bool: True if the choice is successfully deleted, False otherwise.
@@ -128,19 +222,20 @@ class choices_repository:
         Exception: If an error occurs while deleting the choice.
     """
     try:
-      result = self.collection.delete_one({"_id": ObjectId(choice_id)})
+      result = self.collection.delete_one(by_id(choice_id), session=session)
       if result.deleted_count != 1:
         raise ValueError(f"choice not found.")
       return result.deleted_count == 1
     except Exception as e:
       raise Exception(f"An error occurred while delete choice whit id {choice_id}: {e}") from e
   
-  def create_choice(self, c: Choice) -> Choice:
+  def create_choice(self, c: Choice, session=None) -> Choice:
     """
     Create a new choice.
 
     Args:
         c (Choice): The Choice object containing the information of the new Choice to create.
+        session (ClientSession, optional): The session of the current transaction.
 
     Returns:
         Choice: The created Choice object.
@@ -157,11 +252,23 @@ class choices_repository:
       raise ValueError("Choice title cannot be empty.")
   
     choice_data = to_dict(c)
+    # Set by a previous attempt of a retried transaction
+    choice_data.pop("id", None)
     choice_data["pageId"] = ObjectId(choice_data["pageId"])
     choice_data["sendToPageId"] = ObjectId(choice_data["sendToPageId"])
 
+    # Store the owning story so all the choices of a story can be read with one query,
+    # always taken from the page so a choice cannot be attached to the graph of another story
+    page = get_db()["pages"].find_one(by_id(choice_data["pageId"]), {"storyId": 1}, session=session)
+    if not page:
+      raise ValueError("Choice page not found.")
+    if c.story_id and str(c.story_id) != str(page["storyId"]):
+      raise ValueError("Choice storyId does not match the story of its page.")
+    choice_data["storyId"] = page["storyId"]
+    c.story_id = str(page["storyId"])
+
     try:
-      result = self.collection.insert_one(choice_data)
+      result = self.collection.insert_one(choice_data, session=session)
 
       if result.inserted_id:
         c.id = str(result.inserted_id)
@@ -172,6 +279,44 @@ class choices_repository:
     except Exception as e:
       raise Exception(f"An error occurred while creating the choice: {e}") from e
      
+  def insert_choices(self, choices: list[Choice], session=None, batch_size:int=1000) -> int:
+    """
+    Insert new choices with ordered insert_many batches, e.g. the choices of an imported story.
+
+    Args:
+        choices (list[Choice]): The choices, with the identifier of their story.
+        session (ClientSession, optional): The session of the current transaction.
+        batch_size (int): The maximum number of choices inserted by a single insert_many.
+
+    Returns:
+        int: The number of choices inserted.
+
+    Raises:
+        ValueError: If any of the required values to create a choice is missing.
+        Exception: If an error occurs while inserting the choices.
+    """
+    documents = []
+    for c in choices:
+      if not c.page_id or not c.send_to_page_id or not c.story_id:
+        raise ValueError("Choice page_id, send_to_page_id and story_id cannot be empty.")
+      if not c.title:
+        raise ValueError("Choice title cannot be empty.")
+      choice_data = to_dict(c)
+      choice_data["pageId"] = ObjectId(choice_data["pageId"])
+      choice_data["sendToPageId"] = ObjectId(choice_data["sendToPageId"])
+      choice_data["storyId"] = ObjectId(choice_data["storyId"])
+      if c.id:
+        choice_data["_id"] = ObjectId(choice_data.pop("id"))
+      documents.append(choice_data)
+    try:
+      inserted = 0
+      for start in range(0, len(documents), batch_size):
+        result = self.collection.insert_many(documents[start:start + batch_size], ordered=True, session=session)
+        inserted += len(result.inserted_ids)
+      return inserted
+    except Exception as e:
+      raise Exception(f"An error occurred while inserting {len(documents)} choices: {e}") from e
+
   def update_choice(self, choice: Choice) -> Choice:
     """
     Update an existing choice.
@@ -195,11 +340,12 @@ class choices_repository:
   
     choice_data = to_dict(choice)
     choice_data.pop("id")
+    choice_data.pop("storyId", None)
     choice_data.pop("pageId")
     choice_data.pop("sendToPageId")
     try:
       result = self.collection.update_one(
-        {"_id": ObjectId(choice.id)},
+        by_id(choice.id),
         {"$set": choice_data}
       )
       if result.modified_count == 0:
@@ -209,3 +355,37 @@ class choices_repository:
       return choice
     except Exception as e:
       raise Exception(f"An error occurred while updating the choice whit id {choice.id}: {e}") from e
+
+  def backfill_story_ids(self, batch_size:int=1000) -> int:
+    """
+    Set the storyId of the choices created before it was stored on them.
+
+    Args:
+        batch_size (int): The maximum number of page ids updated by a single query.
+
+    Returns:
+        int: The number of choices updated.
+    
+    Raises:
+        Exception: If an error occurs while updating the choices.
+    """
+    try:
+      modified = 0
+      stories_pages = get_db()["pages"].aggregate([
+        {"$group": {"_id": "$storyId", "pageIds": {"$push": "$_id"}}}
+      ])
+      for story_pages in stories_pages:
+        page_ids = story_pages["pageIds"]
+        requests = [
+          UpdateMany(
+            {"pageId": {"$in": page_ids[start:start + batch_size]}, "storyId": {"$exists": False}},
+            {"$set": {"storyId": story_pages["_id"]}}
+          )
+          for start in range(0, len(page_ids), batch_size)
+        ]
+        if requests:
+          modified += self.collection.bulk_write(requests, ordered=False).modified_count
+        story_graphs.invalidate(story_pages["_id"])
+      return modified
+    except Exception as e:
+      raise Exception(f"An error occurred while backfilling the choices story ids: {e}") from e
@@ -1,5 +1,15 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+
+from utils.database import run_in_transaction
+from utils.pagination import PAGE_DEFAULT_LIMIT
+
 from .choices_repository import choices_repository
 from .choice import Choice
+from routes.pages.pages_repository import pages_repository
+from routes.stories.stories_repository import stories_repository
+from routes.stories.story_graph import story_graphs
 
 class choices_service:
   """
@@ -13,25 +23,85 @@ class choices_service:
     Initialize a new choices_service object.
 
     This constructor creates an instance of choice_repository to interact
-    with the database.
+    with the database, and the pages and stories repositories used to
+    maintain the open node counter of the stories.
     """
     self.repository = choices_repository()
+    self.pages_repository = pages_repository()
+    self.stories_repository = stories_repository()
+
+  def _update_open_nodes(self, page_id:str, added:bool, session=None) -> None:
+    """
+    Update the open node counter of a story after choices are added to or removed from one of its pages.
+
+    A page which is not an end stops being an open node with its first choice,
+    and becomes one again when its last choice is removed.
+
+    Args:
+      page_id (str): The identifier of the page whose choices changed.
+      added (bool): Whether a choice was added, or choices removed.
+      session (ClientSession, optional): The session of the current transaction.
+    """
+    page = self.pages_repository.get_page_state(page_id, session=session)
+    if page is None or page.get("end"):
+      return
+    remaining = self.repository.count_by_page(page_id, limit=2, session=session)
+    if added and remaining == 1:
+      self.stories_repository.increment_counters(page["storyId"], {"totalOpenNode": -1}, session=session)
+    elif not added and remaining == 0:
+      self.stories_repository.increment_counters(page["storyId"], {"totalOpenNode": 1}, session=session)
+
+  def _invalidate(self, choice: Choice) -> None:
+    """
+    Drop the cached graph of the story of a choice, once its write is committed.
+
+    Invalidating after the commit, rather than in the transaction, keeps a graph
+    loaded before the commit from being cached as the current one.
+
+    Args:
+      choice (Choice): The written choice.
+    """
+    if choice.story_id:
+      story_graphs.invalidate(choice.story_id)
+    else:
+      # Choices written before their storyId was stored
+      story_graphs.invalidate_page(choice.page_id)
   
-  def get_all(self, page_id:str) -> list[dict]:
+  def get_all(self, page_id:str, limit:int=PAGE_DEFAULT_LIMIT, after:str=None) -> tuple[list[Choice], str]:
     """
-    Retrieve all choice associated with a page_id.
+    Retrieve a page of the choices associated with a page_id.
 
     Args:
       page_id (str): The page identifier.
+      limit (int): The maximum number of choices returned.
+      after (str, optional): The cursor returned with the previous page.
 
     Returns:
-      list[dict]: A list containing the information of all the choice pages.
+      tuple[list[Choice], str]: The choices of the page, and the cursor of the next page or None on the last page.
     
     Raises:
       Exception: If an error occurs while fetching the choices.
     """
     try:
-      return self.repository.get_all(page_id)
+      return self.repository.get_all(page_id, limit, after)
+    except Exception as e:
+      raise Exception(f"Failed to fetch choices: {e}") from e
+    
+  def get_all_by_story_id(self, story_id:str) -> list[dict]:
+    """
+    Retrieve all choices associated with a story_id.
+
+    Args:
+      story_id (str): The story identifier.
+
+    Returns:
+      list[dict]: A list containing the information of all the choices of the story.
+    
+    Raises:
+      Exception: If an error occurs while fetching the choices.
+    """
+    try:
+      return self.repository.get_all_by_story_id(story_id)
     except Exception as e:
       raise Exception(f"Failed to fetch choices: {e}") from e
     
@@ -49,7 +119,14 @@ class choices_service:
       Exception: If an error occurs while deleting the choices.
     """
     try:
-      return self.repository.delete_all(page_id)
+      def delete(session):
+        deleted = self.repository.delete_all(page_id, session=session)
+        if deleted:
+          self._update_open_nodes(page_id, added=False, session=session)
+        return deleted
+      deleted = run_in_transaction(delete)
+      story_graphs.invalidate_page(page_id)
+      return deleted
     except Exception as e:
       raise Exception(f"Failed to delete choice: {e}") from e
   
@@ -69,7 +146,13 @@ class choices_service:
     """
     
     try:
-      return self.repository.create_choice(c)
+      def create(session):
+        choice = self.repository.create_choice(c, session=session)
+        self._update_open_nodes(choice.page_id, added=True, session=session)
+        return choice
+      choice = run_in_transaction(create)
+      self._invalidate(choice)
+      return choice
     except ValueError as ve:
       raise ValueError(f"Missing required values to create the choice: {ve}") from ve
     except Exception as e:
@@ -135,7 +218,9 @@ class choices_service:
     existing_choice.send_to_page_id = choice_data.get('sendToPageId', existing_choice.send_to_page_id)
     existing_choice.title = choice_data.get('title', existing_choice.title)
 
-    return self.repository.update_choice(existing_choice)
+    choice = self.repository.update_choice(existing_choice)
+    self._invalidate(choice)
+    return choice
   
   def delete_choice(self, choice_id:str) -> bool:
     """
@@ -153,6 +238,12 @@ class choices_service:
     existing_choice = self.repository.get_choice_by_id(choice_id)
     if not existing_choice:
         raise ValueError(f"Choice with id {choice_id} not found.")
-    return self.repository.delete_choice(choice_id)
+    def delete(session):
+      deleted = self.repository.delete_choice(choice_id, session=session)
+      self._update_open_nodes(existing_choice.page_id, added=False, session=session)
+      return deleted
+    deleted = run_in_transaction(delete)
+    self._invalidate(existing_choice)
+    return deleted
   
   
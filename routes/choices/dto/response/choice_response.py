@@ -3,6 +3,7 @@ from marshmallow import Schema, fields
 # Define a schema for the reponse
 class choice_response(Schema):
   id = fields.String(required=True)
+  storyId = fields.String()
   pageId = fields.String(required=True)
   sendToPageId = fields.String(required=True)
   title = fields.String(required=True)
@@ -10,4 +11,6 @@ class choice_response(Schema):
 
 
 class choices_response(Schema):
-  choices = fields.List(fields.Nested(choice_response))
\ No newline at end of file
+  choices = fields.List(fields.Nested(choice_response))
+  nextCursor = fields.String(allow_none=True)
+  next = fields.String(allow_none=True)
\ No newline at end of file
@@ -16,10 +16,26 @@ class page_response(Schema):
   first = fields.Boolean()
   totalCharacters = fields.Integer()
   image = fields.String(allow_none=True)
+  imageInfo = fields.Dict(allow_none=True)
+  imageUrl = fields.String(allow_none=True)
   choiceTitle = fields.String(allow_none=True)
   choices = fields.List(fields.Nested(choice_response), allow_none=True)
 
 
 
 class pages_response(Schema):
-  pages = fields.List(fields.Nested(page_response))
\ No newline at end of file
+  pages = fields.List(fields.Nested(page_response))
+  nextCursor = fields.String(allow_none=True)
+  next = fields.String(allow_none=True)
+
+class page_outline_response(Schema):
+  id = fields.String(required=True)
+  title = fields.String(required=True)
+  first = fields.Boolean()
+  end = fields.Boolean()
+  hasImage = fields.Boolean()
+  choices = fields.List(fields.Nested(choice_response))
+
+class outline_response(Schema):
+  storyId = fields.String(required=True)
+  pages = fields.List(fields.Nested(page_outline_response))
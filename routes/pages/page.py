@@ -1,5 +1,5 @@
 class Page:
-  def __init__(self, id: str="", story_id: str="", previous_page_id: str="", end:bool=False, first:bool=False, title:str="", text:str="", total_pages:int=0, total_characters:int=0, section:int=None, image:str="") -> None:
+  def __init__(self, id: str="", story_id: str="", previous_page_id: str="", end:bool=False, first:bool=False, title:str="", text:str="", total_pages:int=0, total_characters:int=0, section:int=None, image:str="", image_info:dict=None) -> None:
     self.id = id
     self.story_id = story_id
     self.previous_page_id = previous_page_id
@@ -10,6 +10,8 @@ class Page:
     self.total_characters = total_characters
     self.section = section
     self.image = image
+    # width, height, bytes and sha256 of the image, recorded at upload
+    self.image_info = image_info
   
   def __repr__(self) -> str:
     return f"{self.id} => ({self.story_id} {self.title}, {self.text})"
\ No newline at end of file
@@ -4,6 +4,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath
 
 from .page import Page
 from bson.objectid import ObjectId
+from utils.asset_store import get_asset_store
 from routes.choices.choice_mapper import to_entity as choice_to_entity
 from routes.choices.choice_mapper import to_dict as choice_to_dict
 def to_entity(page_data: dict) -> Page:
@@ -26,6 +27,7 @@ def to_entity(page_data: dict) -> Page:
     p.choices=[choice_to_entity(choice) for choice in page_data.get('choices', [])]
     p.choice_title = page_data.get("choiceTitle", "")
     p.image = page_data.get("image", "")
+    p.image_info = page_data.get("imageInfo")
     
 
     if page_data.get("_id") and isinstance(page_data.get("_id"), ObjectId):
@@ -64,6 +66,7 @@ def to_dict(p: Page) -> dict:
       "choices" :[choice_to_dict(choice) for choice in p.choices],
       "choiceTitle" :p.choice_title,
       "image": p.image,
+      "imageInfo": p.image_info,
     }
     
     if p.id:
@@ -76,4 +79,37 @@ def to_dict(p: Page) -> dict:
       page_dict["previousPageId"] = str(p.previous_page_id)
 
 
-    return page_dict
\ No newline at end of file
+    return page_dict
+
+def to_response_dict(p: Page) -> dict:
+    """
+    Convert a Page object to its representation in the API responses.
+
+    Args:
+        p (Page): The Page object to convert.
+
+    Returns:
+        dict: The attributes of the page object with the url to download its image.
+    """
+    page_dict = to_dict(p)
+    page_dict["imageUrl"] = get_asset_store().url(p.image) if p.image else None
+    return page_dict
+
+def to_outline_dict(p: Page) -> dict:
+    """
+    Convert a Page object to its entry in the story outline, without its text.
+
+    Args:
+        p (Page): The Page object to convert.
+
+    Returns:
+        dict: The identifier, title, flags and choices of the page, and whether it has an image.
+    """
+    return {
+      "id": str(p.id),
+      "title": p.title,
+      "first": p.first,
+      "end": p.end,
+      "hasImage": bool(p.image),
+      "choices": [choice_to_dict(choice) for choice in p.choices],
+    }
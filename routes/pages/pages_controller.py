@@ -1,33 +1,43 @@
 import os
 import sys
-import base64
 # Add the parent directory to the system path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
 
 
 from flask.views import MethodView
-from flask import jsonify, send_file, request
+from flask import jsonify, send_file, request, make_response
 from flask_smorest import Blueprint
 
-from fpdf import FPDF
-import io
 
 from utils.jwt_decorator import jwt_required
+from utils.pagination import pagination_args, paginated
+from utils.uploads import upload_stream, save_image, save_data_url, release_on_error, discard_replaced, upload_too_large
 
 from .pages_service import pages_service
-from .pages_pdf import pages_pdf
+from .pages_pdf import render_key, render_story_to_file
+from .pdf_exports import pdf_exports, pdf_renders
 from routes.stories.stories_service import stories_service
 
 from .dto.request.page_create import create_page
 from .dto.request.page_update import update_page
-from .dto.response.page_response import page_response, pages_response
+from .dto.response.page_response import page_response, pages_response, outline_response
 
-from .page_mapper import to_dict, to_entity
+from .page_mapper import to_response_dict, to_entity, to_outline_dict
 
 
 # Initialize services
 pages_service = pages_service()
 stories_service = stories_service()
+pdf_export_jobs = pdf_exports()
+
+def export_job_response(job: dict) -> dict:
+  """
+    Convert a PDF export job to its response, with the download url once it is done.
+  """
+  response = {key: job[key] for key in ("id", "storyId", "status", "progress", "error")}
+  if job["status"] == "done":
+    response["download"] = f"/pages/pdf_exports/job/{job['id']}/download"
+  return response
 
 # Create a blueprint for pages routes
 pages = Blueprint("pages", "pages", url_prefix="/pages", description="pages routes")
@@ -39,25 +49,27 @@ class pages_controller(MethodView):
 
     This controller provides endpoints for retrieving, creating, updating and deleting pages.
     """
+  @pages.arguments(pagination_args, location="query")
   @pages.response(200, pages_response)
   @jwt_required
-  def get(self, story_id:str):
+  def get(self, args:dict, story_id:str):
     """
-      Retrieve all pages associated with a story_id.
+      Retrieve a page of the pages associated with a story_id.
 
       Args:
+          args (dict): The "limit" and the "after" cursor of the page.
           story_id (str): The identifier of the story whose pages are to be retrieved.
 
       Returns:
-          dict: A dictionary containing the list of pages associated with the specified story_id.
+          dict: A dictionary containing the requested pages, the "nextCursor" and the "next" url.
       
       Raises:
           Exception: If an error occurs while retrieving the pages.
       """
     try:
-      pages = pages_service.get_pages_with_leading_choice_title(story_id)
-      pages = [to_dict(page) for page in pages]
-      return {"pages": pages}
+      pages, cursor = pages_service.get_pages_with_leading_choice_title(story_id, args["limit"], args["after"])
+      pages = [to_response_dict(page) for page in pages]
+      return paginated("pages", pages, cursor, args["limit"])
     except Exception as e:
       return jsonify({"error": str(e)}), 500
     
@@ -107,14 +119,42 @@ class pages_controller(MethodView):
     except Exception as e:
       return jsonify({"error": str(e)}), 500
   
-    return jsonify({"page": to_dict(page)})
+    return jsonify({"page": to_response_dict(page)})
 
-  @pages.route("/generate_pdf/<story_id>", methods=['POST'])
+  @pages.route("/outline/<story_id>", methods=['GET'])
+  @pages.response(200, outline_response)
+  @jwt_required
+  def get_outline(story_id: str):
+      """
+        Retrieve the outline of a story for the graph view of the editor.
+
+        The outline lists the pages with their title, first and end flags,
+        whether they have an image and their choices, without the text of the
+        pages, so it is cheap enough to be requested on every navigation.
+
+        Args:
+            story_id (str): The identifier of the story.
+
+        Returns:
+            dict: A dictionary containing the story id and the outline of its pages.
+      """
+      try:
+        pages = pages_service.get_outline(story_id)
+        return {"storyId": story_id, "pages": [to_outline_dict(page) for page in pages]}
+      except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+  @pages.route("/generate_pdf/<story_id>", methods=['GET', 'POST'])
   @jwt_required
   def generate_pdf(story_id: str):
       """
         Generate a PDF for the given story_id.
 
+        The options are read from the json body of a POST, or from the query string of a GET
+        (e.g. ?cover=false&titleColor=0,0,0&adventurePage=false). The PDF is served from the
+        render cache when the story content and options did not change, and its render key is
+        the ETag, so a request with a matching If-None-Match gets a 304.
+
         Args:
             story_id (str): The identifier of the story for which the PDF is generated.
 
@@ -125,61 +165,122 @@ class pages_controller(MethodView):
             Exception: If an error occurs while generating the PDF.
       """
       try:
-        # Retrieve options from the request body
-        options = request.get_json()
+        # Retrieve options from the request body or query string
+        if request.method == 'GET':
+          options = {key: request.args[key].lower() not in ("0", "false") for key in ("cover", "adventurePage") if key in request.args}
+          if request.args.get('titleColor'):
+            options['titleColor'] = request.args['titleColor'].split(',')
+        else:
+          options = request.get_json(silent=True) or {}
+
         pages = pages_service.get_pages_with_choices(story_id)
 
         if pages:
           story= stories_service.get_story_by_id(story_id)
-          first_page = [page for page in pages if page.first == True]
-
-          # Sort pages by the length of the choice title (random)
-          def get_title_len(page):
-            return len(page.choice_title)
-          pages.sort(key=get_title_len)
-          for index, page in enumerate(pages):
-            page.section = index
-          
-          pdf = pages_pdf(orientation = 'P', unit = 'mm', format='A5')
-          pdf.set_title(story.title)
-          pdf.set_author('Artist Unknown')
-          pdf.set_subject(story.summary)
-
-          pdf.add_page()
-          if options['cover'] != False:
-            pdf.draw_cover_title(story)
-
-          title_color = [255,0,0]
-          if options['titleColor'] and len(options['titleColor']) == 3:
-            title_color = options['titleColor']
-          pdf.draw_story_title(title_color)
-
-          pdf.draw_summary()
-
-          if options['adventurePage'] != False:
-            pdf.draw_aventure_pages()
-          
-          pdf.draw_page(pages, first_page[0])
-          
-          pdf.draw_pages(pages)
-          
-          #demo
-          pdf.output('test.pdf', 'F')
-
-          ##send pdf
-          stream = io.BytesIO(pdf.output(dest='S').encode('latin-1'))
+          key = render_key(story, pages, options)
+          if key in request.if_none_match:
+            response = make_response('', 304)
+            response.set_etag(key)
+            return response
+
+          path = pdf_renders.get(key)
+          if path is None:
+            os.makedirs(pdf_renders.directory, exist_ok=True)
+            path = pdf_renders.path(key)
+            render_story_to_file(story, pages, options, path)
+            pdf_renders.add(key)
+
           return send_file(
-              stream,
+              path,
               mimetype='application/pdf',
               download_name='example.pdf',
-              as_attachment=False
+              as_attachment=False,
+              etag=key,
+              conditional=False
           )
         else:
           return jsonify({"Error": "No pages found for creating the pdf"}), 404
       
+      except ValueError as ve:
+          return jsonify({"error": str(ve)}), 400
       except Exception as e:
           return jsonify({"error": str(e)}), 500
 
+  @pages.route("/pdf_exports/<story_id>", methods=['POST'])
+  @jwt_required
+  def export_pdf(story_id: str):
+      """
+        Queue the export of a story as a PDF.
+
+        The same options on the same version of the story reuse the job and the PDF already rendered.
+
+        Args:
+            story_id (str): The identifier of the story to export.
+
+        Returns:
+            Response: A response containing the export job, with the 202 status code.
+        
+        Raises:
+            Exception: If an error occurs while queuing the export.
+      """
+      try:
+        options = request.get_json(silent=True) or {}
+        pages = pages_service.get_pages_with_choices(story_id)
+        if not pages:
+          return jsonify({"Error": "No pages found for creating the pdf"}), 404
+
+        story = stories_service.get_story_by_id(story_id)
+        job = pdf_export_jobs.submit(story, pages, options, render_key(story, pages, options))
+        return jsonify({"job": export_job_response(job)}), 202
+      except ValueError as ve:
+          return jsonify({"error": str(ve)}), 400
+      except Exception as e:
+          return jsonify({"error": str(e)}), 500
+
+  @pages.route("/pdf_exports/job/<job_id>", methods=['GET'])
+  @jwt_required
+  def get_export_pdf_job(job_id: str):
+      """
+        Retrieve the status and the progress of a PDF export job.
+
+        Args:
+            job_id (str): The identifier of the job.
+
+        Returns:
+            Response: A response containing the job.
+      """
+      job = pdf_export_jobs.get_job(job_id)
+      if not job:
+        return jsonify({"error": "Export job not found"}), 404
+      return jsonify({"job": export_job_response(job)})
+
+  @pages.route("/pdf_exports/job/<job_id>/download", methods=['GET'])
+  @jwt_required
+  def download_export_pdf(job_id: str):
+      """
+        Download the PDF rendered by an export job.
+
+        Args:
+            job_id (str): The identifier of the job.
+
+        Returns:
+            Response: A response containing the PDF, or 409 if the job is not done.
+      """
+      job = pdf_export_jobs.get_job(job_id)
+      if not job:
+        return jsonify({"error": "Export job not found"}), 404
+      if job["status"] != "done":
+        return jsonify({"error": f"Export job is {job['status']}"}), 409
+      path = pdf_export_jobs.artifact_path(job)
+      if not path:
+        return jsonify({"error": "The exported PDF expired, export the story again"}), 410
+      return send_file(
+          path,
+          mimetype='application/pdf',
+          download_name=f"story_{job['storyId']}.pdf",
+          as_attachment=True
+      )
+
   @pages.route("/page/<page_id>")
   class page_controller(MethodView):
     """
@@ -202,7 +303,7 @@ class pages_controller(MethodView):
       """
       try:
           page = pages_service.get_page_by_id(page_id)
-          return jsonify({"page": to_dict(page)})
+          return jsonify({"page": to_response_dict(page)})
       except ValueError as ve:
           return jsonify({"error": str(ve)}), 404
       except Exception as e:
@@ -226,23 +327,29 @@ class pages_controller(MethodView):
             ValueError: If no page is found with the specified identifier or the provided data is invalid.
             Exception: If an error occurs while updating the page.
         """
-      image_base64 = page_data.get('image')
-
-      # Decode the cover image and save it to the server
-      image_url = None
-      if image_base64:
-        image_data = base64.b64decode(image_base64.split(',')[1])
-        image_filename = f"{page_id}.png"
-        image_path = os.path.join('static', 'images', 'pages', image_filename)
-        with open(image_path, 'wb') as f:
-          f.write(image_data)
-        image_url = f"/static/images/pages/{image_filename}"
-      
-      page_data['image'] = image_url
-
       try:
-        updated_page = pages_service.update_page(page_id, page_data)
-        return jsonify({"page": to_dict(updated_page)})
+        previous_image = None
+        with release_on_error() as uploaded:
+          if 'image' in page_data:
+            image = page_data['image']
+            if not image:
+              # Remove the image
+              previous_image = pages_service.get_page_by_id(page_id).image
+              page_data['imageInfo'] = None
+            elif image.startswith('data:'):
+              # Legacy clients send the image as a base64 data url
+              previous_image = pages_service.get_page_by_id(page_id).image
+              page_data['image'], page_data['imageInfo'] = save_data_url(image)
+              uploaded.append(page_data['image'])
+            else:
+              # The url of the stored image, uploaded with PUT /pages/page/<page_id>/image
+              del page_data['image']
+
+          updated_page = pages_service.update_page(page_id, page_data)
+        discard_replaced(previous_image)
+        return jsonify({"page": to_response_dict(updated_page)})
+      except upload_too_large as e:
+        return jsonify({"error": str(e)}), 413
       except ValueError as ve:
         return jsonify({"error": str(ve)}), 400
       except Exception as e:
@@ -271,4 +378,38 @@ class pages_controller(MethodView):
       except ValueError as ve:
         return jsonify({"error": str(ve)}), 404
       except Exception as e:
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+    @pages.route("/page/<page_id>/image", methods=['PUT'])
+    @jwt_required
+    def upload_image(page_id: str):
+      """
+        Upload the image of a page, sent as the raw body or as the "file" field of a multipart form.
+
+        The image is streamed to the asset store under the hash of its content, so the
+        page updates only carry its url and an image uploaded again is not copied.
+
+        Args:
+            page_id (str): The identifier of the page.
+
+        Returns:
+            dict: A dictionary containing the updated page with the url and metadata of its image.
+
+        Raises:
+            ValueError: If no page is found with the specified identifier or the upload is not a valid image.
+            Exception: If an error occurs while storing the image.
+      """
+      try:
+        page = pages_service.get_page_by_id(page_id)
+        with release_on_error() as uploaded:
+          image_url, info = save_image(upload_stream(request))
+          uploaded.append(image_url)
+          updated_page = pages_service.update_page(page_id, {"image": image_url, "imageInfo": info})
+        discard_replaced(page.image)
+        return jsonify({"page": to_response_dict(updated_page)})
+      except upload_too_large as e:
+        return jsonify({"error": str(e)}), 413
+      except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+      except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -1,7 +1,37 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+
+import json
+import hashlib
+import tempfile
+
 from fpdf import FPDF
 from PIL import Image
 
-base_url = "http://127.0.0.1:8080/"
+from utils.files import STATIC_DIR
+from utils.assets import resolve_asset
+
+class file_buffer:
+  """
+    Replacement of the FPDF buffer writing the document to a file as it is produced.
+
+    FPDF appends every line of the document to a string and only measures its
+    length to compute the object offsets, so the document is never held in
+    memory as a whole, nor encoded a second time on output.
+  """
+  def __init__(self, file):
+    self.file = file
+    self.size = 0
+
+  def __iadd__(self, data:str):
+    data = data.encode('latin-1')
+    self.file.write(data)
+    self.size += len(data)
+    return self
+
+  def __len__(self) -> int:
+    return self.size
 
 class pages_pdf(FPDF):
   def __init__(self, *args, **kwargs):
@@ -16,6 +46,41 @@ class pages_pdf(FPDF):
     # Définir les dimensions de la page A5
     self.page_width = 148  # Largeur en mm
     self.page_height = 210
+    # Page id => section number, built once by index_sections
+    self.sections = {}
+    # Optional callable(done, total) called after each drawn page
+    self.progress = None
+
+  def output_file(self, path:str) -> int:
+    """
+      Finish the document and stream it to a file.
+
+      Args:
+        path (str): The path of the PDF file.
+
+      Returns:
+        int: The size of the file in bytes.
+    """
+    with open(path, 'wb') as f:
+      self.buffer = file_buffer(f)
+      self.close()
+      return len(self.buffer)
+
+  def index_sections(self, pages) -> None:
+    """
+      Index the section number of every page and check that every choice leads to a page of the story.
+
+      Args:
+        pages (list): List of all pages, with their section set.
+
+      Raises:
+        ValueError: If a choice leads to a page that is not part of the story.
+    """
+    self.sections = {page.id: page.section for page in pages}
+    for page in pages:
+      for choice in page.choices:
+        if choice.send_to_page_id not in self.sections:
+          raise ValueError(f"Choice '{choice.title}' of page '{page.title}' leads to the missing page {choice.send_to_page_id}.")
 
   def draw_cover_title(self, story):
     """
@@ -25,8 +90,7 @@ class pages_pdf(FPDF):
         story: The story object containing cover information.
     """
     if story.cover:
-      image_url = f"{base_url}{story.cover}"
-      self.image(image_url, x=0, y=20, w=self.w, h=self.h -20)
+      self.image(resolve_asset(story.cover, 'print', story.cover_info), x=0, y=20, w=self.w, h=self.h -20)
 
   def draw_story_title(self, title_color):
     """
@@ -104,10 +168,14 @@ class pages_pdf(FPDF):
     
     #Image
     if page.image != "" and page.image != None:
-      # open image with Pillow to get dimension
-      image_page_path = f"./{page.image}"
-      with Image.open(image_page_path) as img:
-        img_width, img_height = img.size
+      image_page_path = resolve_asset(page.image, 'print', page.image_info)
+      if page.image_info:
+        # dimensions recorded at upload, the derivative keeps the same ratio
+        img_width, img_height = page.image_info["width"], page.image_info["height"]
+      else:
+        # open image with Pillow to get dimension
+        with Image.open(image_page_path) as img:
+          img_width, img_height = img.size
 
       max_width = self.page_width - 28 # Maximum width for the image
 
@@ -125,9 +193,7 @@ class pages_pdf(FPDF):
       else:
         self.ln(3)
         
-      image_page_url = f"{base_url}{page.image}"
-
-      self.image(image_page_url, x=x, y=y, w=max_width, h=new_height)
+      self.image(image_page_path, x=x, y=y, w=max_width, h=new_height)
       text_y_position = y + new_height + 10  # add 10 mm after image
       self.set_xy(10, text_y_position) 
 
@@ -149,9 +215,12 @@ class pages_pdf(FPDF):
       Args:
         pages (list): List of all pages.
     """
-    for page in pages:
+    total = len(pages)
+    for done, page in enumerate(pages, start=1):
       if not page.first:
-        self.draw_page(pages, page)      
+        self.draw_page(pages, page)
+      if self.progress:
+        self.progress(done, total)
   
   def draw_choice(self, pages, choice):
     """
@@ -161,9 +230,13 @@ class pages_pdf(FPDF):
         pages (list): List of all pages.
         choice: The choice object to draw.
     """
+    if not self.sections:
+      self.index_sections(pages)
+
     title = choice.title.replace('’', "'")
-    section = [page.section for page in pages if page.id == choice.send_to_page_id]
-    section = str(section[0])
+    if choice.send_to_page_id not in self.sections:
+      raise ValueError(f"Choice '{choice.title}' leads to the missing page {choice.send_to_page_id}.")
+    section = str(self.sections[choice.send_to_page_id])
     #Page text
     self.ln(12)
     self.set_font('Times', 'I', 14)
@@ -191,8 +264,149 @@ class pages_pdf(FPDF):
       Draw the adventure pages.
     """
     self.add_page()
-    image_url = f"{base_url}static/page_aventure.png"
-    self.image(image_url, x=0, y=0, w=self.page_width, h=self.page_height)
+    # Pages bundled with the application, not uploaded assets
+    self.image(os.path.join(STATIC_DIR, "page_aventure.png"), x=0, y=0, w=self.page_width, h=self.page_height)
     self.add_page()
-    image_url = f"{base_url}static/page_aventure_2.png"
-    self.image(image_url, x=0, y=0, w=self.page_width, h=self.page_height)
+    self.image(os.path.join(STATIC_DIR, "page_aventure_2.png"), x=0, y=0, w=self.page_width, h=self.page_height)
+
+# Bump when the layout changes, so the PDFs rendered by the previous code are not served anymore
+RENDER_VERSION = 1
+
+def export_options(options:dict) -> dict:
+  """
+    Normalize the export options, ignoring unknown ones.
+
+    Args:
+      options (dict): The export options "cover", "titleColor" and "adventurePage" of the request.
+
+    Returns:
+      dict: The options with their defaults.
+  """
+  options = options or {}
+  title_color = [255,0,0]
+  if options.get('titleColor') and len(options['titleColor']) == 3:
+    title_color = [int(value) for value in options['titleColor']]
+  return {
+    "cover": options.get('cover', True) != False,
+    "titleColor": title_color,
+    "adventurePage": options.get('adventurePage', True) != False,
+  }
+
+def _asset_stamp(url:str, info:dict):
+  """
+    Return what identifies the content of an image from the page or story document, without reading the asset store.
+
+    Uploaded images are stored under the sha256 of their content, so the url changes with the
+    image, and the sha256 recorded with the metadata covers the older per-document files.
+  """
+  if not url:
+    return None
+  return [url, info.get("sha256") if info else None]
+
+def render_key(story, pages, options:dict) -> str:
+  """
+    Hash everything the book of a story is rendered from.
+
+    Two requests get the same key only if the story, its pages, their choices,
+    their images and the export options are identical, so the key addresses
+    the rendered PDF and is used as its ETag.
+
+    Args:
+      story: The story object.
+      pages (list): List of all pages with their choices and leading choice title, in the order they are loaded.
+      options (dict): The export options.
+
+    Returns:
+      str: The hexadecimal sha256 of the content.
+  """
+  content = {
+    "version": RENDER_VERSION,
+    "options": export_options(options),
+    "story": [story.title, story.summary, _asset_stamp(story.cover, story.cover_info)],
+    "pages": [
+      [
+        str(page.id), page.title, page.text, page.first, page.choice_title, _asset_stamp(page.image, page.image_info),
+        [[str(choice.send_to_page_id), choice.title] for choice in page.choices],
+      ]
+      for page in pages
+    ],
+  }
+  return hashlib.sha256(json.dumps(content, separators=(',', ':')).encode()).hexdigest()
+
+def render_story(story, pages, options:dict, progress=None) -> pages_pdf:
+  """
+    Lay out the whole book of a story.
+
+    Args:
+      story: The story object.
+      pages (list): List of all pages with their choices and leading choice title.
+      options (dict): The export options "cover", "titleColor" and "adventurePage".
+      progress (callable, optional): Called with (done, total) after each drawn page.
+
+    Returns:
+      pages_pdf: The laid out document, ready to be output.
+
+    Raises:
+      ValueError: If the story has no first page or a choice leads to a missing page.
+  """
+  first_page = [page for page in pages if page.first == True]
+  if not first_page:
+    raise ValueError("The story has no first page.")
+
+  # Sort pages by the length of the choice title (random)
+  def get_title_len(page):
+    return len(page.choice_title)
+  pages.sort(key=get_title_len)
+  for index, page in enumerate(pages):
+    page.section = index
+
+  pdf = pages_pdf(orientation = 'P', unit = 'mm', format='A5')
+  pdf.index_sections(pages)
+  pdf.progress = progress
+
+  pdf.set_title(story.title)
+  pdf.set_author('Artist Unknown')
+  pdf.set_subject(story.summary)
+
+  options = export_options(options)
+  pdf.add_page()
+  if options['cover']:
+    pdf.draw_cover_title(story)
+
+  pdf.draw_story_title(options['titleColor'])
+
+  pdf.draw_summary()
+
+  if options['adventurePage']:
+    pdf.draw_aventure_pages()
+
+  pdf.draw_page(pages, first_page[0])
+
+  pdf.draw_pages(pages)
+  return pdf
+
+def render_story_to_file(story, pages, options:dict, path:str, progress=None) -> None:
+  """
+    Render the book of a story to a file.
+
+    The document is written next to its destination then moved in place, so
+    a partially written file is never visible under the final name.
+
+    Args:
+      story: The story object.
+      pages (list): List of all pages with their choices and leading choice title.
+      options (dict): The export options.
+      path (str): The path of the PDF file.
+      progress (callable, optional): Called with (done, total) after each drawn page.
+  """
+  pdf = render_story(story, pages, options, progress)
+  # Unique per call, as the threads of a worker may render the same key at once
+  fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path), suffix=".tmp")
+  os.close(fd)
+  try:
+    pdf.output_file(temporary_path)
+    os.replace(temporary_path, path)
+  except BaseException:
+    if os.path.exists(temporary_path):
+      os.remove(temporary_path)
+    raise
@@ -3,16 +3,15 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
 
 from bson.objectid import ObjectId
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
+from pymongo import ASCENDING, IndexModel, UpdateOne
 
-from configs.config_database import mongodb_uri 
+from utils.database import get_db
+from utils.images import image_info
+from utils.pagination import PAGE_DEFAULT_LIMIT, KEYSET_SORT, find_page, keyset_filter, slice_page
+from utils.queries import by_id, pages_of_story, choices_leading_to
 from .page import Page
 from .page_mapper import to_entity, to_dict
-
-# Create a new client and connect to the MongoDB server
-client = MongoClient(mongodb_uri, server_api=ServerApi('1'))
-db = client["ariane"]
+from routes.stories.story_graph import PAGE_FIELDS, OUTLINE_PAGE_FIELDS, load_pages_with_choices, story_graphs
 
 class pages_repository:
   """
@@ -21,161 +20,170 @@ class pages_repository:
   This repository provides methods for interacting with the database
   to perform CRUD (Create, Read, Update, Delete) operations on pages.
   """
+  indexes = [
+    IndexModel([("storyId", ASCENDING), ("_id", ASCENDING)], name="storyId_id"),
+  ]
+  # Queries issued by this repository, built with the same utils.queries filters, checked with explain() by utils.indexes
+  queries = [
+    {"filter": pages_of_story(ObjectId()), "sort": KEYSET_SORT},
+    {"filter": keyset_filter(pages_of_story(ObjectId()), ObjectId()), "sort": KEYSET_SORT},
+    {"filter": by_id(ObjectId())},
+  ]
+
   def __init__(self):
     """
     Initialize a new pages_repository object.
 
-    This constructor creates an instance of MongoClient to connect to the MongoDB server
-    and selects the database named "ariane".
+    The collection is resolved through the shared MongoDB client on every access,
+    so a repository created before a fork keeps working in the worker processes.
+    """
+    self.collection_name = "pages"
+
+  @property
+  def collection(self):
+    """
+    Return the pages collection of the shared MongoDB client.
     """
-    self.collection = db["pages"]
+    return get_db()[self.collection_name]
   
-  def get_all(self, story_id:str) -> list[Page]:
+  def get_all(self, story_id:str, limit:int=PAGE_DEFAULT_LIMIT, after:str=None) -> tuple[list[Page], str]:
     """
-    Retrieve all pages associated with a story.
+    Retrieve a page of the pages associated with a story, in creation order.
 
     Args:
         story_id (str): The identifier of the story whose pages are to be retrieved.
+        limit (int): The maximum number of pages returned.
+        after (str, optional): The cursor returned with the previous page.
 
     Returns:
-        list[Pages]: A list containing the Pages objects associated with the specified story.
+        tuple[list[Page], str]: The Page objects, and the cursor of the next page or None on the last page.
     
     Raises:
         Exception: If an error occurs while retrieving the pages.
     """
     try:
-      pages_collection = self.collection.find({"storyId": ObjectId(story_id)})
-      return [to_entity(page) for page in pages_collection]
+      pages_collection, cursor = find_page(self.collection, pages_of_story(story_id), limit, after)
+      return [to_entity(page) for page in pages_collection], cursor
     except Exception as e:
       raise Exception(f"Failed to get pages: {e}") from e
     
-  def get_pages_with_choices(self, story_id:str) -> list[dict]:
+  def get_pages_with_choices(self, story_id:str) -> list[Page]:
     """
     Retrieve all pages with the all the choice in it
 
+    The pages are served from the story graph cache.
+
     Args:
         story_id (str): The identifier of the story whose pages are to be retrieved.
 
     Returns:
-        list[dict]: A list of dictionaries containing page information along with the leading choice title.
+        list[Page]: The pages of the story with their choices and the title of the first choice leading to them.
     
     Raises:
         Exception: If an error occurs while retrieving the pages.
     """
     try:
-      pipeline = [
-        {"$match": {"storyId": ObjectId(story_id)}},
-        {
-          "$lookup": {
-            "from": "choices",
-            "localField": "_id",
-            "foreignField": "sendToPageId",
-            "as": "leadingChoice"
-          }
-        },
-        {
-          "$unwind": {
-            "path": "$leadingChoice",
-            "preserveNullAndEmptyArrays": True
-          }
-        },
-        {
-          "$lookup": {
-            "from": "choices",
-            "localField": "_id",
-            "foreignField": "pageId",
-            "as": "choices"
-          }
-        },
-        {
-          "$project": {
-            "_id": 1,
-            "storyId": 1,
-            "end": {"$ifNull": ["$end", False]},
-            "first": {"$ifNull": ["$first", False]},
-            "text": 1,
-            "title": 1,
-            "previousPageId": 1,
-            "totalCharacters": 1,
-            "image":1,
-            "choiceTitle": "$leadingChoice.title",
-            "choices": {
-              "$map": {
-                "input": "$choices",
-                "as": "choice",
-                "in": {
-                  "_id": "$$choice._id",
-                  "title": "$$choice.title",
-                  "pageId": "$$choice.pageId",
-                  "sendToPageId": "$$choice.sendToPageId",
-                }
-              }
-            }
-          }
-        }
-      ]
-      pages_with_choices = list(self.collection.aggregate(pipeline))
-      return [to_entity(page) for page in pages_with_choices]
+      graph = story_graphs.get(story_id)
+      return [to_entity(page) for page in graph["pages"]]
     except Exception as e:
       raise Exception(f"Failed to get pages with leading choice titles: {e}") from e
     
-  def get_pages_with_leading_choice_title(self, story_id:str) -> list[dict]:
+  def get_pages_with_leading_choice_title(self, story_id:str, limit:int=PAGE_DEFAULT_LIMIT, after:str=None) -> tuple[list[Page], str]:
     """
-    Retrieve all pages with the title of the choice that leads to them.
+    Retrieve a page of the pages of a story with the title of the choice that leads to them.
+
+    The pages are served from the story graph cache when this worker has the
+    story cached. Otherwise only the requested pages and the choices leading to
+    them are read, instead of loading the whole graph.
 
     Args:
         story_id (str): The identifier of the story whose pages are to be retrieved.
+        limit (int): The maximum number of pages returned.
+        after (str, optional): The cursor returned with the previous page.
 
     Returns:
-        list[dict]: A list of dictionaries containing page information along with the leading choice title.
+        tuple[list[Page], str]: The pages with the title of the first choice leading to them, and the cursor of the next page or None on the last page.
     
     Raises:
         Exception: If an error occurs while retrieving the pages.
     """
     try:
-      pipeline = [
-        {"$match": {"storyId": ObjectId(story_id)}},
-        {
-          "$lookup": {
-            "from": "choices",
-            "localField": "_id",
-            "foreignField": "sendToPageId",
-            "as": "leadingChoice"
-          }
-        },
-        {
-          "$unwind": {
-            "path": "$leadingChoice",
-            "preserveNullAndEmptyArrays": True
-          }
-        },
-        {
-          "$project": {
-            "_id": 1,
-            "storyId": 1,
-            "end": { "$ifNull": ["$end", False] },
-            "first": { "$ifNull": ["$first", False] }, 
-            "text": 1,
-            "title": 1,
-            "previousPageId": 1,
-            "totalCharacters": 1,
-            "image": 1, 
-            "choiceTitle": "$leadingChoice.title"
-          }
-        }
-      ]
-        
-      pages_with_choices = list(self.collection.aggregate(pipeline))
-      return [to_entity(page) for page in pages_with_choices]
+      graph = story_graphs.get_cached(story_id)
+      if graph is not None:
+        pages, cursor = slice_page(graph["pages"], limit, after)
+        return [to_entity({**page, "choices": []}) for page in pages], cursor
+
+      pages, cursor = find_page(self.collection, pages_of_story(story_id), limit, after, {**PAGE_FIELDS, "storyId": 1})
+      pages_by_id = {page["_id"]: page for page in pages}
+      leading_choices = get_db()["choices"].find(choices_leading_to(list(pages_by_id)), {"sendToPageId": 1, "title": 1}).sort(KEYSET_SORT)
+      for choice in leading_choices:
+        page = pages_by_id[choice["sendToPageId"]]
+        if "choiceTitle" not in page:
+          page["choiceTitle"] = choice.get("title")
+      return [to_entity(page) for page in pages], cursor
     except Exception as e:
       raise Exception(f"Failed to get pages with leading choice titles: {e}") from e
   
-  def delete_all(self, story_id:str) ->int:
+  def get_outline(self, story_id:str) -> list[Page]:
+    """
+    Retrieve the outline of a story: its pages with their choices, without their text.
+
+    The outline is taken from the story graph cache when this worker has the
+    story cached, otherwise it is read with two indexed queries projecting out
+    the text of the pages.
+
+    Args:
+        story_id (str): The identifier of the story.
+
+    Returns:
+        list[Page]: The pages of the story with their choices.
+
+    Raises:
+        Exception: If an error occurs while retrieving the pages.
+    """
+    try:
+      graph = story_graphs.get_cached(story_id)
+      if graph is not None:
+        pages = graph["pages"]
+      else:
+        pages = load_pages_with_choices(story_id, fields=OUTLINE_PAGE_FIELDS)
+      return [to_entity(page) for page in pages]
+    except Exception as e:
+      raise Exception(f"Failed to get the outline of story {story_id}: {e}") from e
+
+  def get_page_ids_and_images(self, story_id:str, session=None) -> tuple[list[str], list[str]]:
+    """
+    Retrieve the identifiers and the images of all the pages of a story.
+
+    Args:
+        story_id (str): The identifier of the story.
+        session (ClientSession, optional): The session of the current transaction.
+
+    Returns:
+        tuple[list[str], list[str]]: The page identifiers and the urls of the page images.
+    
+    Raises:
+        Exception: If an error occurs while retrieving the pages.
+    """
+    try:
+      pages = self.collection.find(pages_of_story(story_id), {"_id": 1, "image": 1}, session=session)
+      page_ids = []
+      images = []
+      for page in pages:
+        page_ids.append(str(page["_id"]))
+        if page.get("image"):
+          images.append(page["image"])
+      return page_ids, images
+    except Exception as e:
+      raise Exception(f"Failed to get pages of story {story_id}: {e}") from e
+
+  def delete_all(self, story_id:str, session=None) ->int:
     """
     Delete all pages associated with a story.
 
     Args:
         story_id (str): The identifier of the story.
+        session (ClientSession, optional): The session of the current transaction.
 
     Returns:
         int: the number of pages deleted
@@ -184,7 +192,7 @@ class pages_repository:
         Exception: If an error occurs while deleting the pages.
     """
     try:
-      result = self.collection.delete_many({"storyId": ObjectId(story_id)})
+      result = self.collection.delete_many(pages_of_story(story_id), session=session)
       return result.deleted_count
     except Exception as e:
       raise Exception(f"An error occurred while delete pages whit story_id {story_id}: {e}") from e
@@ -204,19 +212,43 @@ class pages_repository:
         Exception: If an error occurs while retrieving the page.
     """
     try:
-      page = self.collection.find_one({"_id": ObjectId(page_id)})
+      cached_page = story_graphs.get_page(page_id)
+      if cached_page:
+        return to_entity({key: value for key, value in cached_page.items() if key not in ("choices", "choiceTitle")})
+
+      page = self.collection.find_one(by_id(page_id))
       if not page:
         raise ValueError(f"page not found.")
       return to_entity(page)
     except Exception as e:
       raise Exception(f"An error occurred while geting page whit the id {page_id}: {e}") from e
   
-  def delete_page(self, page_id:str) ->bool:
+  def get_page_state(self, page_id:str, session=None) -> dict:
+    """
+    Read the story, end flag and number of characters of a page from the database, bypassing the cache.
+
+    Args:
+        page_id (str): The identifier of the page.
+        session (ClientSession, optional): The session of the current transaction.
+
+    Returns:
+        dict: The "storyId", "end" and "totalCharacters" of the page, or None if the page does not exist.
+
+    Raises:
+        Exception: If an error occurs while retrieving the page.
+    """
+    try:
+      return self.collection.find_one(by_id(page_id), {"storyId": 1, "end": 1, "totalCharacters": 1}, session=session)
+    except Exception as e:
+      raise Exception(f"An error occurred while geting page whit the id {page_id}: {e}") from e
+
+  def delete_page(self, page_id:str, session=None) ->bool:
     """
     Delete a page by its identifier.
 
     Args:
         page_id (str): The identifier of the page to delete.
+        session (ClientSession, optional): The session of the current transaction.
 
     Returns:
         bool: True if the page is successfully deleted, False otherwise.
@@ -226,26 +258,25 @@ class pages_repository:
         Exception: If an error occurs while deleting the page.
     """
     try:
-      result = self.collection.delete_one({"_id": ObjectId(page_id)})
+      result = self.collection.delete_one(by_id(page_id), session=session)
       if result.deleted_count != 1:
         raise ValueError(f"page not found.")
       return result.deleted_count == 1
     except Exception as e:
       raise Exception(f"An error occurred while delete page whit id {page_id}: {e}") from e
   
-  def create_page(self, p: Page) -> Page:
+  def _to_document(self, p: Page) -> dict:
     """
-    Create a new page.
+    Convert a new Page object to the document to insert.
 
     Args:
-        p (Page): The Page object containing the information of the new page to create.
+        p (Page): The page, with its identifier if it was assigned before the insert.
 
     Returns:
-        Page: The created Page object.
-    
+        dict: The page document.
+
     Raises:
         ValueError: If any of the required values to create the page is missing.
-        Exception: If an error occurs while inserting the page.
     """
     if not p.story_id :
       raise ValueError("Page story_id cannot be empty.")
@@ -256,12 +287,59 @@ class pages_repository:
     page_data["storyId"] = ObjectId(page_data["storyId"])
     if not page_data["first"]:
       page_data["previousPageId"] = ObjectId(page_data["previousPageId"])
+    if p.id:
+      page_data["_id"] = ObjectId(p.id)
     page_data.pop("id", None)
     page_data.pop("choices", None)
     page_data.pop("choiceTitle", None)
     page_data.pop("section", None)
+    return page_data
+
+  def insert_pages(self, pages: list[Page], session=None, batch_size:int=500) -> int:
+    """
+    Insert new pages with ordered insert_many batches, e.g. the pages of an imported story.
+
+    Args:
+        pages (list[Page]): The pages, with their identifiers assigned before the insert.
+        session (ClientSession, optional): The session of the current transaction.
+        batch_size (int): The maximum number of pages inserted by a single insert_many.
+
+    Returns:
+        int: The number of pages inserted.
+
+    Raises:
+        ValueError: If any of the required values to create a page is missing.
+        Exception: If an error occurs while inserting the pages.
+    """
+    documents = [self._to_document(p) for p in pages]
+    try:
+      inserted = 0
+      for start in range(0, len(documents), batch_size):
+        result = self.collection.insert_many(documents[start:start + batch_size], ordered=True, session=session)
+        inserted += len(result.inserted_ids)
+      return inserted
+    except Exception as e:
+      raise Exception(f"An error occurred while inserting {len(documents)} pages: {e}") from e
+
+  def create_page(self, p: Page, session=None) -> Page:
+    """
+    Create a new page.
+
+    Args:
+        p (Page): The Page object containing the information of the new page to create.
+        session (ClientSession, optional): The session of the current transaction.
+
+    Returns:
+        Page: The created Page object.
+    
+    Raises:
+        ValueError: If any of the required values to create the page is missing.
+        Exception: If an error occurs while inserting the page.
+    """
+    page_data = self._to_document(p)
+    page_data.pop("_id", None)
     try:
-      result = self.collection.insert_one(page_data)
+      result = self.collection.insert_one(page_data, session=session)
 
       if result.inserted_id:
         p.id = str(result.inserted_id)
@@ -272,12 +350,13 @@ class pages_repository:
     except Exception as e:
       raise Exception(f"An error occurred while creating the page: {e}") from e
      
-  def update_page(self, page: Page) -> Page:
+  def update_page(self, page: Page, session=None) -> Page:
     """
     Update an existing page.
 
     Args:
         page (Page): The Page object containing the updated information of the page.
+        session (ClientSession, optional): The session of the current transaction.
 
     Returns:
         Page: The updated Page object.
@@ -300,13 +379,54 @@ class pages_repository:
     page_data.pop("section", None)
     try:
       result = self.collection.update_one(
-        {"_id": ObjectId(page.id)},
-        {"$set": page_data}
+        by_id(page.id),
+        {"$set": page_data},
+        session=session
       )
-      if result.modified_count == 0:
+      if result.matched_count == 0:
         raise Exception("Failed to update page.")
       
       print("update repo", result)
       return page
     except Exception as e:
       raise Exception(f"An error occurred while updating the page whit id {page.id}: {e}") from e
+
+  def backfill_image_info(self, force:bool=False, batch_size:int=500) -> tuple[int, int]:
+    """
+    Record the metadata of the page images uploaded before it was stored on the pages.
+
+    Args:
+        force (bool): Read the metadata of every page image again.
+        batch_size (int): The maximum number of pages updated by a single bulk write.
+
+    Returns:
+        tuple[int, int]: The number of pages updated and of images not found.
+    
+    Raises:
+        Exception: If an error occurs while updating the pages.
+    """
+    query = {"image": {"$nin": [None, ""]}}
+    if not force:
+      query["imageInfo"] = None
+    try:
+      updated = missing = 0
+      requests = []
+      story_ids = set()
+      for page in self.collection.find(query, {"image": 1, "storyId": 1}):
+        try:
+          info = image_info(page["image"])
+        except FileNotFoundError:
+          missing += 1
+          continue
+        requests.append(UpdateOne({"_id": page["_id"]}, {"$set": {"imageInfo": info}}))
+        story_ids.add(page["storyId"])
+        if len(requests) >= batch_size:
+          updated += self.collection.bulk_write(requests, ordered=False).modified_count
+          requests = []
+      if requests:
+        updated += self.collection.bulk_write(requests, ordered=False).modified_count
+      for story_id in story_ids:
+        story_graphs.invalidate(story_id)
+      return updated, missing
+    except Exception as e:
+      raise Exception(f"An error occurred while backfilling the page images metadata: {e}") from e
@@ -1,5 +1,17 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+
+from utils.database import run_in_transaction
+from utils.pagination import PAGE_DEFAULT_LIMIT
+from utils.uploads import retain_images, release_images
+
 from .pages_repository import pages_repository
 from .page import Page
+from routes.choices.choices_repository import choices_repository
+from routes.stories.stories_repository import stories_repository
+from routes.stories.story_counters import page_counters, counters_delta
+from routes.stories.story_graph import story_graphs
 from fpdf import FPDF
 
 class pages_service:
@@ -14,25 +26,30 @@ class pages_service:
     Initialize a new pages_service object.
 
     This constructor creates an instance of pages_repository to interact
-    with the database.
+    with the database, and the choices and stories repositories used to
+    maintain the counters of the stories.
     """
     self.repository = pages_repository()
+    self.choices_repository = choices_repository()
+    self.stories_repository = stories_repository()
   
-  def get_all(self, story_id:str) -> list[dict]:
+  def get_all(self, story_id:str, limit:int=PAGE_DEFAULT_LIMIT, after:str=None) -> tuple[list[Page], str]:
     """
-    Retrieve all pages associated with a story_id.
+    Retrieve a page of the pages associated with a story_id.
 
     Args:
       story_id (str): The story identifier.
+      limit (int): The maximum number of pages returned.
+      after (str, optional): The cursor returned with the previous page.
 
     Returns:
-      list[dict]: A list containing the information of all the story pages.
+      tuple[list[Page], str]: The pages of the story, and the cursor of the next page or None on the last page.
     
     Raises:
       Exception: If an error occurs while fetching the pages.
     """
     try:
-      return self.repository.get_all(story_id)
+      return self.repository.get_all(story_id, limit, after)
     except Exception as e:
       raise Exception(f"Failed to fetch pages: {e}") from e
     
@@ -54,27 +71,47 @@ class pages_service:
     except Exception as e:
       raise Exception(f"Failed to fetch pages: {e}") from e
     
-  def get_pages_with_leading_choice_title(self, story_id:str) -> list[dict]:
+  def get_pages_with_leading_choice_title(self, story_id:str, limit:int=PAGE_DEFAULT_LIMIT, after:str=None) -> tuple[list[Page], str]:
     """
-    Retrieve all pages with the title of the choice that leads to them.
+    Retrieve a page of the pages of a story with the title of the choice that leads to them.
 
     Args:
         story_id (str): The identifier of the story whose pages are to be retrieved.
+        limit (int): The maximum number of pages returned.
+        after (str, optional): The cursor returned with the previous page.
 
     Returns:
-        list[dict]: A list of dictionaries containing page information along with the leading choice title.
+        tuple[list[Page], str]: The pages with the leading choice title, and the cursor of the next page or None on the last page.
     
     Raises:
         Exception: If an error occurs while retrieving the pages.
     """
     try:
-      return self.repository.get_pages_with_leading_choice_title(story_id)
+      return self.repository.get_pages_with_leading_choice_title(story_id, limit, after)
     except Exception as e:
       raise Exception(f"Failed to fetch pages: {e}") from e
       
+  def get_outline(self, story_id:str) -> list[Page]:
+    """
+    Retrieve the outline of a story, its pages and choices without the text of the pages.
+
+    Args:
+        story_id (str): The identifier of the story.
+
+    Returns:
+        list[Page]: The pages of the story with their choices.
+
+    Raises:
+        Exception: If an error occurs while retrieving the outline.
+    """
+    try:
+      return self.repository.get_outline(story_id)
+    except Exception as e:
+      raise Exception(f"Failed to fetch the outline: {e}") from e
+
   def delete_all(self, story_id:str) -> int:
     """
-    Delete all pages associated with a story_id.
+    Delete all pages associated with a story_id, reset the counters of the story and release the images.
 
     Args:
       story_id (str): The story identifier.
@@ -86,13 +123,21 @@ class pages_service:
       Exception: If an error occurs while deleting the pages.
     """
     try:
-      return self.repository.delete_all(story_id)
+      def delete(session):
+        _, images = self.repository.get_page_ids_and_images(story_id, session=session)
+        deleted = self.repository.delete_all(story_id, session=session)
+        self.stories_repository.reset_counters(story_id, session=session)
+        return deleted, images
+      deleted, images = run_in_transaction(delete)
+      story_graphs.invalidate(story_id)
+      release_images(images)
+      return deleted
     except Exception as e:
       raise Exception(f"Failed to delete pages: {e}") from e
   
   def create_page(self, p: Page) -> Page:
     """
-    Create a new page.
+    Create a new page, counted in the counters of its story.
 
     Args:
       p (Page): The Page object containing the information of the new page.
@@ -105,7 +150,15 @@ class pages_service:
       Exception: If an error occurs while creating the pages.
     """
     try:
-      return self.repository.create_page(p)
+      def create(session):
+        page = self.repository.create_page(p, session=session)
+        # A new page has no choice yet
+        self.stories_repository.increment_counters(page.story_id, page_counters(page.end, page.total_characters, False), session=session)
+        return page
+      page = run_in_transaction(create)
+      story_graphs.invalidate(page.story_id)
+      retain_images([page.image])
+      return page
     except ValueError as ve:
       raise ValueError(f"Missing required values to create the page: {ve}") from ve
     except Exception as e:
@@ -132,7 +185,7 @@ class pages_service:
   
   def update_page(self, page_id: str, page_data: dict) -> Page:
     """
-    Update an existing page.
+    Update an existing page, and the counters of its story when its end flag or number of characters change.
 
     Args:
       page_id (str): The identifier of the page to update.
@@ -147,6 +200,8 @@ class pages_service:
     existing_page = self.repository.get_page_by_id(page_id)
     if not existing_page:
       raise ValueError(f"Page with id {page_id} not found.")
+    story_id = existing_page.story_id
+    before = (existing_page.end, existing_page.total_characters)
     
     existing_page.story_id = page_data.get('storyId', existing_page.story_id)
     existing_page.title = page_data.get('title', existing_page.title)
@@ -155,12 +210,23 @@ class pages_service:
     existing_page.end = page_data.get('end', existing_page.end)
     existing_page.total_characters = page_data.get('totalCharacters', existing_page.total_characters)
     existing_page.image = page_data.get('image', existing_page.image)
-
-    return self.repository.update_page(existing_page)
+    existing_page.image_info = page_data.get('imageInfo', existing_page.image_info)
+
+    def update(session):
+      page = self.repository.update_page(existing_page, session=session)
+      after = (page.end, page.total_characters)
+      if after != before:
+        has_choices = self.choices_repository.count_by_page(page_id, limit=1, session=session) > 0
+        delta = counters_delta(page_counters(*before, has_choices), page_counters(*after, has_choices))
+        self.stories_repository.increment_counters(story_id, delta, session=session)
+      return page
+    page = run_in_transaction(update)
+    story_graphs.invalidate(story_id)
+    return page
   
   def delete_page(self, page_id:str) -> bool:
     """
-    Delete a page by its identifier.
+    Delete a page by its identifier, remove it from the counters of its story and release its image.
 
     Args:
       page_id (str): The identifier of the page to delete.
@@ -174,6 +240,14 @@ class pages_service:
     existing_page = self.repository.get_page_by_id(page_id)
     if not existing_page:
         raise ValueError(f"Page with id {page_id} not found.")
-    return self.repository.delete_page(page_id)
+    def delete(session):
+      has_choices = self.choices_repository.count_by_page(page_id, limit=1, session=session) > 0
+      deleted = self.repository.delete_page(page_id, session=session)
+      self.stories_repository.increment_counters(existing_page.story_id, page_counters(existing_page.end, existing_page.total_characters, has_choices, sign=-1), session=session)
+      return deleted
+    deleted = run_in_transaction(delete)
+    story_graphs.invalidate(existing_page.story_id)
+    release_images([existing_page.image])
+    return deleted
   
 
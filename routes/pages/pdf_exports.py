@@ -0,0 +1,253 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+
+import json
+import time
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.cache import disk_lru_cache
+from .pages_pdf import render_story_to_file
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+# Directory of the job files and size of the render pool
+PDF_EXPORT_DIR = os.environ.get("PDF_EXPORT_DIR", os.path.join(ROOT_DIR, "exports", "pdf"))
+PDF_EXPORT_WORKERS = int(os.environ.get("PDF_EXPORT_WORKERS", 2))
+# A queued or running job not updated for this many seconds is considered lost (e.g. after a restart)
+PDF_EXPORT_JOB_TIMEOUT = int(os.environ.get("PDF_EXPORT_JOB_TIMEOUT", 600))
+# Jobs not updated for this many seconds are deleted, checked at most every PDF_EXPORT_PURGE_INTERVAL seconds
+PDF_EXPORT_JOB_TTL = int(os.environ.get("PDF_EXPORT_JOB_TTL", 24 * 3600))
+PDF_EXPORT_PURGE_INTERVAL = 600
+# Directory and total size of the rendered PDFs, addressed by their render key
+PDF_CACHE_DIR = os.environ.get("PDF_CACHE_DIR", os.path.join(ROOT_DIR, "exports", "cache"))
+PDF_CACHE_MAX_BYTES = int(os.environ.get("PDF_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+# Rendered PDFs shared by the generate_pdf endpoint and the export jobs
+pdf_renders = disk_lru_cache(PDF_CACHE_DIR, PDF_CACHE_MAX_BYTES, ".pdf")
+
+def _write_json(path:str, data:dict) -> None:
+  """
+  Atomically write a json file.
+  """
+  temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+  with open(temporary_path, "w") as f:
+    json.dump(data, f)
+  os.replace(temporary_path, path)
+
+def _read_json(path:str) -> dict:
+  """
+  Read a json file, or return None if it does not exist.
+  """
+  try:
+    with open(path) as f:
+      return json.load(f)
+  except FileNotFoundError:
+    return None
+
+class job_progress:
+  """
+  Progress callback of the render process, saving the page count in the job file.
+
+  The file is rewritten at most every second to keep the I/O low on large books.
+  """
+  def __init__(self, job_path:str, job:dict):
+    self.job_path = job_path
+    self.job = job
+    self.last_write = 0
+
+  def __call__(self, done:int, total:int) -> None:
+    now = time.time()
+    if done < total and now - self.last_write < 1:
+      return
+    self.last_write = now
+    self.job.update({"status": "running", "progress": {"done": done, "total": total}, "updatedAt": now})
+    _write_json(self.job_path, self.job)
+
+def _render_job(job_path:str, job:dict, story, pages, options:dict, artifact_path:str) -> bool:
+  """
+  Render a job in a process of the pool and record its outcome in the job file.
+
+  Returns:
+      bool: True if the PDF was rendered, False if the render failed.
+  """
+  try:
+    job_progress(job_path, job)(0, len(pages))
+    render_story_to_file(story, pages, options, artifact_path, progress=job_progress(job_path, job))
+    job.update({"status": "done", "updatedAt": time.time()})
+  except Exception as e:
+    job.update({"status": "failed", "error": str(e), "updatedAt": time.time()})
+  _write_json(job_path, job)
+  return job["status"] == "done"
+
+class pdf_exports:
+  """
+  PDF export jobs rendered in a bounded process pool.
+
+  Jobs are files of the export directory and PDFs are files of the render
+  cache, so any worker of the node can report the status of a job and serve
+  its PDF. Requests with the same render key share the same job and PDF.
+
+  Both directories are local to the node: with several nodes, the polling and
+  download requests of a job must reach the node which created it (e.g. with
+  sticky sessions), or the export directory must be a shared volume.
+  """
+  def __init__(self, directory:str=PDF_EXPORT_DIR, max_workers:int=PDF_EXPORT_WORKERS, cache:disk_lru_cache=pdf_renders):
+    """
+    Initialize a new pdf_exports object.
+
+    Args:
+        directory (str): The directory of the job files.
+        max_workers (int): The number of render processes.
+        cache (disk_lru_cache): The cache the PDFs are rendered to.
+    """
+    self.directory = directory
+    self.max_workers = max_workers
+    self.cache = cache
+    self._executor = None
+    self._executor_pid = None
+    self._lock = threading.Lock()
+    self._last_purge = 0
+
+  def _pool(self) -> ProcessPoolExecutor:
+    """
+    Return the render pool of the current process, created on first use.
+
+    The processes are spawned rather than forked so they do not inherit the
+    database connections and threads of the server.
+    """
+    with self._lock:
+      if self._executor is None or self._executor_pid != os.getpid():
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        self._executor_pid = os.getpid()
+      return self._executor
+
+  def _job_path(self, job_id:str) -> str:
+    return os.path.join(self.directory, f"{job_id}.json")
+
+  def artifact_path(self, job:dict) -> str:
+    """
+    Return the path of the PDF rendered by a job, or None if it was evicted from the cache.
+    """
+    return self.cache.get(job['key'])
+
+  def get_job(self, job_id:str) -> dict:
+    """
+    Return a job by its identifier.
+
+    Args:
+        job_id (str): The identifier of the job.
+
+    Returns:
+        dict: The job with its status and progress, or None if it does not exist.
+    """
+    try:
+      uuid.UUID(hex=job_id)
+    except ValueError:
+      return None
+    job = _read_json(self._job_path(job_id))
+    if job and job["status"] in ("queued", "running") and time.time() - job["updatedAt"] > PDF_EXPORT_JOB_TIMEOUT:
+      job.update({"status": "failed", "error": "The export was interrupted."})
+    return job
+
+  def purge_expired(self) -> int:
+    """
+    Delete the files of the jobs not updated for PDF_EXPORT_JOB_TTL seconds, and the render keys pointing to them.
+
+    Returns:
+        int: The number of jobs deleted.
+    """
+    try:
+      names = os.listdir(self.directory)
+    except FileNotFoundError:
+      return 0
+    now = time.time()
+    removed = 0
+    for name in names:
+      if not name.endswith(".json"):
+        continue
+      job = _read_json(os.path.join(self.directory, name))
+      if job is None or now - job["updatedAt"] < PDF_EXPORT_JOB_TTL:
+        continue
+      try:
+        os.remove(os.path.join(self.directory, name))
+        removed += 1
+      except FileNotFoundError:
+        pass
+    # Render keys whose job is gone
+    for name in names:
+      if not name.endswith(".job"):
+        continue
+      key_path = os.path.join(self.directory, name)
+      try:
+        with open(key_path) as f:
+          job_id = f.read().strip()
+        if not os.path.exists(self._job_path(job_id)):
+          os.remove(key_path)
+      except (FileNotFoundError, ValueError):
+        pass
+    return removed
+
+  def submit(self, story, pages, options:dict, key:str) -> dict:
+    """
+    Queue the export of a story, or return the job already exporting the same content with the same options.
+
+    Args:
+        story: The story object.
+        pages (list): List of all pages with their choices and leading choice title.
+        options (dict): The export options.
+        key (str): The render key of the story and options, see render_key.
+
+    Returns:
+        dict: The job.
+    """
+    os.makedirs(self.directory, exist_ok=True)
+    os.makedirs(self.cache.directory, exist_ok=True)
+    if time.time() - self._last_purge > PDF_EXPORT_PURGE_INTERVAL:
+      self._last_purge = time.time()
+      self.purge_expired()
+
+    # Reuse the job of an identical request unless it failed or its PDF was evicted
+    key_path = os.path.join(self.directory, f"{key}.job")
+    if os.path.exists(key_path):
+      with open(key_path) as f:
+        job = self.get_job(f.read().strip())
+      if job and job["status"] in ("queued", "running"):
+        return job
+      if job and job["status"] == "done" and self.artifact_path(job):
+        return job
+
+    now = time.time()
+    # The PDF may already have been rendered by the generate_pdf endpoint
+    rendered = self.cache.get(key) is not None
+    job = {
+      "id": uuid.uuid4().hex,
+      "storyId": str(story.id),
+      "key": key,
+      "options": options,
+      "status": "done" if rendered else "queued",
+      "progress": {"done": len(pages) if rendered else 0, "total": len(pages)},
+      "error": None,
+      "createdAt": now,
+      "updatedAt": now,
+    }
+    job_path = self._job_path(job["id"])
+    _write_json(job_path, job)
+    with open(key_path, "w") as f:
+      f.write(job["id"])
+    if rendered:
+      return job
+
+    future = self._pool().submit(_render_job, job_path, dict(job), story, pages, options, self.cache.path(key))
+    def on_done(future):
+      if future.exception() is not None:
+        job.update({"status": "failed", "error": str(future.exception()), "updatedAt": time.time()})
+        _write_json(job_path, job)
+      elif future.result():
+        # Only a rendered PDF is registered, a failed render must not be served as the PDF of its key
+        self.cache.add(key)
+    future.add_done_callback(on_done)
+    return job
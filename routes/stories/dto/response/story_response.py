@@ -8,6 +8,9 @@ class story_response(Schema):
   title = fields.String(required=True)
   summary = fields.String()
   cover = fields.String(allow_none=True)
+  coverInfo = fields.Dict(allow_none=True)
+  coverUrl = fields.String(allow_none=True)
+  coverThumbnail = fields.String(allow_none=True)
   createdAt = fields.String()
   updatedAt = fields.String()
   totalCharacters = fields.Integer()
@@ -17,4 +20,6 @@ class story_response(Schema):
   pages = fields.List(fields.Nested(page_response), allow_none=True)
 
 class stories_response(Schema):
-  stories = fields.List(fields.Nested(story_response))
\ No newline at end of file
+  stories = fields.List(fields.Nested(story_response))
+  nextCursor = fields.String(allow_none=True)
+  next = fields.String(allow_none=True)
\ No newline at end of file
@@ -3,36 +3,30 @@ import sys
 # Add the parent directory to the system path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
 
-import io
-import base64
-import zipfile
-import json
+import shutil
+import tempfile
 
 from flask.views import MethodView
-from flask import jsonify, send_file, request
+from flask import jsonify, request, Response, stream_with_context
 from flask_smorest import Blueprint
 
 
 from utils.jwt_decorator import jwt_required
+from utils.pagination import pagination_args, paginated
+from utils.uploads import upload_stream, save_image, save_data_url, release_on_error, discard_replaced, upload_too_large, check_content_length
 
 from .stories_service import stories_service
-from routes.pages.pages_service import pages_service
-from routes.choices.choices_service import choices_service
+from .story_export import stream_story_archive
+from .story_import import archive_invalid, IMPORT_MAX_BYTES
 
 from .dto.request.story_create import create_story
 from .dto.request.story_update import update_story
 from .dto.response.story_response import story_response, stories_response
 
-from .story_mapper import to_dict, to_entity
-from routes.pages.page_mapper import to_entity as page_to_entity
-from routes.pages.page_mapper import to_dict as page_to_dict
-from routes.choices.choice_mapper import to_entity as choice_to_entity
-from routes.choices.choice_mapper import to_dict as choice_to_dict
+from .story_mapper import to_response_dict, to_entity
 
 # Initialize services
 stories_service = stories_service()
-pages_service = pages_service()
-choices_service = choices_service()
 
 stories = Blueprint("stories", "stories", url_prefix="/stories", description="stories routes")
  
@@ -43,25 +37,27 @@ class stories_controller(MethodView):
 
     This controller provides endpoints for retrieving, creating, updating, and deleting stories.
   """
+  @stories.arguments(pagination_args, location="query")
   @stories.response(200, stories_response)
   @jwt_required
-  def get(self, user_id:str):
+  def get(self, args:dict, user_id:str):
     """
-      Retrieve all stories associated with a user.
+      Retrieve a page of the stories associated with a user.
 
       Args:
+          args (dict): The "limit" and the "after" cursor of the page.
           user_id (str): The identifier of the user whose stories are to be retrieved.
 
       Returns:
-          dict: A dictionary containing the list of stories associated with the specified user.
+          dict: A dictionary containing the requested stories, the "nextCursor" and the "next" url.
       
       Raises:
           Exception: If an error occurs while retrieving the stories.
     """
     try:
-      stories = stories_service.get_all(user_id)
-      stories = [to_dict(story) for story in stories]
-      return {"stories": stories}
+      stories, cursor = stories_service.get_all(user_id, args["limit"], args["after"])
+      stories = [to_response_dict(story) for story in stories]
+      return paginated("stories", stories, cursor, args["limit"])
     except Exception as e:
       return jsonify({"error": str(e)}), 500
       
@@ -90,7 +86,7 @@ class stories_controller(MethodView):
     except Exception as e:
       return jsonify({"error": str(e)}), 500
   
-    return jsonify({"story": to_dict(story)})
+    return jsonify({"story": to_response_dict(story)})
 
   @stories.route("/<user_id>/<story_id>")
   class story_controller(MethodView):
@@ -116,7 +112,7 @@ class stories_controller(MethodView):
       """
       try:
           story = stories_service.get_story_by_id(story_id)
-          return jsonify({"story": to_dict(story)})
+          return jsonify({"story": to_response_dict(story)})
       except ValueError as ve:
           return jsonify({"error": str(ve)}), 404
       except Exception as e:
@@ -141,27 +137,69 @@ class stories_controller(MethodView):
             ValueError: If no story is found with the specified identifier or the provided data is invalid.
             Exception: If an error occurs while updating the story.
         """
-      image_base64 = story_data.get('cover')
-
-      # Decode the cover image and save it to the server
-      image_url = None
-      if image_base64:
-        image_data = base64.b64decode(image_base64.split(',')[1])
-        image_filename = f"{story_id}.png"
-        image_path = os.path.join('static', 'images', image_filename)
-        with open(image_path, 'wb') as f:
-          f.write(image_data)
-        image_url = f"/static/images/{image_filename}"
-      
-      story_data['cover'] = image_url
       try:
-        updated_story = stories_service.update_story(story_id, story_data)
-        return jsonify({"story": to_dict(updated_story)})
+        previous_cover = None
+        with release_on_error() as uploaded:
+          if 'cover' in story_data:
+            cover = story_data['cover']
+            if not cover:
+              # Remove the cover
+              previous_cover = stories_service.get_story_by_id(story_id).cover
+              story_data['coverInfo'] = None
+            elif cover.startswith('data:'):
+              # Legacy clients send the cover as a base64 data url
+              previous_cover = stories_service.get_story_by_id(story_id).cover
+              story_data['cover'], story_data['coverInfo'] = save_data_url(cover)
+              uploaded.append(story_data['cover'])
+            else:
+              # The url of the stored cover, uploaded with PUT /stories/<user_id>/<story_id>/cover
+              del story_data['cover']
+
+          updated_story = stories_service.update_story(story_id, story_data)
+        discard_replaced(previous_cover)
+        return jsonify({"story": to_response_dict(updated_story)})
+      except upload_too_large as e:
+        return jsonify({"error": str(e)}), 413
       except ValueError as ve:
         return jsonify({"error": str(ve)}), 400
       except Exception as e:
         return jsonify({"error": str(e)}), 500
       
+    @stories.route("/<user_id>/<story_id>/cover", methods=['PUT'])
+    @jwt_required
+    def upload_cover(story_id: str, user_id: str):
+      """
+        Upload the cover of a story, sent as the raw body or as the "file" field of a multipart form.
+
+        The image is streamed to the asset store under the hash of its content, so the
+        story updates only carry its url and a cover uploaded again is not copied.
+
+        Args:
+            story_id (str): The identifier of the story.
+            user_id (str): The identifier of the user who owns the story.
+
+        Returns:
+            dict: A dictionary containing the updated story with the url and metadata of its cover.
+
+        Raises:
+            ValueError: If no story is found with the specified identifier or the upload is not a valid image.
+            Exception: If an error occurs while storing the cover.
+      """
+      try:
+        story = stories_service.get_story_by_id(story_id)
+        with release_on_error() as uploaded:
+          cover_url, info = save_image(upload_stream(request))
+          uploaded.append(cover_url)
+          updated_story = stories_service.update_story(story_id, {"cover": cover_url, "coverInfo": info})
+        discard_replaced(story.cover)
+        return jsonify({"story": to_response_dict(updated_story)})
+      except upload_too_large as e:
+        return jsonify({"error": str(e)}), 413
+      except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+      except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
     @stories.response(status_code=200)
     @jwt_required
     def delete(self, story_id:str, user_id:str,):
@@ -173,17 +211,17 @@ class stories_controller(MethodView):
             user_id (str): The identifier of the user who owns the story.
 
         Returns:
-            dict: A dictionary containing a success message if the story is deleted successfully.
+            dict: A dictionary containing a success message and the number of deleted stories, pages, choices and images.
         
         Raises:
             ValueError: If no story is found with the specified identifier.
             Exception: If an error occurs while deleting the story.
         """
       try:
-        success = stories_service.delete_story(story_id)
-        if not success:
+        deleted = stories_service.delete_story(story_id)
+        if not deleted:
             return jsonify({"error": "Story not found"}), 404
-        return jsonify({"message": "Story successfully deleted"}), 200
+        return jsonify({"message": "Story successfully deleted", "deleted": deleted}), 200
       except ValueError as ve:
         return jsonify({"error": str(ve)}), 404
       except Exception as e:
@@ -205,37 +243,15 @@ class stories_controller(MethodView):
             Exception: If an error occurs while creating the zip file.
       """
       try:
-        memory_file = io.BytesIO()
-
-        with zipfile.ZipFile(memory_file, 'w') as zf:
-          story = stories_service.get_full_story_by_id(story_id)
-          if not story:
-            raise ValueError('Story not found')
-            
-          # Add story data to the zip
-          story_data = json.dumps(to_dict(story), default=str)
-          zf.writestr('story.json', story_data)
-          
-          # Add story cover to the zip
-          if story.cover != None and story.cover != "":
-            cover_path = "." + story.cover
-            if os.path.exists(cover_path):
-              zf.write(cover_path, arcname=f"{story.cover}")
-
-          # Add page images to the zip
-          for page in story.pages:
-            if page.image != None and page.image != "":
-              image_path = "." + page.image
-              if os.path.exists(image_path):
-                zf.write(image_path, arcname=f"{page.image}")
-
-        memory_file.seek(0)
-
-        return send_file(
-          memory_file,
+        story = stories_service.get_full_story_by_id(story_id)
+        if not story:
+          raise ValueError('Story not found')
+
+        # The archive is sent while it is written
+        return Response(
+          stream_with_context(stream_story_archive(story)),
           mimetype='application/zip',
-          as_attachment=True,
-          download_name=f'story_{story_id}.ariane'
+          headers={"Content-Disposition": f"attachment; filename=story_{story_id}.ariane"},
         )
       except ValueError as e:
         return jsonify({"error": str(e)}), 404
@@ -247,109 +263,42 @@ class stories_controller(MethodView):
       """
         Import a story from a zip file.
 
+        The archive is checked before anything is written. With ?dry_run=1, only the
+        validation report is returned.
+
         Returns:
-            dict: A success message if the story is imported successfully.
+            dict: A success message if the story is imported successfully, or the validation report.
         
         Raises:
-            ValueError: If no story is found in the zip file.
+            ValueError: If no story is found in the zip file or the archive is invalid.
             Exception: If an error occurs while importing the story.
       """
+      try:
+        check_content_length(request, IMPORT_MAX_BYTES, "archive")
+      except upload_too_large as e:
+        return jsonify({"error": str(e)}), 413
       if 'file' not in request.files:
         return jsonify({"error": "No file part in the request"}), 400
       
       file = request.files['file']
       if file and file.filename.endswith('.ariane'):
+        # The archive is spooled to disk and read member by member
+        fd, path = tempfile.mkstemp(suffix=".ariane")
         try:
-          memory_file = io.BytesIO(file.read())
-
-          with zipfile.ZipFile(memory_file, 'r') as zf:
-            story_data = zf.read('story.json')
-            story_dict = json.loads(story_data)
-
-            story = stories_service.create_story(to_entity(story_dict))
-
-            if story.cover:
-              cover_path = '/'.join(story_dict["cover"].split('/')[1:-1])
-              cover_filename = story_dict["cover"].split('/')[-1]
-              cover_extension = cover_filename.split('.')[1]
-
-              try:
-                # Lire l'image de l'archive
-                image_data = zf.read(f'{cover_path}/{cover_filename}')
-                
-                # Déterminer le nouveau nom de fichier
-                new_cover_filename = f"{story.id}.{cover_extension}"
-
-                # Déterminer le chemin du nouveau fichier
-                new_cover_path = f'{cover_path}/{new_cover_filename}'
-
-                # Sauvegarder l'image renommée
-                with open(new_cover_path, 'wb') as image_file:
-                  image_file.write(image_data)
-
-                # Mettre à jour la référence de l'image dans l'objet story
-                story.cover = f'/{new_cover_path}'
-                stories_service.update_story(story.id, to_dict(story))
-              except KeyError:
-                print(f"Image {cover_filename} not found in the archive")
-
-            if "pages" in story_dict and story_dict["pages"]:
-              pages = [page for page in story_dict["pages"]]
-              first_page = next((page for page in pages if page["first"]), None)
-
-              def save_next_page(current_page):
-                if current_page:
-                  current_page["storyId"] = story.id
-                  choices = current_page.get("choices", [])
-                  current_page.pop("choices")
-                
-                  page = pages_service.create_page(page_to_entity(current_page))
-                  if page.image:
-                    image_path = '/'.join(page.image.split('/')[1:-1])
-                    image_filename = page.image.split('/')[-1]
-                    image_extension = image_filename.split('.')[1]
-                    try:
-                      # Lire l'image de l'archive
-                      image_data = zf.read(f'{image_path}/{image_filename}')
-                      
-                      # Déterminer le nouveau nom de fichier
-                      new_image_filename = f"{page.id}.{image_extension}"
-
-                      # Déterminer le chemin du nouveau fichier
-                      new_image_path = f'{image_path}/{new_image_filename}'
-
-                      # Sauvegarder l'image renommée
-                      with open(new_image_path, 'wb') as image_file:
-                        image_file.write(image_data)
-
-                      # Mettre à jour la référence de l'image dans l'objet story
-                      page.image = f'/{new_image_path}'
-                      pages_service.update_page(page.id, page_to_dict(page))
-                    except KeyError:
-                      print(f"Image {image_filename} not found in the archive")
-                    
-                  if len(choices) > 0:
-                    for current_choice in choices:
-                      send_to_page = next((page for page in pages if page["id"] == current_choice["sendToPageId"]), None)
-                      if send_to_page:
-                        send_to_page["storyId"] = story.id
-                        send_to_page["previousPageId"] = page.id
-
-                        next_page = save_next_page(send_to_page)
-                        if next_page:
-                          current_choice["pageId"] = page.id
-                          current_choice["sendToPageId"] = next_page.id
-                          try:
-                            choices_service.create_choice(choice_to_entity(current_choice))
-                          except TypeError as e:
-                            print(f"Error creating choice: {e}")
-                  return page
-              save_next_page(first_page)
-          return jsonify({"message": "Story imported successfully"}), 200
+          with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(file.stream, f, 1024 * 1024)
+          if request.args.get("dry_run", "").lower() in ("1", "true"):
+            return jsonify({"report": stories_service.validate_archive(path)}), 200
+          story, imported = stories_service.import_story(path)
+          return jsonify({"message": "Story imported successfully", "storyId": story.id, "imported": imported}), 200
+        except archive_invalid as e:
+          return jsonify({"error": str(e), "report": e.report}), 400
         except ValueError as ve:
           return jsonify({"error": str(ve)}), 400
         except Exception as e:
           return jsonify({"error": str(e)}), 500
+        finally:
+          os.remove(path)
 
       return jsonify({"error": "Invalid file format"}), 400
       
\ No newline at end of file
@@ -3,16 +3,16 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
 
 from bson.objectid import ObjectId
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
+from pymongo import ASCENDING, IndexModel, UpdateOne
 
-from configs.config_database import mongodb_uri 
+from utils.database import get_db
+from utils.images import image_info
+from utils.pagination import PAGE_DEFAULT_LIMIT, KEYSET_SORT, find_page, keyset_filter
+from utils.queries import by_id, stories_of_user
 from .story import Story
 from .story_mapper import to_entity, to_dict
-
-# Create a new client and connect to the MongoDB server
-client = MongoClient(mongodb_uri, server_api=ServerApi('1'))
-db = client["ariane"]
+from .story_graph import load_story_graph, story_graphs
+from .story_counters import COUNTERS
 
 class stories_repository:
   """
@@ -21,31 +21,50 @@ class stories_repository:
   This repository provides methods for interacting with the database
   to perform CRUD (Create, Read, Update, Delete) operations on stories.
   """
+  indexes = [
+    IndexModel([("userId", ASCENDING), ("_id", ASCENDING)], name="userId_id"),
+  ]
+  # Queries issued by this repository, built with the same utils.queries filters, checked with explain() by utils.indexes
+  queries = [
+    {"filter": stories_of_user(ObjectId())},
+    {"filter": keyset_filter(stories_of_user(ObjectId()), ObjectId()), "sort": KEYSET_SORT},
+    {"filter": by_id(ObjectId())},
+  ]
+
   def __init__(self):
     """
     Initialize a new stories_repository object.
 
-    This constructor creates an instance of MongoClient to connect to the MongoDB server
-    and selects the database named "ariane".
+    The collection is resolved through the shared MongoDB client on every access,
+    so a repository created before a fork keeps working in the worker processes.
+    """
+    self.collection_name = "stories"
+
+  @property
+  def collection(self):
     """
-    self.collection = db["stories"]
+    Return the stories collection of the shared MongoDB client.
+    """
+    return get_db()[self.collection_name]
   
-  def get_all(self, user_id:str) -> list[Story]:
+  def get_all(self, user_id:str, limit:int=PAGE_DEFAULT_LIMIT, after:str=None) -> tuple[list[Story], str]:
     """
-    Retrieve all stories associated with a user.
+    Retrieve a page of the stories associated with a user, in creation order.
 
     Args:
         user_id (str): The identifier of the user whose stories are to be retrieved.
+        limit (int): The maximum number of stories returned.
+        after (str, optional): The cursor returned with the previous page.
 
     Returns:
-        list[Story]: A list containing the Story objects associated with the specified user.
-    
+        tuple[list[Story], str]: The Story objects, and the cursor of the next page or None on the last page.
+
     Raises:
         Exception: If an error occurs while retrieving the stories.
     """
     try:
-      stories_collection = self.collection.find({"userId": ObjectId(user_id)})
-      return [to_entity(story) for story in stories_collection]
+      stories_collection, cursor = find_page(self.collection, stories_of_user(user_id), limit, after)
+      return [to_entity(story) for story in stories_collection], cursor
     except Exception as e:
       raise Exception(f"Failed to get stories: {e}") from e
   
@@ -64,7 +83,7 @@ class stories_repository:
         Exception: If an error occurs while retrieving the story.
     """
     try:
-      story = self.collection.find_one({"_id": ObjectId(story_id)})
+      story = self.collection.find_one(by_id(story_id))
       if not story:
         raise ValueError(f"story not found.")
       return to_entity(story)
@@ -73,95 +92,34 @@ class stories_repository:
   
 
   def get_full_story_by_id(self, story_id: str) -> Story:
+    """
+    Retrieve a story with all its pages and their choices.
+
+    Args:
+        story_id (str): The identifier of the story to retrieve.
+
+    Returns:
+        Story: The Story object with its pages and choices.
+
+    Raises:
+        ValueError: If no story is found with the specified identifier.
+        Exception: If an error occurs while retrieving the story.
+    """
     try:
-      story_id = ObjectId(story_id)
-      
-      pipeline = [
-        {"$match": {"_id": story_id}},
-        {"$lookup": {
-          "from": "pages",
-          "localField": "_id",
-          "foreignField": "storyId",
-          "as": "pages"
-        }},
-        {"$unwind": {"path": "$pages", "preserveNullAndEmptyArrays": True}},
-        {"$lookup": {
-          "from": "choices",
-          "localField": "pages._id",
-          "foreignField": "pageId",
-          "as": "pages.choices"
-        }},
-        {"$group": {
-          "_id": "$_id",
-          "title": {"$first": "$title"},
-          "summary": {"$first": "$summary"},
-          "userId": {"$first": "$userId"},
-          "cover": {"$first": "$cover"},
-          "createdAt":{"$first": "$createdAt"},
-          "updatedAt":{"$first": "$updatedAt"},
-          "totalCharacters":{"$first": "$totalCharacters"},
-          "totalEnd":{"$first": "$totalEnd"},
-          "totalPages":{"$first": "$totalPages"},
-          "totalOpenNode":{"$first": "$totalOpenNode"},
-          "pages": {"$push": "$pages"}
-        }},
-        {"$project": {
-          "_id": 1,
-          "title": 1,
-          "summary": 1,
-          "cover":1,
-          "createdAt":1,
-          "updatedAt":1,
-          "totalCharacters":1,
-          "totalEnd":1,
-          "totalPages":1,
-          "totalOpenNode":1,
-          "userId": 1,
-          "pages": {
-            "$map": {
-              "input": "$pages",
-              "as": "page",
-              "in": {
-                "_id": "$$page._id",
-                "title": "$$page.title",
-                "text": "$$page.text",
-                "end": "$$page.end",
-                "first": "$$page.first",
-                "totalCharacters": "$$page.totalCharacters", 
-                "previousPageId": "$$page.previousPageId",
-                "image":"$$page.image",
-                "choices": {
-                  "$map": {
-                    "input": "$$page.choices",
-                    "as": "choice",
-                    "in": {
-                      "_id": "$$choice._id",
-                      "title": "$$choice.title",
-                      "pageId": "$$choice.pageId",
-                      "sendToPageId": "$$choice.sendToPageId",
-                    }
-                  }
-                }
-              }
-            }
-          }
-        }}
-      ]
-      
-      stories = list(self.collection.aggregate(pipeline))
-      story = stories[0]
+      story = load_story_graph(story_id)
       if not story:
         raise ValueError("Story not found")
       return to_entity(story)
     except Exception as e:
       raise Exception(f"An error occurred while retrieving the full story with id {story_id}: {e}") from e
   
-  def delete_story(self, story_id:str) ->bool:
+  def delete_story(self, story_id:str, session=None) ->bool:
     """
     Delete a story by its identifier.
 
     Args:
         story_id (str): The identifier of the story to delete.
+        session (ClientSession, optional): The session of the current transaction.
 
     Returns:
         bool: True if the story is successfully deleted, False otherwise.
@@ -171,19 +129,20 @@ class stories_repository:
         Exception: If an error occurs while deleting the story.
     """
     try:
-      result = self.collection.delete_one({"_id": ObjectId(story_id)})
+      result = self.collection.delete_one(by_id(story_id), session=session)
       if result.deleted_count != 1:
         raise ValueError(f"story not found.")
       return result.deleted_count == 1
     except Exception as e:
       raise Exception(f"An error occurred while delete story whit id {story_id}: {e}") from e
   
-  def create_story(self, s: Story) -> Story:
+  def create_story(self, s: Story, session=None) -> Story:
     """
     Create a new story.
 
     Args:
         s (Story): The Story object containing the information of the new story to create.
+        session (ClientSession, optional): The session of the current transaction.
 
     Returns:
         Story: The created Story object.
@@ -197,12 +156,16 @@ class stories_repository:
     if not s.title :
       raise ValueError("Story title cannot be empty.")
   
+    # A new story has no page, its counters are then maintained by the page and choice writes
+    s.total_characters = s.total_end = s.total_pages = s.total_open_node = 0
     story_data = to_dict(s)
     story_data["userId"] = ObjectId(story_data["userId"])
     story_data.pop("id", None)
     story_data.pop("pages", None)
+    if s.id:
+      story_data["_id"] = ObjectId(s.id)
     try:
-      result = self.collection.insert_one(story_data)
+      result = self.collection.insert_one(story_data, session=session)
 
       if result.inserted_id:
         s.id = str(result.inserted_id)
@@ -236,13 +199,149 @@ class stories_repository:
     story_data.pop("id", None)
     story_data.pop("userId", None)
     story_data.pop("pages", None)
+    # The counters are only changed by increment_counters, so concurrent page writes are not overwritten
+    for key in COUNTERS:
+      story_data.pop(key, None)
     try:
       result = self.collection.update_one(
-        {"_id": ObjectId(story.id)},
+        by_id(story.id),
         {"$set": story_data}
       )
-      if result.modified_count == 0:
+      story_graphs.invalidate(story.id)
+      if result.matched_count == 0:
         raise Exception("Failed to update story.")
       return story
     except Exception as e:
       raise Exception(f"An error occurred while updating the story whit id {story.id}: {e}") from e
+
+  def backfill_cover_info(self, force:bool=False, batch_size:int=500) -> tuple[int, int]:
+    """
+    Record the metadata of the covers uploaded before it was stored on the stories.
+
+    Args:
+        force (bool): Read the metadata of every cover again.
+        batch_size (int): The maximum number of stories updated by a single bulk write.
+
+    Returns:
+        tuple[int, int]: The number of stories updated and of covers not found.
+    
+    Raises:
+        Exception: If an error occurs while updating the stories.
+    """
+    query = {"cover": {"$nin": [None, ""]}}
+    if not force:
+      query["coverInfo"] = None
+    try:
+      updated = missing = 0
+      requests = []
+      story_ids = []
+      for story in self.collection.find(query, {"cover": 1}):
+        try:
+          info = image_info(story["cover"])
+        except FileNotFoundError:
+          missing += 1
+          continue
+        requests.append(UpdateOne({"_id": story["_id"]}, {"$set": {"coverInfo": info}}))
+        story_ids.append(story["_id"])
+        if len(requests) >= batch_size:
+          updated += self.collection.bulk_write(requests, ordered=False).modified_count
+          requests = []
+      if requests:
+        updated += self.collection.bulk_write(requests, ordered=False).modified_count
+      for story_id in story_ids:
+        story_graphs.invalidate(story_id)
+      return updated, missing
+    except Exception as e:
+      raise Exception(f"An error occurred while backfilling the covers metadata: {e}") from e
+
+  def increment_counters(self, story_id:str, deltas:dict, session=None) -> None:
+    """
+    Apply the changes of a page or choice write to the counters of a story with a single $inc.
+
+    Args:
+        story_id (str): The identifier of the story.
+        deltas (dict): The delta of each counter, see story_counters.page_counters.
+        session (ClientSession, optional): The session of the current transaction.
+
+    Raises:
+        Exception: If an error occurs while updating the story.
+    """
+    deltas = {key: value for key, value in deltas.items() if value}
+    if not deltas:
+      return
+    try:
+      self.collection.update_one(by_id(story_id), {"$inc": deltas}, session=session)
+    except Exception as e:
+      raise Exception(f"Failed to update the counters of story {story_id}: {e}") from e
+
+  def reset_counters(self, story_id:str, session=None) -> None:
+    """
+    Set the counters of a story to zero, e.g. once all its pages are deleted.
+
+    Args:
+        story_id (str): The identifier of the story.
+        session (ClientSession, optional): The session of the current transaction.
+
+    Raises:
+        Exception: If an error occurs while updating the story.
+    """
+    try:
+      self.collection.update_one(by_id(story_id), {"$set": dict.fromkeys(COUNTERS, 0)}, session=session)
+    except Exception as e:
+      raise Exception(f"Failed to reset the counters of story {story_id}: {e}") from e
+
+  def recompute_counters(self, batch_size:int=1000) -> int:
+    """
+    Recompute the counters of every story from its pages and choices.
+
+    The counters of all the stories are computed by a single aggregation on
+    the pages, sorted by story, and written while walking the stories in the
+    same order, so the stories without pages are reset without keeping the
+    list of stories in memory.
+
+    Args:
+        batch_size (int): The maximum number of stories updated by a single bulk write.
+
+    Returns:
+        int: The number of stories updated.
+
+    Raises:
+        Exception: If an error occurs while recomputing the counters.
+    """
+    pipeline = [
+      {"$match": {"storyId": {"$type": "objectId"}}},
+      {"$project": {"storyId": 1, "end": 1, "totalCharacters": 1}},
+      {"$lookup": {"from": "choices", "localField": "_id", "foreignField": "pageId", "as": "choices"}},
+      {"$group": {
+        "_id": "$storyId",
+        "totalCharacters": {"$sum": {"$ifNull": ["$totalCharacters", 0]}},
+        "totalEnd": {"$sum": {"$cond": [{"$eq": ["$end", True]}, 1, 0]}},
+        "totalPages": {"$sum": 1},
+        "totalOpenNode": {"$sum": {"$cond": [{"$and": [{"$ne": ["$end", True]}, {"$eq": [{"$size": "$choices"}, 0]}]}, 1, 0]}},
+      }},
+      {"$sort": {"_id": 1}},
+    ]
+    try:
+      updated = 0
+      requests = []
+      counters = get_db()["pages"].aggregate(pipeline, allowDiskUse=True)
+      counted = next(counters, None)
+      for story in self.collection.find({}, {"_id": 1}).sort("_id", ASCENDING):
+        # Skip the pages of deleted stories
+        while counted is not None and counted["_id"] < story["_id"]:
+          counted = next(counters, None)
+        if counted is not None and counted["_id"] == story["_id"]:
+          values = {key: counted[key] for key in COUNTERS}
+        else:
+          values = dict.fromkeys(COUNTERS, 0)
+        # totalPage was written instead of totalPages by former versions
+        requests.append(UpdateOne({"_id": story["_id"]}, {"$set": values, "$unset": {"totalPage": ""}}))
+        if len(requests) >= batch_size:
+          updated += self.collection.bulk_write(requests, ordered=False).matched_count
+          requests = []
+        story_graphs.invalidate(story["_id"])
+      if requests:
+        updated += self.collection.bulk_write(requests, ordered=False).matched_count
+      return updated
+    except Exception as e:
+      raise Exception(f"An error occurred while recomputing the story counters: {e}") from e
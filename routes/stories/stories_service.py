@@ -1,5 +1,17 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+
+from utils.database import run_in_transaction
+from utils.pagination import PAGE_DEFAULT_LIMIT
+from utils.uploads import retain_images, release_images
+
 from .stories_repository import stories_repository
+from .story_import import story_archive, scan_archive, import_story
 from .story import Story
+from .story_graph import story_graphs
+from routes.pages.pages_repository import pages_repository
+from routes.choices.choices_repository import choices_repository
 
 class stories_service:
   """
@@ -13,25 +25,30 @@ class stories_service:
     Initialize a new stories_service object.
 
     This constructor creates an instance of stories_repository to interact
-    with the database.
+    with the database, and the pages and choices repositories used to delete
+    a story with its content.
     """
     self.repository = stories_repository()
+    self.pages_repository = pages_repository()
+    self.choices_repository = choices_repository()
   
-  def get_all(self, user_id:str) -> list[dict]:
+  def get_all(self, user_id:str, limit:int=PAGE_DEFAULT_LIMIT, after:str=None) -> tuple[list[Story], str]:
     """
-    Retrieve all stories associated with a user.
+    Retrieve a page of the stories associated with a user.
 
     Args:
       user_id (str): The user's identifier.
+      limit (int): The maximum number of stories returned.
+      after (str, optional): The cursor returned with the previous page.
 
     Returns:
-      ist[dict]: A list containing the information of all the user's stories.
+      tuple[list[Story], str]: The user's stories, and the cursor of the next page or None on the last page.
     
     Raises:
       Exception: If an error occurs while fetching the stories.
     """
     try:
-      return self.repository.get_all(user_id)
+      return self.repository.get_all(user_id, limit, after)
     except Exception as e:
       raise Exception(f"Failed to fetch stories: {e}") from e
   
@@ -48,8 +65,44 @@ class stories_service:
     Raises:
       ValueError: If any of the required values to create the story is missing.
     """
-    return self.repository.create_story(s)
+    story = self.repository.create_story(s)
+    retain_images([story.cover])
+    return story
   
+  def import_story(self, path:str) -> tuple[Story, dict]:
+    """
+    Import a story exported as an .ariane archive, with its pages, choices and images.
+
+    Args:
+      path (str): The path of the archive.
+
+    Returns:
+      tuple[Story, dict]: The created story, and the number of pages, choices and images imported.
+
+    Raises:
+      archive_invalid: If the archive fails its validation, nothing being written.
+      ValueError: If the file is not an .ariane archive.
+      Exception: If an error occurs while writing the story.
+    """
+    with story_archive(path) as archive:
+      return import_story(archive)
+
+  def validate_archive(self, path:str) -> dict:
+    """
+    Check an .ariane archive without importing it.
+
+    Args:
+      path (str): The path of the archive.
+
+    Returns:
+      dict: The validation report, with the "valid" flag, the "errors" and "warnings" found and the number of pages, choices and images.
+
+    Raises:
+      ValueError: If the file is not an .ariane archive.
+    """
+    with story_archive(path) as archive:
+      return scan_archive(archive)[1]
+
   def get_story_by_id(self, story_id:str) -> Story:
     """
     Retrieve a story by its identifier.
@@ -97,24 +150,26 @@ class stories_service:
     existing_story.title = story_data.get('title', existing_story.title)
     existing_story.summary = story_data.get('summary', existing_story.summary)
     existing_story.cover = story_data.get('cover', existing_story.cover)
+    existing_story.cover_info = story_data.get('coverInfo', existing_story.cover_info)
     existing_story.created_at = story_data.get('createdAt', existing_story.created_at)
     existing_story.updated_at = story_data.get('updatedAt', existing_story.updated_at)
-    existing_story.total_characters = story_data.get('totalCharacters', existing_story.total_characters)
-    existing_story.total_end = story_data.get('totalEnd', existing_story.total_end)
-    existing_story.total_pages = story_data.get('totalPages', existing_story.total_pages)
-    existing_story.total_open_node = story_data.get('totalOpenNode', existing_story.total_open_node)
+    # totalCharacters, totalEnd, totalPages and totalOpenNode are maintained by the page and choice writes
 
     return self.repository.update_story(existing_story)
   
-  def delete_story(self, story_id:str) -> bool:
+  def delete_story(self, story_id:str) -> dict:
     """
-    Delete a story by its identifier.
+    Delete a story by its identifier with its pages, choices and images.
+
+    Choices and pages are removed with one delete_many each, in a transaction
+    when the deployment supports it. Once the documents are gone, their images
+    are released and the ones no other story uses are deleted in the background.
 
     Args:
       story_id (str): The identifier of the story to delete.
 
     Returns:
-      bool: True if the story is successfully deleted, False otherwise.
+      dict: The number of stories, pages and choices deleted and of unused images scheduled for deletion.
     
     Raises:
       ValueError: If no story is found with the specified identifier.
@@ -122,6 +177,21 @@ class stories_service:
     existing_story = self.repository.get_story_by_id(story_id)
     if not existing_story:
         raise ValueError(f"Story with id {story_id} not found.")
-    return self.repository.delete_story(story_id)
-  
-  
+
+    def delete(session):
+      page_ids, images = self.pages_repository.get_page_ids_and_images(story_id, session=session)
+      deleted_choices = self.choices_repository.delete_all_by_page_ids(page_ids, session=session)
+      deleted_pages = self.pages_repository.delete_all(story_id, session=session)
+      self.repository.delete_story(story_id, session=session)
+      return deleted_choices, deleted_pages, images
+    deleted_choices, deleted_pages, images = run_in_transaction(delete)
+    story_graphs.invalidate(story_id)
+
+    images.append(existing_story.cover)
+
+    return {
+      "stories": 1,
+      "pages": deleted_pages,
+      "choices": deleted_choices,
+      "images": release_images(images),
+    }
@@ -1,5 +1,5 @@
 class Story:
-  def __init__(self, id: str="", user_id: str="", created_at:str="", updated_at:str="", total_characters:int=0, total_end:int=0, total_pages:int=0, total_open_node:int=0, title: str="", summary: str="", cover: str="") -> None:
+  def __init__(self, id: str="", user_id: str="", created_at:str="", updated_at:str="", total_characters:int=0, total_end:int=0, total_pages:int=0, total_open_node:int=0, title: str="", summary: str="", cover: str="", cover_info:dict=None) -> None:
     self.id = id
     self.user_id = user_id
     self.created_at = created_at
@@ -11,6 +11,8 @@ class Story:
     self.title = title
     self.summary = summary
     self.cover = cover
+    # width, height, bytes and sha256 of the cover, recorded at upload
+    self.cover_info = cover_info
   
   def __repr__(self) -> str:
     return f"{self.id} => ({self.title} {self.summary})"
\ No newline at end of file
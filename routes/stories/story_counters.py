@@ -0,0 +1,37 @@
+# Counters of a story, maintained by the server from its pages and choices:
+# the sum of the totalCharacters of the pages, the number of end pages, the
+# number of pages and the number of pages neither being an end nor having a choice yet
+COUNTERS = ("totalCharacters", "totalEnd", "totalPages", "totalOpenNode")
+
+def page_counters(end:bool, total_characters:int, has_choices:bool, sign:int=1) -> dict:
+  """
+  Return what a page adds to the counters of its story.
+
+  Args:
+      end (bool): Whether the page is an end.
+      total_characters (int): The number of characters of the page.
+      has_choices (bool): Whether the page has at least one choice.
+      sign (int): -1 to get what the page removes from the counters when it is deleted.
+
+  Returns:
+      dict: The delta of each counter.
+  """
+  return {
+    "totalPages": sign,
+    "totalCharacters": sign * (total_characters or 0),
+    "totalEnd": sign * int(bool(end)),
+    "totalOpenNode": sign * int(not end and not has_choices),
+  }
+
+def counters_delta(before:dict, after:dict) -> dict:
+  """
+  Return the difference between the counters of a page after and before a change.
+
+  Args:
+      before (dict): The page_counters of the page before the change.
+      after (dict): The page_counters of the page after the change.
+
+  Returns:
+      dict: The delta of each counter.
+  """
+  return {key: after[key] - before[key] for key in COUNTERS}
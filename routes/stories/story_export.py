@@ -0,0 +1,121 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+
+import json
+import time
+import zipfile
+
+from utils.asset_store import get_asset_store
+
+from .story import Story
+from .story_mapper import to_dict
+
+CHUNK_SIZE = 64 * 1024
+# Already compressed formats, stored as is
+STORED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif")
+
+class _chunk_sink:
+  """
+  Unseekable file collecting the bytes written by zipfile until they are sent.
+
+  zipfile writes a data descriptor after every member when its output cannot
+  seek, so the archive is produced in a single pass.
+  """
+  def __init__(self):
+    self.chunks = []
+    self.size = 0
+
+  def write(self, data) -> int:
+    self.chunks.append(bytes(data))
+    self.size += len(data)
+    return len(data)
+
+  def flush(self) -> None:
+    pass
+
+  def drain(self, min_size:int=CHUNK_SIZE):
+    """
+    Yield the collected bytes once there are at least min_size of them.
+    """
+    if self.size and self.size >= min_size:
+      data = b"".join(self.chunks)
+      self.chunks = []
+      self.size = 0
+      yield data
+
+def _write_story_json(zf:zipfile.ZipFile, story:Story, sink:_chunk_sink):
+  """
+  Write story.json one page at a time, yielding the bytes of the archive produced so far.
+  """
+  story_dict = to_dict(story)
+  pages = story_dict.pop("pages", None) or []
+  # The size is unknown until the end, so the member is written in the zip64 format
+  with zf.open("story.json", "w", force_zip64=True) as f:
+    # The fields of the story followed by its pages
+    f.write(json.dumps(story_dict, default=str)[:-1].encode())
+    f.write(b', "pages": [' if story_dict else b'"pages": [')
+    for index, page in enumerate(pages):
+      if index:
+        f.write(b", ")
+      f.write(json.dumps(page, default=str).encode())
+      yield from sink.drain()
+    f.write(b"]}")
+
+def _write_asset(zf:zipfile.ZipFile, key:str, sink:_chunk_sink):
+  """
+  Stream an asset of the store to the archive under its key without the leading slash, yielding the bytes produced.
+
+  Missing assets and assets already added, e.g. an image shared by several pages, are skipped.
+
+  Raises:
+      Exception: If the asset changed while it was copied, so its member would not hold the announced bytes.
+  """
+  name = key.lstrip("/")
+  if name in zf.NameToInfo:
+    return
+  store = get_asset_store()
+  stat = store.stat(key)
+  if stat is None:
+    return
+  zinfo = zipfile.ZipInfo(name, date_time=time.localtime(stat["modified"])[:6])
+  zinfo.compress_type = zipfile.ZIP_STORED if name.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+  # The announced size lets zipfile switch to zip64 for files larger than 4GB
+  zinfo.file_size = stat["bytes"]
+  # Only an asset deleted since its stat is skipped, once a member is started the archive cannot drop it
+  try:
+    source = store.open(key)
+  except FileNotFoundError:
+    return
+  size = 0
+  with source, zf.open(zinfo, "w") as target:
+    for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+      size += len(chunk)
+      target.write(chunk)
+      yield from sink.drain()
+  if size != stat["bytes"]:
+    raise Exception(f"The asset {key} changed during the export: {size} bytes written instead of {stat['bytes']}.")
+
+def stream_story_archive(story:Story):
+  """
+  Produce the .ariane archive of a story while it is sent, without building it in memory.
+
+  The archive contains story.json, deflated, and the cover and page images,
+  stored without compression for PNG, JPEG and GIF files. Members and the
+  archive switch to the zip64 format when they exceed the zip limits.
+
+  Args:
+      story (Story): The story with its pages and choices.
+
+  Yields:
+      bytes: The successive parts of the archive.
+  """
+  sink = _chunk_sink()
+  with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+    yield from _write_story_json(zf, story, sink)
+    if story.cover:
+      yield from _write_asset(zf, story.cover, sink)
+    for page in story.pages:
+      if page.image:
+        yield from _write_asset(zf, page.image, sink)
+  yield from sink.drain(1)
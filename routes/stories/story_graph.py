@@ -0,0 +1,306 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+
+import random
+import threading
+
+import bson
+from bson.objectid import ObjectId
+
+from utils.database import get_db
+from utils.queries import by_id, pages_of_story, choices_of_story
+from utils.pagination import KEYSET_SORT
+from utils.cache import ttl_lru_cache, get_cache_backend
+
+# Size and time to live (in seconds) of the per-worker cache of story graphs
+STORY_CACHE_SIZE = int(os.environ.get("STORY_CACHE_SIZE", 128))
+STORY_CACHE_TTL = float(os.environ.get("STORY_CACHE_TTL", 60))
+
+# Channel on which the workers broadcast the stories they modify
+INVALIDATION_CHANNEL = "ariane:story:invalidate"
+
+STORY_FIELDS = {
+  "_id": 1, "title": 1, "summary": 1, "userId": 1, "cover": 1, "coverInfo": 1, "createdAt": 1, "updatedAt": 1,
+  "totalCharacters": 1, "totalEnd": 1, "totalPages": 1, "totalOpenNode": 1,
+}
+PAGE_FIELDS = {
+  "_id": 1, "title": 1, "text": 1, "end": 1, "first": 1, "totalCharacters": 1, "previousPageId": 1, "image": 1, "imageInfo": 1,
+}
+# The fields of the story outline, without the text of the pages
+OUTLINE_PAGE_FIELDS = {"_id": 1, "title": 1, "end": 1, "first": 1, "image": 1}
+CHOICE_FIELDS = {"_id": 1, "title": 1, "storyId": 1, "pageId": 1, "sendToPageId": 1}
+
+def load_pages_with_choices(story_id, db=None, fields:dict=PAGE_FIELDS, leading_choice_title:bool=False) -> list[dict]:
+  """
+  Load all the pages of a story with their choices.
+
+  Pages and choices both carry the storyId, so the whole graph is read with two
+  indexed queries and stitched together with a dict keyed by page id.
+
+  Args:
+      story_id (str | ObjectId): The identifier of the story.
+      db (Database, optional): The database to read from, the shared one by default.
+      fields (dict): The projection applied to the pages.
+      leading_choice_title (bool): Whether to set on each page the "choiceTitle" of the first choice leading to it.
+
+  Returns:
+      list[dict]: The page documents, each with a "choices" list.
+  """
+  db = db if db is not None else get_db()
+  story_id = ObjectId(story_id)
+
+  pages = list(db["pages"].find(pages_of_story(story_id), fields).sort(KEYSET_SORT))
+  pages_by_id = {}
+  for page in pages:
+    page["choices"] = []
+    pages_by_id[page["_id"]] = page
+
+  for choice in db["choices"].find(choices_of_story(story_id), CHOICE_FIELDS).sort(KEYSET_SORT):
+    page = pages_by_id.get(choice["pageId"])
+    if page is not None:
+      page["choices"].append(choice)
+    if leading_choice_title:
+      target = pages_by_id.get(choice.get("sendToPageId"))
+      if target is not None and "choiceTitle" not in target:
+        target["choiceTitle"] = choice.get("title")
+
+  return pages
+
+def load_story_graph(story_id, db=None) -> dict:
+  """
+  Load a story with all its pages and their choices.
+
+  Args:
+      story_id (str | ObjectId): The identifier of the story to load.
+      db (Database, optional): The database to read from, the shared one by default.
+
+  Returns:
+      dict: The story document with a "pages" list, each page having a "choices" list, or None if no story is found.
+  """
+  db = db if db is not None else get_db()
+
+  story = db["stories"].find_one(by_id(story_id), STORY_FIELDS)
+  if not story:
+    return None
+
+  story["pages"] = load_pages_with_choices(story["_id"], db)
+  return story
+
+class story_graph_cache:
+  """
+  Per-worker LRU cache of story graphs, backed by the shared cache tier.
+
+  A graph holds the story document and its pages, each page with its choices
+  and the title of the first choice leading to it. Repositories read from it,
+  and the services invalidate it once their writes of a story, a page or a
+  choice are committed, as a graph loaded before the commit would be stale.
+
+  Serialized graphs are stored in the shared tier under keys containing the
+  version of the story, which is incremented on every write. Invalidations are broadcast so each worker drops its own copy.
+  """
+  def __init__(self, maxsize:int=STORY_CACHE_SIZE, ttl:float=STORY_CACHE_TTL, backend=None):
+    """
+    Initialize a new story_graph_cache object.
+
+    Args:
+        maxsize (int): The maximum number of cached stories.
+        ttl (float): The number of seconds a graph is served before being reloaded.
+        backend (cache_backend, optional): The shared cache tier, the configured one by default.
+    """
+    self.graphs = ttl_lru_cache(maxsize, ttl, on_remove=self._forget_pages)
+    # Page id => story id of the cached graphs, to serve and invalidate by page
+    self.page_stories = {}
+    # Story id => [loads in progress, invalidations received since they started], so a graph
+    # loaded during a write is not cached. Entries are removed with the last load of a story.
+    self.loading = {}
+    self._lock = threading.Lock()
+    self.epoch = 0
+    self.backend = backend if backend is not None else get_cache_backend()
+    self.backend.subscribe(INVALIDATION_CHANNEL, self._drop)
+
+  def _forget_pages(self, story_id:str, graph:dict) -> None:
+    for page_id in graph["pages_by_id"]:
+      if self.page_stories.get(page_id) == story_id:
+        self.page_stories.pop(page_id, None)
+
+  def version(self, story_id:str) -> int:
+    """
+    Return the current version of a story in the shared cache tier.
+
+    A missing version starts at a random value, so keys written before a
+    restart of the cache server are never mistaken for current ones.
+
+    Args:
+        story_id (str): The identifier of the story.
+
+    Returns:
+        int: The version of the story.
+    """
+    key = f"ariane:story:{story_id}:version"
+    version = self.backend.get(key)
+    if version is None:
+      self.backend.add(key, random.randint(1, 2**31))
+      version = self.backend.get(key)
+    return int(version)
+
+  def _key(self, story_id:str, name:str) -> str:
+    return f"ariane:story:{story_id}:v{self.version(story_id)}:{name}"
+
+  def _load(self, story_id:str) -> dict:
+    """
+    Load the graph of a story from the shared cache tier, or from the database.
+    """
+    key = None
+    if self.backend.shared:
+      try:
+        key = self._key(story_id, "graph")
+        data = self.backend.get(key)
+        if data is not None:
+          document = bson.decode(data)
+          story, pages = document["story"], document["pages"]
+          return {"story": story, "pages": pages, "pages_by_id": {str(page["_id"]): page for page in pages}}
+      except Exception as e:
+        print(f"Failed to read story {story_id} from the cache: {e}")
+
+    db = get_db()
+    story = db["stories"].find_one(by_id(story_id), STORY_FIELDS)
+    pages = load_pages_with_choices(story_id, db, fields={**PAGE_FIELDS, "storyId": 1}, leading_choice_title=True)
+
+    if key is not None:
+      try:
+        self.backend.set(key, bson.encode({"story": story, "pages": pages}))
+      except Exception as e:
+        print(f"Failed to write story {story_id} to the cache: {e}")
+    return {
+      "story": story,
+      "pages": pages,
+      "pages_by_id": {str(page["_id"]): page for page in pages},
+    }
+
+  def get(self, story_id:str) -> dict:
+    """
+    Return the graph of a story, loading it on a cache miss.
+
+    The returned documents are shared between requests and must not be modified.
+
+    Args:
+        story_id (str): The identifier of the story.
+
+    Returns:
+        dict: The graph with the "story" document, the "pages" list and the "pages_by_id" index.
+    """
+    story_id = str(story_id)
+    graph = self.graphs.get(story_id)
+    if graph is not None:
+      return graph
+
+    with self._lock:
+      loading = self.loading.setdefault(story_id, [0, 0])
+      loading[0] += 1
+      generation = (self.epoch, loading[1])
+    try:
+      graph = self._load(story_id)
+    finally:
+      with self._lock:
+        loading = self.loading[story_id]
+        fresh = (self.epoch, loading[1]) == generation
+        loading[0] -= 1
+        if loading[0] == 0:
+          del self.loading[story_id]
+    if fresh:
+      self.graphs.set(story_id, graph)
+      for page_id in graph["pages_by_id"]:
+        self.page_stories[page_id] = story_id
+    return graph
+
+  def get_cached(self, story_id:str) -> dict:
+    """
+    Return the graph of a story if this worker has it cached, without loading anything.
+
+    Args:
+        story_id (str): The identifier of the story.
+
+    Returns:
+        dict: The graph, or None if it is not cached.
+    """
+    return self.graphs.get(str(story_id))
+
+  def get_page(self, page_id:str) -> dict:
+    """
+    Return a page from the cached graphs, without loading anything.
+
+    Args:
+        page_id (str): The identifier of the page.
+
+    Returns:
+        dict: The page document with its choices, or None if its story is not cached.
+    """
+    story_id = self.page_stories.get(str(page_id))
+    if story_id is None:
+      return None
+    graph = self.graphs.get(story_id)
+    if graph is None:
+      return None
+    return graph["pages_by_id"].get(str(page_id))
+
+  def _drop(self, story_id) -> None:
+    """
+    Drop the graph of a story from the cache of this worker.
+    """
+    story_id = str(story_id)
+    with self._lock:
+      loading = self.loading.get(story_id)
+      if loading is not None:
+        loading[1] += 1
+    self.graphs.delete(story_id)
+
+  def invalidate(self, story_id) -> None:
+    """
+    Drop the graph of a story in every worker and move it to a new version.
+
+    Args:
+        story_id (str): The identifier of the story.
+    """
+    if not story_id:
+      return
+    story_id = str(story_id)
+    self._drop(story_id)
+    try:
+      self.backend.incr(f"ariane:story:{story_id}:version")
+      self.backend.publish(INVALIDATION_CHANNEL, story_id)
+    except Exception as e:
+      print(f"Failed to broadcast the invalidation of story {story_id}: {e}")
+
+  def invalidate_page(self, page_id) -> None:
+    """
+    Drop the graph of the story containing a page.
+
+    Args:
+        page_id (str): The identifier of the page.
+    """
+    if not page_id:
+      return
+    story_id = self.page_stories.get(str(page_id))
+    if story_id is None and self.backend.shared:
+      # The story may be cached by another worker
+      page = get_db()["pages"].find_one(by_id(page_id), {"storyId": 1})
+      story_id = page.get("storyId") if page else None
+    if story_id is not None:
+      self.invalidate(story_id)
+
+  def clear(self) -> None:
+    """
+    Drop every graph cached by this worker.
+    """
+    self.epoch += 1
+    self.graphs.clear()
+
+  def stats(self) -> dict:
+    """
+    Return the counters of the cache.
+    """
+    return self.graphs.stats()
+
+# Shared by the repositories of the worker
+story_graphs = story_graph_cache()
@@ -0,0 +1,424 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+
+import json
+import zipfile
+
+from bson.objectid import ObjectId
+
+from utils.database import run_in_transaction
+from utils.queries import by_id, choices_of_story
+from utils.uploads import IMAGE_MAX_BYTES, save_image, retain_images, release_images
+
+from .story import Story
+from .story_mapper import to_entity
+from .stories_repository import stories_repository
+from .story_counters import COUNTERS, page_counters
+from .story_graph import story_graphs
+from routes.pages.page_mapper import to_entity as page_to_entity
+from routes.pages.pages_repository import pages_repository
+from routes.choices.choice import Choice
+from routes.choices.choices_repository import choices_repository
+
+try:
+  import ijson
+  from ijson.common import ObjectBuilder
+except ImportError:
+  ijson = None
+
+# Number of documents written by each insert_many
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", 500))
+# Limits of an imported archive, its size being the uncompressed one
+IMPORT_MAX_PAGES = int(os.environ.get("IMPORT_MAX_PAGES", 10000))
+IMPORT_MAX_BYTES = int(os.environ.get("IMPORT_MAX_BYTES", 1024 * 1024 * 1024))
+# Number of errors and of warnings listed in a validation report, the others are only counted
+REPORT_MAX_MESSAGES = 50
+
+class archive_invalid(ValueError):
+  """
+  Raised when an archive fails its validation, with the report.
+  """
+  def __init__(self, report:dict):
+    super().__init__("The archive is invalid: " + " ".join(report["errors"][:5]))
+    self.report = report
+
+class _validation_report:
+  """
+  Errors, which prevent the import, and warnings found while checking an archive.
+  """
+  def __init__(self):
+    self.errors = []
+    self.warnings = []
+    self.error_count = 0
+    self.warning_count = 0
+
+  def error(self, message:str) -> None:
+    self.error_count += 1
+    if len(self.errors) < REPORT_MAX_MESSAGES:
+      self.errors.append(message)
+
+  def warning(self, message:str) -> None:
+    self.warning_count += 1
+    if len(self.warnings) < REPORT_MAX_MESSAGES:
+      self.warnings.append(message)
+
+  def to_dict(self, **counts) -> dict:
+    return {
+      "valid": self.error_count == 0,
+      "errorCount": self.error_count,
+      "errors": self.errors,
+      "warningCount": self.warning_count,
+      "warnings": self.warnings,
+      **counts,
+    }
+
+class story_archive:
+  """
+  An .ariane archive read from disk member by member.
+
+  With the optional ijson package, story.json is parsed as a stream of events
+  so only one page is in memory at a time. Without it, story.json is loaded
+  once, but never the rest of the archive.
+  """
+  def __init__(self, path:str):
+    """
+    Initialize a new story_archive object.
+
+    Args:
+        path (str): The path of the archive.
+
+    Raises:
+        ValueError: If the file is not a zip archive with a story.json member.
+    """
+    try:
+      self.zip = zipfile.ZipFile(path)
+      self.zip.getinfo("story.json")
+    except (zipfile.BadZipFile, KeyError) as e:
+      raise ValueError("The file is not a valid .ariane archive.") from e
+    self._story = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self) -> None:
+    self.zip.close()
+
+  def _load(self) -> dict:
+    if self._story is None:
+      with self.zip.open("story.json") as f:
+        self._story = json.load(f)
+    return self._story
+
+  def story_fields(self) -> dict:
+    """
+    Return the fields of story.json except its pages.
+    """
+    if ijson is None:
+      return {key: value for key, value in self._load().items() if key != "pages"}
+    fields = {}
+    key = builder = None
+    with self.zip.open("story.json") as f:
+      for prefix, event, value in ijson.parse(f, use_float=True):
+        if prefix == "":
+          if builder is not None:
+            fields[key] = builder.value
+            builder = None
+          if event == "map_key":
+            key = value
+            builder = None if value == "pages" else ObjectBuilder()
+        elif builder is not None:
+          builder.event(event, value)
+    return fields
+
+  def pages(self):
+    """
+    Iterate over the pages of story.json.
+    """
+    if ijson is None:
+      yield from self._load().get("pages") or []
+      return
+    with self.zip.open("story.json") as f:
+      yield from ijson.items(f, "pages.item", use_float=True)
+
+  def member_size(self, url:str) -> int:
+    """
+    Return the uncompressed size of a member of the archive from its url, None if it is missing.
+    """
+    info = self.zip.NameToInfo.get(url.lstrip("/"))
+    return info.file_size if info else None
+
+  def total_size(self) -> int:
+    """
+    Return the uncompressed size of all the members of the archive.
+    """
+    return sum(info.file_size for info in self.zip.infolist())
+
+  def open_image(self, url:str):
+    """
+    Open an image of the archive from its url.
+
+    Raises:
+        KeyError: If the archive does not contain the image.
+    """
+    return self.zip.open(url.lstrip("/"))
+
+class _image_importer:
+  """
+  Store the images of an archive, reading every member once even when several pages use it.
+
+  The references taken are kept to release them if the import fails.
+  """
+  def __init__(self, archive:story_archive):
+    self.archive = archive
+    self.imported = {}
+    self.references = []
+
+  def store(self, url:str) -> tuple[str, dict]:
+    """
+    Return the url and metadata of a stored image of the archive, (None, None) if the archive does not contain it.
+    """
+    if url in self.imported:
+      image_url, info = self.imported[url]
+      if image_url:
+        retain_images([image_url])
+        self.references.append(image_url)
+      return image_url, info
+    try:
+      with self.archive.open_image(url) as image_file:
+        image_url, info = save_image(image_file)
+    except KeyError:
+      print(f"Image {url} not found in the archive")
+      image_url, info = None, None
+    self.imported[url] = (image_url, info)
+    if image_url:
+      self.references.append(image_url)
+    return image_url, info
+
+def scan_archive(archive:story_archive) -> tuple[dict, dict]:
+  """
+  Read the links between the pages of an archive and check it, before anything is written.
+
+  A single pass over the pages of story.json collects their choices and
+  images without their text, indexed by their archive identifiers. The graph
+  is then checked with these indexes in linear time: exactly one first page,
+  unique page identifiers, required titles, choices leading to pages of the
+  archive, images present in the archive, size limits, and the pages not
+  reachable from the first page, which are not imported.
+
+  Args:
+      archive (story_archive): The archive.
+
+  Returns:
+      tuple[dict, dict]: The graph ("fields" of the story, "links" and "images" of the pages by identifier,
+      "first_page_id") and the validation report ("valid", "errors", "warnings" and counts).
+  """
+  report = _validation_report()
+  fields = archive.story_fields()
+  if not fields.get("title"):
+    report.error("The story has no title.")
+  if not ObjectId.is_valid(str(fields.get("userId") or "")):
+    report.error("The story has no valid userId.")
+  if archive.total_size() > IMPORT_MAX_BYTES:
+    report.error(f"The archive exceeds the maximum size of {IMPORT_MAX_BYTES} bytes.")
+
+  links = {}
+  images = {}
+  first_page_ids = []
+  total_pages = 0
+  for index, page in enumerate(archive.pages()):
+    total_pages += 1
+    page_id = page.get("id")
+    if not page_id:
+      report.error(f"The page at position {index} has no id.")
+      continue
+    if page_id in links:
+      report.error(f"The page {page_id} appears several times.")
+      continue
+    if not page.get("title"):
+      report.error(f"The page {page_id} has no title.")
+    choices = page.get("choices") or []
+    if any(not choice.get("title") for choice in choices):
+      report.error(f"A choice of the page {page_id} has no title.")
+    links[page_id] = [(choice.get("title"), choice.get("sendToPageId")) for choice in choices]
+    if page.get("image"):
+      images[page_id] = page["image"]
+    if page.get("first"):
+      first_page_ids.append(page_id)
+
+  if total_pages > IMPORT_MAX_PAGES:
+    report.error(f"The story has {total_pages} pages, more than the maximum of {IMPORT_MAX_PAGES}.")
+  if links and not first_page_ids:
+    report.error("The story has no first page.")
+  if len(first_page_ids) > 1:
+    report.error(f"The story has {len(first_page_ids)} first pages.")
+
+  total_choices = 0
+  for page_id, page_links in links.items():
+    for _, target in page_links:
+      total_choices += 1
+      if target not in links:
+        report.error(f"A choice of the page {page_id} leads to the page {target}, missing from the archive.")
+
+  reachable = set()
+  if first_page_ids:
+    reachable.add(first_page_ids[0])
+    stack = [first_page_ids[0]]
+    while stack:
+      for _, target in links[stack.pop()]:
+        if target in links and target not in reachable:
+          reachable.add(target)
+          stack.append(target)
+  unreachable = len(links) - len(reachable)
+  if unreachable:
+    report.warning(f"{unreachable} {'page is' if unreachable == 1 else 'pages are'} not reachable from the first page and will not be imported.")
+
+  urls = {url for page_id, url in images.items() if page_id in reachable}
+  if fields.get("cover"):
+    urls.add(fields["cover"])
+  for url in sorted(urls):
+    size = archive.member_size(url)
+    if size is None:
+      report.error(f"The image {url} is missing from the archive.")
+    elif size > IMAGE_MAX_BYTES:
+      report.error(f"The image {url} exceeds the maximum size of {IMAGE_MAX_BYTES} bytes.")
+
+  graph = {
+    "fields": fields,
+    "links": links,
+    "images": images,
+    "first_page_id": first_page_ids[0] if first_page_ids else None,
+  }
+  return graph, report.to_dict(pages=total_pages, choices=total_choices, reachablePages=len(reachable), images=len(urls))
+
+def import_story(archive:story_archive, use_transaction:bool=True, batch_size:int=IMPORT_BATCH_SIZE) -> tuple[Story, dict]:
+  """
+  Import a story exported as an .ariane archive.
+
+  The archive is first checked by scan_archive, which reads the links between
+  the pages. The story is a directed graph: walking it from the first page,
+  a page reached by several choices, or by a loop, gets its new ObjectId the
+  first time it is reached and every choice is created against that mapping,
+  so the import is linear in the size of the archive. The previousPageId of
+  a page is the page it was first reached from. The images are then stored
+  member by member, and a second pass over story.json writes the pages with
+  ordered insert_many batches while they are read, followed by the choices,
+  in a transaction when the deployment supports it. The documents already
+  written are deleted if the import fails without one.
+
+  Args:
+      archive (story_archive): The archive.
+      use_transaction (bool): Write the documents in a transaction when the deployment supports it.
+      batch_size (int): The maximum number of documents inserted by a single insert_many.
+
+  Returns:
+      tuple[Story, dict]: The created story, and the number of "pages", "choices" and "images" imported.
+
+  Raises:
+      archive_invalid: If the archive fails its validation, nothing being written.
+      Exception: If an error occurs while writing the story.
+  """
+  graph, report = scan_archive(archive)
+  if not report["valid"]:
+    raise archive_invalid(report)
+
+  story_dict = dict(graph["fields"])
+  # The archive urls are replaced by the ones of the stored images
+  cover = story_dict.pop("cover", None)
+  story_dict.pop("coverInfo", None)
+  story = to_entity(story_dict)
+  story.id = str(ObjectId())
+
+  links = graph["links"]
+  images = graph["images"]
+  first_page_id = graph["first_page_id"]
+  new_ids = {}
+  previous_page_ids = {}
+  new_choices = []
+  if first_page_id is not None:
+    new_ids[first_page_id] = str(ObjectId())
+    stack = [first_page_id]
+    while stack:
+      page_id = stack.pop()
+      targets = []
+      for title, target in links[page_id]:
+        if target not in new_ids:
+          new_ids[target] = str(ObjectId())
+          previous_page_ids[target] = new_ids[page_id]
+          targets.append(target)
+        new_choices.append(Choice(title=title, page_id=new_ids[page_id], send_to_page_id=new_ids[target], story_id=story.id))
+      # Reversed so the pages are visited in the order of their choices
+      stack.extend(reversed(targets))
+  graph = links = None
+
+  importer = _image_importer(archive)
+  try:
+    if cover:
+      story.cover, story.cover_info = importer.store(cover)
+    page_images = {page_id: importer.store(url) for page_id, url in images.items() if page_id in new_ids}
+
+    if use_transaction:
+      run_in_transaction(lambda session: _insert(archive, story, new_ids, previous_page_ids, page_images, new_choices, batch_size, session))
+    else:
+      _insert(archive, story, new_ids, previous_page_ids, page_images, new_choices, batch_size, None)
+  except BaseException:
+    release_images(importer.references)
+    raise
+  story_graphs.invalidate(story.id)
+
+  return story, {"pages": len(new_ids), "choices": len(new_choices), "images": len(importer.references)}
+
+def _insert(archive:story_archive, story:Story, new_ids:dict, previous_page_ids:dict, page_images:dict, new_choices:list[Choice], batch_size:int, session) -> None:
+  """
+  Insert the documents of an imported story, deleting the ones already written if it fails outside of a transaction.
+  """
+  repository = pages_repository()
+  pages_with_choices = {choice.page_id for choice in new_choices}
+  counters = dict.fromkeys(COUNTERS, 0)
+  try:
+    stories_repository().create_story(story, session=session)
+
+    # Second pass: the pages, inserted by batches as they are read
+    batch = []
+    written = set()
+    for page in archive.pages():
+      page_id = new_ids.get(page.get("id"))
+      if page_id is None or page_id in written:
+        continue
+      written.add(page_id)
+      entity = page_to_entity({key: value for key, value in page.items() if key not in ("choices", "image", "imageInfo")})
+      entity.id = page_id
+      entity.story_id = story.id
+      entity.previous_page_id = previous_page_ids.get(page["id"])
+      entity.image, entity.image_info = page_images.get(page["id"], (None, None))
+      entity.image = entity.image or ""
+      for key, value in page_counters(entity.end, entity.total_characters, page_id in pages_with_choices).items():
+        counters[key] += value
+      batch.append(entity)
+      if len(batch) >= batch_size:
+        repository.insert_pages(batch, session=session, batch_size=batch_size)
+        batch = []
+    if batch:
+      repository.insert_pages(batch, session=session, batch_size=batch_size)
+
+    choices_repository().insert_choices(new_choices, session=session, batch_size=batch_size)
+    stories_repository().increment_counters(story.id, counters, session=session)
+  except BaseException:
+    if session is None:
+      _delete_partial_import(story.id)
+    raise
+
+def _delete_partial_import(story_id:str) -> None:
+  """
+  Delete the documents written by an import that failed without a transaction.
+  """
+  try:
+    choices_repository().collection.delete_many(choices_of_story(story_id))
+    pages_repository().delete_all(story_id)
+    stories_repository().collection.delete_one(by_id(story_id))
+    story_graphs.invalidate(story_id)
+  except Exception as e:
+    print(f"Failed to delete the partial import of story {story_id}: {e}")
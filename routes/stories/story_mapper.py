@@ -5,8 +5,12 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath
 from .story import Story
 from bson.objectid import ObjectId
 
+from utils.asset_store import get_asset_store
+from utils.images import variant_url
+
 from routes.pages.page_mapper import to_entity as page_to_entity
 from routes.pages.page_mapper import to_dict as page_to_dict
+from routes.pages.page_mapper import to_response_dict as page_to_response_dict
 
 def to_entity(story_data: dict) -> Story:
     """
@@ -28,6 +32,7 @@ def to_entity(story_data: dict) -> Story:
     s.total_pages = story_data.get("totalPages", 0)
     s.total_open_node = story_data.get("totalOpenNode", 0)
     s.cover = story_data.get("cover", "")
+    s.cover_info = story_data.get("coverInfo")
     s.pages=[page_to_entity(page) for page in story_data.get('pages', [])]
 
     if story_data.get("_id") and isinstance(story_data.get("_id"), ObjectId):
@@ -48,7 +53,7 @@ def to_dict(s: Story) -> dict:
         s (Story): The Story object to convert.
 
     Returns:
-        dict: A dictionary containing the attributes of the Story object.
+        dict: A dictionary containing the attributes of the Story object, as stored and exported.
     """
     story_dict = {
       "title": s.title,
@@ -57,9 +62,10 @@ def to_dict(s: Story) -> dict:
       "updatedAt": s.updated_at,
       "totalCharacters": s.total_characters,
       "totalEnd":s.total_end,
-      "totalPage": s.total_pages,
+      "totalPages": s.total_pages,
       "totalOpenNode": s.total_open_node,
       "cover":s.cover,
+      "coverInfo": s.cover_info,
       "pages" :[page_to_dict(page) for page in s.pages],
     }
 
@@ -67,4 +73,21 @@ def to_dict(s: Story) -> dict:
       story_dict["id"] = str(s.id)
     if s.user_id:
       story_dict["userId"] = str(s.user_id)
-    return story_dict
\ No newline at end of file
+    return story_dict
+
+def to_response_dict(s: Story) -> dict:
+    """
+    Convert a Story object to its representation in the API responses.
+
+    Args:
+        s (Story): The Story object to convert.
+
+    Returns:
+        dict: The attributes of the Story object with the urls to download its cover and thumbnail.
+    """
+    story_dict = to_dict(s)
+    store = get_asset_store()
+    story_dict["coverUrl"] = store.url(s.cover) if s.cover else None
+    story_dict["coverThumbnail"] = store.url(variant_url(s.cover, "thumbnail")) if s.cover else None
+    story_dict["pages"] = [page_to_response_dict(page) for page in s.pages]
+    return story_dict
@@ -13,4 +13,6 @@ class user_response(Schema):
   
 
 class users_response(Schema):
-  users = fields.List(fields.Nested(user_response))
\ No newline at end of file
+  users = fields.List(fields.Nested(user_response))
+  nextCursor = fields.String(allow_none=True)
+  next = fields.String(allow_none=True)
\ No newline at end of file
@@ -3,6 +3,7 @@ from flask import jsonify
 from flask_smorest import Blueprint
 
 from utils.jwt_helpers import generate_token
+from utils.pagination import pagination_args, paginated
 
 from .users_service import users_service
 
@@ -98,19 +99,23 @@ users = Blueprint("users", "users", url_prefix="/users", description="users rout
  
 @users.route("/")
 class users_controller(MethodView):
+  @users.arguments(pagination_args, location="query")
   @users.response(200, users_response)
-  def get(self):
+  def get(self, args:dict):
     """
-      Get all users.
+      Get a page of the users.
+
+      Expects the optional "limit" and "after" cursor in the query string.
 
       Returns:
-        - 200: A list of all users.
+        - 200: The users of the page, with the "nextCursor" and the "next" url of the following page.
+        - 422: Invalid limit or cursor.
         - 500: Internal server error.
     """
     try:
-      users = users_service.get_all()
+      users, cursor = users_service.get_all(args["limit"], args["after"])
       users = [to_dict(user) for user in users]
-      return {"users": users}
+      return paginated("users", users, cursor, args["limit"])
     except Exception as e:
       return jsonify({"error": str(e)}), 500
   
@@ -3,31 +3,42 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
 
 from bson.objectid import ObjectId
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
+from pymongo import ASCENDING, IndexModel
 
-from configs.config_database import mongodb_uri 
+from utils.database import get_db
+from utils.pagination import PAGE_DEFAULT_LIMIT, KEYSET_SORT, find_page, keyset_filter
+from utils.queries import by_id, user_by_email
 from .user import User
 from .user_mapper import to_entity, to_dict
 
-# Create a new client and connect to the MongoDB server
-client = MongoClient(mongodb_uri, server_api=ServerApi('1'))
-db = client["ariane"]
-
 class users_repository:
+  indexes = [
+    IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+  ]
+  # Queries issued by this repository, built with the same utils.queries filters, checked with explain() by utils.indexes
+  queries = [
+    {"filter": user_by_email("")},
+    {"filter": by_id(ObjectId())},
+    {"filter": keyset_filter({}, ObjectId()), "sort": KEYSET_SORT},
+  ]
+
   def __init__(self):
-    self.collection = db["users"]
+    self.collection_name = "users"
+
+  @property
+  def collection(self):
+    return get_db()[self.collection_name]
   
-  def get_all(self) -> list[User]:
+  def get_all(self, limit:int=PAGE_DEFAULT_LIMIT, after:str=None) -> tuple[list[User], str]:
     try:
-      users_collection = self.collection.find({})
-      return [to_entity(user) for user in users_collection]
+      users_collection, cursor = find_page(self.collection, {}, limit, after)
+      return [to_entity(user) for user in users_collection], cursor
     except Exception as e:
       raise Exception(f"Failed to get users: {e}") from e
   
   def get_user_by_id(self, user_id:str) -> User:
     try:
-      user = self.collection.find_one({"_id": ObjectId(user_id)})
+      user = self.collection.find_one(by_id(user_id))
       if not user:
         raise ValueError(f"User not found.")
       return to_entity(user)
@@ -36,7 +47,7 @@ class users_repository:
     
   def get_user_by_email(self, email:str) -> User:
     try:
-      user = self.collection.find_one({"email": email})
+      user = self.collection.find_one(user_by_email(email))
       if not user:
         return None
       return to_entity(user)
@@ -45,7 +56,7 @@ class users_repository:
   
   def delete_user(self, user_id:str) ->bool:
     try:
-      result = self.collection.delete_one({"_id": ObjectId(user_id)})
+      result = self.collection.delete_one(by_id(user_id))
       if result.deleted_count != 1:
         raise ValueError(f"user not found.")
       return result.deleted_count == 1
@@ -77,7 +88,7 @@ class users_repository:
   def update_user(self, user: User) -> User:
     try:
       result = self.collection.update_one(
-        {"_id": ObjectId(user.id)},
+        by_id(user.id),
         {"$set": to_dict(user)}
       )
       if result.modified_count == 0:
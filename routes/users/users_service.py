@@ -2,6 +2,8 @@ import random
 import string
 import hashlib
 
+from utils.pagination import PAGE_DEFAULT_LIMIT
+
 from .users_repository import users_repository
 from .user import User
 
@@ -9,9 +11,9 @@ class users_service:
   def __init__(self):
     self.repository = users_repository()
   
-  def get_all(self) -> list[dict]:
+  def get_all(self, limit:int=PAGE_DEFAULT_LIMIT, after:str=None) -> tuple[list[User], str]:
     try:
-      return self.repository.get_all()
+      return self.repository.get_all(limit, after)
     except Exception as e:
       raise Exception(f"Failed to fetch users: {e}") from e
   
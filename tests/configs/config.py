@@ -0,0 +1,4 @@
+# Configuration of the test suite, used when the deployment configs package is not installed
+class config:
+  JWT_SECRET_KEY = "ariane-test-secret-key-of-32-bytes!"
+  JWT_ALGORITHM = "HS256"
@@ -0,0 +1,2 @@
+# Never connected to, the tests replace the client with mongomock
+mongodb_uri = "mongodb://localhost:27017"
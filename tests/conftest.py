@@ -0,0 +1,101 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import importlib.util
+
+# The deployment configs package holds the secrets and is not versioned, the tests use their own
+if importlib.util.find_spec("configs") is None:
+  sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+os.environ.setdefault("MONGODB_ENSURE_INDEXES", "0")
+
+import boto3
+import mongomock
+import mongomock.collection
+import pytest
+from moto import mock_aws
+
+import utils.database as database
+
+# mongomock does not know the sort argument of the bulk updates sent by pymongo 4.9+
+_add_update = mongomock.collection.BulkOperationBuilder.add_update
+def _add_update_without_sort(self, *args, sort=None, **kwargs):
+  return _add_update(self, *args, **kwargs)
+mongomock.collection.BulkOperationBuilder.add_update = _add_update_without_sort
+
+from app import server
+from utils.jwt_helpers import generate_token
+from utils.asset_store import s3_asset_store, set_asset_store, local_asset_store
+from routes.stories.story_graph import story_graphs
+
+@pytest.fixture(autouse=True)
+def db(monkeypatch):
+  """
+  Give every test an empty mongomock database and an empty story graph cache.
+  """
+  client = mongomock.MongoClient()
+  monkeypatch.setattr(database, "get_client", lambda: client)
+  monkeypatch.setattr(database, "supports_transactions", lambda: False)
+  story_graphs.clear()
+  yield client[database.DATABASE_NAME]
+  story_graphs.clear()
+
+@pytest.fixture
+def s3(tmp_path):
+  """
+  Use an S3 asset store on a moto bucket, recording the operations sent to it.
+  """
+  with mock_aws():
+    client = boto3.client("s3", region_name="us-east-1")
+    client.create_bucket(Bucket="ariane")
+    store = s3_asset_store("ariane", client=client, cache_dir=str(tmp_path))
+    store.calls = []
+    client.meta.events.register("before-call.s3", lambda model, **kwargs: store.calls.append(model.name))
+    set_asset_store(store)
+    yield store
+    set_asset_store(local_asset_store())
+
+@pytest.fixture
+def client():
+  """
+  Return a test client of the application.
+  """
+  return server.test_client()
+
+@pytest.fixture
+def user(client):
+  """
+  Sign up a user and return its identifier with the headers of its requests.
+  """
+  response = client.post("/sign_up/", json={"email": "reader@ariane.test", "password": "secret"})
+  user_id = response.get_json()["user"]["id"]
+  return {"id": user_id, "headers": {"Authorization": f"Bearer {generate_token(user_id)}"}}
+
+@pytest.fixture
+def story(client, user):
+  """
+  Create a story of three pages: the first page leads to the second and to the third, an end, and the second to the third.
+
+  Returns:
+      dict: The "id" of the story, its "pages" and "choices" as returned by the API, and the "headers" of its owner.
+  """
+  headers = user["headers"]
+  story_id = client.post(f"/stories/{user['id']}", json={"userId": user["id"], "title": "The maze", "summary": "Find the exit"}, headers=headers).get_json()["story"]["id"]
+
+  def create_page(**page):
+    page = {"storyId": story_id, "image": "", "totalCharacters": len(page["text"]), **page}
+    return client.post(f"/pages/{story_id}", json=page, headers=headers).get_json()["page"]
+
+  first = create_page(title="Entrance", text="Two doors.", first=True)
+  left = create_page(title="Left door", text="A corridor.", previousPageId=first["id"])
+  exit_page = create_page(title="Exit", text="Daylight.", end=True, previousPageId=first["id"])
+
+  def create_choice(page, target, title):
+    return client.post(f"/choices/{page['id']}", json={"pageId": page["id"], "sendToPageId": target["id"], "title": title}, headers=headers).get_json()["choice"]
+
+  choices = [
+    create_choice(first, left, "Go left"),
+    create_choice(first, exit_page, "Go right"),
+    create_choice(left, exit_page, "Follow the corridor"),
+  ]
+  return {"id": story_id, "pages": [first, left, exit_page], "choices": choices, "headers": headers}
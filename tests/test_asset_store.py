@@ -0,0 +1,40 @@
+import io
+
+from PIL import Image
+
+from utils.assets import resolve_asset
+from utils.images import derivative_url, generate_derivatives, generate_missing_derivatives, image_info
+
+def png(color:str) -> bytes:
+  buffer = io.BytesIO()
+  Image.new("RGB", (8, 8), color).save(buffer, "PNG")
+  return buffer.getvalue()
+
+def test_render_reads_each_version_of_an_image_once(s3):
+  url = "/static/images/pages/page.png"
+  s3.save(url, io.BytesIO(png("red")))
+  generate_derivatives(url)
+  info = image_info(url)
+  s3.calls.clear()
+
+  path = resolve_asset(url, "print", info)
+
+  assert path.endswith(".jpg")
+  assert s3.calls == ["ListObjectsV2", "HeadObject", "GetObject"]
+  s3.calls.clear()
+  assert resolve_asset(url, "print", info) == path
+  assert s3.calls == []
+
+def test_missing_derivatives_are_found_without_listing_the_store(s3, db):
+  used, unused = "/static/images/pages/used.png", "/static/images/pages/unused.png"
+  s3.save(used, io.BytesIO(png("red")))
+  s3.save(unused, io.BytesIO(png("blue")))
+  db.pages.insert_one({"title": "Page", "image": used})
+
+  assert generate_missing_derivatives() == (1, 0)
+
+  assert s3.stat(derivative_url(used, "thumbnail")) is not None
+  assert s3.stat(derivative_url(unused, "thumbnail")) is None
+  s3.calls.clear()
+  assert generate_missing_derivatives() == (0, 0)
+  assert s3.calls == ["ListObjectsV2"]
@@ -0,0 +1,81 @@
+import base64
+import hashlib
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import utils.uploads as uploads
+from routes.pages.pages_service import pages_service
+from utils.assets_repository import assets_repository
+
+INFO = {"width": 1, "height": 1, "bytes": 3}
+
+def test_deletion_is_claimed_once_and_only_without_references():
+  assets = assets_repository()
+  assert assets.acquire("a" * 64, "blobs/a.png", INFO) is True
+  assert assets.acquire("a" * 64, "blobs/a.png", INFO) is False
+
+  assert assets.release("a" * 64) is False
+  assert assets.claim_deletion("a" * 64) is None
+  assert assets.release("a" * 64) is True
+  key, token = assets.claim_deletion("a" * 64)
+
+  assert key == "blobs/a.png"
+  assert assets.claim_deletion("a" * 64) is None
+  assert assets.finish_deletion("a" * 64, token) is True
+  assert assets.collection.count_documents({}) == 0
+
+def test_image_referenced_again_during_its_deletion_is_kept(db):
+  assets = assets_repository()
+  assets.acquire("b" * 64, "blobs/b.png", INFO)
+  assets.release("b" * 64)
+  key, token = assets.claim_deletion("b" * 64)
+  # An upload of the same image while its files are being deleted waits for the deletion
+  with ThreadPoolExecutor(max_workers=1) as executor:
+    upload = executor.submit(assets.acquire, "b" * 64, "blobs/b.png", INFO)
+    while db.assets.find_one({"_id": "b" * 64})["refs"] == 0:
+      time.sleep(0.01)
+    assert not upload.done()
+
+    assert assets.finish_deletion("b" * 64, token) is False
+
+    # The upload stores the files again
+    assert upload.result(timeout=5) is True
+  asset = db.assets.find_one({"_id": "b" * 64})
+  assert asset["refs"] == 1
+  assert "deleting" not in asset
+
+def test_failed_update_releases_the_image_sent_as_a_data_url(client, story, db, s3, monkeypatch):
+  page = story["pages"][0]
+  buffer = io.BytesIO()
+  Image.new("RGB", (8, 8), "red").save(buffer, "PNG")
+  data_url = "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+  url = f"{uploads.BLOB_URL}/{hashlib.sha256(buffer.getvalue()).hexdigest()}.png"
+  def update_failing(self, page_id, page_data):
+    raise Exception("Failed to update page")
+  monkeypatch.setattr(pages_service, "update_page", update_failing)
+  monkeypatch.setattr(uploads, "generate_derivatives_in_background", lambda url: None)
+
+  response = client.put(f"/pages/page/{page['id']}", json={"image": data_url}, headers=story["headers"])
+
+  assert response.status_code == 500
+  # The image is deleted in the background once its last reference is released
+  uploads._executor.submit(lambda: None).result()
+  assert db.assets.count_documents({}) == 0
+  assert s3.stat(url) is None
+
+def test_image_that_cannot_be_stored_is_not_referenced(client, story, db, s3, monkeypatch):
+  page = story["pages"][0]
+  buffer = io.BytesIO()
+  Image.new("RGB", (8, 8), "blue").save(buffer, "PNG")
+  def save_failing(key, path):
+    raise OSError("No space left on device")
+  monkeypatch.setattr(s3, "save_file", save_failing)
+
+  response = client.put(f"/pages/page/{page['id']}/image", data=buffer.getvalue(), content_type="image/png", headers=story["headers"])
+
+  assert response.status_code == 500
+  uploads._executor.submit(lambda: None).result()
+  assert db.assets.count_documents({"refs": {"$gt": 0}}) == 0
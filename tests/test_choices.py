@@ -0,0 +1,17 @@
+from bson.objectid import ObjectId
+
+def test_choice_belongs_to_the_story_of_its_page(client, db, story):
+  left, exit_page = story["pages"][1], story["pages"][2]
+
+  response = client.post(f"/choices/{left['id']}", json={"pageId": left["id"], "sendToPageId": exit_page["id"], "title": "Run"}, headers=story["headers"])
+
+  assert response.status_code == 200
+  choice = db.choices.find_one({"_id": ObjectId(response.get_json()["choice"]["id"])})
+  assert choice["storyId"] == ObjectId(story["id"])
+
+def test_choice_story_cannot_be_given(client, story):
+  left, exit_page = story["pages"][1], story["pages"][2]
+
+  response = client.post(f"/choices/{left['id']}", json={"pageId": left["id"], "sendToPageId": exit_page["id"], "title": "Run", "storyId": str(ObjectId())}, headers=story["headers"])
+
+  assert response.status_code == 422
@@ -0,0 +1,76 @@
+import pytest
+from bson.objectid import ObjectId
+
+from routes.stories.story_graph import story_graphs
+from utils.pagination import slice_page
+
+def walk(client, url:str, name:str, headers:dict=None) -> tuple[list[dict], int]:
+  """
+  Follow the "next" links of a listing.
+
+  Returns:
+      tuple[list[dict], int]: The items of every page, and the number of requests.
+  """
+  items, requests = [], 0
+  while url:
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    body = response.get_json()
+    items += body[name]
+    requests += 1
+    url = body["next"]
+    assert (url is None) == (body["nextCursor"] is None)
+  return items, requests
+
+def test_users_are_listed_page_by_page(client, user):
+  for i in range(4):
+    client.post("/sign_up/", json={"email": f"user{i}@ariane.test", "password": "secret"})
+
+  users, requests = walk(client, "/users/?limit=2", "users")
+
+  assert requests == 3
+  assert len(users) == 5
+  assert len({u["id"] for u in users}) == 5
+
+def test_stories_are_listed_page_by_page(client, user):
+  created = [client.post(f"/stories/{user['id']}", json={"userId": user["id"], "title": f"Story {i}"}, headers=user["headers"]).get_json()["story"]["id"] for i in range(5)]
+
+  stories, requests = walk(client, f"/stories/{user['id']}?limit=2", "stories", user["headers"])
+
+  assert requests == 3
+  assert [s["id"] for s in stories] == created
+
+def test_choices_are_listed_page_by_page(client, story):
+  first = story["pages"][0]
+
+  choices, requests = walk(client, f"/choices/{first['id']}?limit=1", "choices", story["headers"])
+
+  assert requests == 2
+  assert [c["title"] for c in choices] == ["Go left", "Go right"]
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_pages_are_listed_page_by_page(client, story, cached):
+  if cached:
+    story_graphs.get(story["id"])
+  else:
+    story_graphs.invalidate(story["id"])
+
+  pages, requests = walk(client, f"/pages/{story['id']}?limit=2", "pages", story["headers"])
+
+  assert requests == 2
+  assert [p["title"] for p in pages] == ["Entrance", "Left door", "Exit"]
+  assert [p.get("choiceTitle") for p in pages] == ["", "Go left", "Go right"]
+  assert (story_graphs.get_cached(story["id"]) is not None) == cached
+
+@pytest.mark.parametrize("query", ["limit=0", "limit=9999", "after=zz"])
+def test_invalid_limit_or_cursor(client, query):
+  assert client.get(f"/users/?{query}").status_code == 422
+
+def test_slice_page_follows_the_cursor():
+  documents = [{"_id": ObjectId()} for _ in range(5)]
+
+  assert slice_page(documents, 2) == (documents[:2], str(documents[1]["_id"]))
+  assert slice_page(documents, 2, str(documents[1]["_id"])) == (documents[2:4], str(documents[3]["_id"]))
+  assert slice_page(documents, 2, str(documents[3]["_id"])) == (documents[4:], None)
+  # A cursor whose document was deleted still resumes after it
+  assert slice_page(documents[:2] + documents[3:], 2, str(documents[2]["_id"])) == (documents[3:], None)
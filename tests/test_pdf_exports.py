@@ -0,0 +1,111 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import routes.pages.pages_controller as pages_controller
+import routes.pages.pages_pdf as pages_pdf
+import routes.pages.pdf_exports as pdf_exports_module
+from routes.pages.pages_service import pages_service
+from routes.pages.pdf_exports import pdf_exports, PDF_EXPORT_JOB_TIMEOUT, PDF_EXPORT_JOB_TTL
+from routes.stories.stories_service import stories_service
+from utils.cache import disk_lru_cache
+
+@pytest.fixture
+def exports(tmp_path, monkeypatch):
+  """
+  Render the export jobs in a thread of the test process, to temporary directories.
+  """
+  jobs = pdf_exports(str(tmp_path / "jobs"), 1, disk_lru_cache(str(tmp_path / "cache"), 10 * 1024 * 1024, ".pdf"))
+  executor = ThreadPoolExecutor(max_workers=1)
+  monkeypatch.setattr(jobs, "_pool", lambda: executor)
+  monkeypatch.setattr(pages_controller, "pdf_export_jobs", jobs)
+  yield jobs
+  executor.shutdown(wait=True)
+
+def wait(exports:pdf_exports) -> None:
+  """
+  Wait for the jobs submitted so far to finish.
+  """
+  exports._pool().submit(lambda: None).result()
+
+def submit(client, story) -> dict:
+  response = client.post(f"/pages/pdf_exports/{story['id']}", json={}, headers=story["headers"])
+  assert response.status_code == 202
+  return response.get_json()["job"]
+
+def get_job(client, story, job_id:str) -> dict:
+  return client.get(f"/pages/pdf_exports/job/{job_id}", headers=story["headers"]).get_json()["job"]
+
+def test_export_is_rendered_and_downloaded(client, story, exports):
+  job = submit(client, story)
+  assert job["status"] == "queued"
+
+  wait(exports)
+
+  done = get_job(client, story, job["id"])
+  assert done["status"] == "done"
+  assert done["progress"] == {"done": 3, "total": 3}
+  response = client.get(f"/pages/pdf_exports/job/{job['id']}/download", headers=story["headers"])
+  assert response.status_code == 200
+  assert response.get_data().startswith(b"%PDF")
+  # The same request reuses the rendered PDF
+  assert submit(client, story)["id"] == job["id"]
+
+def test_failed_render_is_not_served_and_can_be_retried(client, story, exports, monkeypatch):
+  added = []
+  monkeypatch.setattr(exports.cache, "add", added.append)
+  def render_failing(story, pages, options, path, progress=None):
+    raise RuntimeError("No space left on device")
+  with monkeypatch.context() as patch:
+    patch.setattr(pdf_exports_module, "render_story_to_file", render_failing)
+    job = submit(client, story)
+    wait(exports)
+
+  failed = get_job(client, story, job["id"])
+  key = exports.get_job(job["id"])["key"]
+  assert failed["status"] == "failed"
+  assert failed["error"] == "No space left on device"
+  assert added == []
+  assert exports.cache.get(key) is None
+  assert client.get(f"/pages/pdf_exports/job/{job['id']}/download", headers=story["headers"]).status_code == 409
+
+  retry = submit(client, story)
+  wait(exports)
+
+  assert retry["id"] != job["id"]
+  assert get_job(client, story, retry["id"])["status"] == "done"
+  assert added == [key]
+
+def test_interrupted_render_leaves_no_file(story, tmp_path, monkeypatch):
+  story_id = story["id"]
+  path = str(tmp_path / "story.pdf")
+  def replace_failing(source, destination):
+    raise OSError("No space left on device")
+  monkeypatch.setattr(pages_pdf.os, "replace", replace_failing)
+
+  with pytest.raises(OSError):
+    pages_pdf.render_story_to_file(stories_service().get_story_by_id(story_id), pages_service().get_pages_with_choices(story_id), {}, path)
+
+  assert os.listdir(tmp_path) == []
+
+def test_lost_job_times_out(exports):
+  job = {"id": "0" * 32, "key": "key", "status": "running", "updatedAt": time.time() - PDF_EXPORT_JOB_TIMEOUT - 1}
+  os.makedirs(exports.directory)
+  pdf_exports_module._write_json(exports._job_path(job["id"]), job)
+
+  assert exports.get_job(job["id"])["status"] == "failed"
+  assert exports.get_job("not-a-job") is None
+
+def test_purge_removes_the_expired_jobs_and_their_keys(exports):
+  os.makedirs(exports.directory)
+  now = time.time()
+  for job_id, key, updated_at in (("a" * 32, "old", now - PDF_EXPORT_JOB_TTL - 1), ("b" * 32, "new", now)):
+    pdf_exports_module._write_json(exports._job_path(job_id), {"id": job_id, "key": key, "status": "done", "updatedAt": updated_at})
+    with open(os.path.join(exports.directory, f"{key}.job"), "w") as f:
+      f.write(job_id)
+
+  assert exports.purge_expired() == 1
+
+  assert sorted(os.listdir(exports.directory)) == [f"{'b' * 32}.json", "new.job"]
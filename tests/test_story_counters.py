@@ -0,0 +1,49 @@
+from bson.objectid import ObjectId
+
+from routes.stories.stories_repository import stories_repository
+from routes.stories.story_counters import COUNTERS
+
+def counters(db, story_id:str) -> dict:
+  story = db.stories.find_one({"_id": ObjectId(story_id)})
+  return {key: story.get(key, 0) for key in COUNTERS}
+
+def assert_counters_match_a_recompute(db, story_id:str) -> dict:
+  maintained = counters(db, story_id)
+  stories_repository().recompute_counters()
+  assert counters(db, story_id) == maintained
+  return maintained
+
+def test_counters_follow_the_creation_of_pages_and_choices(db, story):
+  assert assert_counters_match_a_recompute(db, story["id"]) == {"totalCharacters": len("Two doors.A corridor.Daylight."), "totalEnd": 1, "totalPages": 3, "totalOpenNode": 0}
+
+def test_counters_follow_page_updates(client, db, story):
+  left = story["pages"][1]
+
+  client.put(f"/pages/page/{left['id']}", json={"text": "A long and dark corridor.", "totalCharacters": 25, "end": True}, headers=story["headers"])
+
+  assert assert_counters_match_a_recompute(db, story["id"]) == {"totalCharacters": len("Two doors.Daylight.") + 25, "totalEnd": 2, "totalPages": 3, "totalOpenNode": 0}
+
+def test_counters_follow_choice_and_page_deletions(client, db, story):
+  left, exit_page = story["pages"][1], story["pages"][2]
+  corridor = story["choices"][2]
+
+  client.delete(f"/choices/choice/{corridor['id']}", headers=story["headers"])
+
+  # The left door has no choice anymore and is not an end
+  assert assert_counters_match_a_recompute(db, story["id"])["totalOpenNode"] == 1
+
+  client.put(f"/pages/page/{exit_page['id']}", json={"end": False}, headers=story["headers"])
+  assert assert_counters_match_a_recompute(db, story["id"])["totalOpenNode"] == 2
+
+  response = client.delete(f"/pages/page/{left['id']}", headers=story["headers"])
+
+  assert response.status_code == 200
+  assert assert_counters_match_a_recompute(db, story["id"]) == {"totalCharacters": len("Two doors.Daylight."), "totalEnd": 0, "totalPages": 2, "totalOpenNode": 1}
+
+def test_recompute_resets_the_stories_without_pages(client, user, db):
+  story_id = client.post(f"/stories/{user['id']}", json={"userId": user["id"], "title": "Empty"}, headers=user["headers"]).get_json()["story"]["id"]
+  db.stories.update_one({"_id": ObjectId(story_id)}, {"$set": {"totalPages": 7, "totalEnd": 2}})
+
+  stories_repository().recompute_counters()
+
+  assert counters(db, story_id) == {key: 0 for key in COUNTERS}
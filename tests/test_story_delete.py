@@ -0,0 +1,24 @@
+from bson.objectid import ObjectId
+
+from routes.stories.story_graph import story_graphs
+
+def test_delete_story_removes_its_pages_and_choices(client, user, story, db):
+  other_id = client.post(f"/stories/{user['id']}", json={"userId": user["id"], "title": "Another"}, headers=user["headers"]).get_json()["story"]["id"]
+  client.post(f"/pages/{other_id}", json={"storyId": other_id, "title": "Kept", "first": True, "image": ""}, headers=user["headers"])
+
+  response = client.delete(f"/stories/{user['id']}/{story['id']}", headers=story["headers"])
+
+  assert response.status_code == 200
+  assert response.get_json()["deleted"] == {"stories": 1, "pages": 3, "choices": 3, "images": 0}
+  assert db.stories.count_documents({"_id": ObjectId(story["id"])}) == 0
+  assert db.pages.count_documents({"storyId": ObjectId(story["id"])}) == 0
+  assert db.choices.count_documents({}) == 0
+  assert db.pages.count_documents({"storyId": ObjectId(other_id)}) == 1
+
+def test_delete_story_drops_its_cached_graph(client, user, story):
+  story_graphs.get(story["id"])
+  assert story_graphs.get_cached(story["id"]) is not None
+
+  client.delete(f"/stories/{user['id']}/{story['id']}", headers=story["headers"])
+
+  assert story_graphs.get_cached(story["id"]) is None
@@ -0,0 +1,43 @@
+import io
+import zipfile
+
+import pytest
+
+from routes.stories.story_export import _chunk_sink, _write_asset
+
+def write_asset(key:str) -> zipfile.ZipFile:
+  """
+  Write an asset to an archive, and return the archive read back.
+  """
+  sink = _chunk_sink()
+  with zipfile.ZipFile(sink, "w") as zf:
+    list(_write_asset(zf, key, sink))
+  return zipfile.ZipFile(io.BytesIO(b"".join(sink.chunks)))
+
+def test_asset_deleted_after_its_stat_is_skipped(s3, monkeypatch):
+  key = "/static/images/blobs/deleted.png"
+  s3.save(key, io.BytesIO(b"image"))
+  stat = s3.stat(key)
+  s3.delete(key)
+  monkeypatch.setattr(s3, "stat", lambda key: stat)
+
+  assert write_asset(key).namelist() == []
+
+def test_asset_shorter_than_its_stat_fails_the_export(s3, monkeypatch):
+  key = "/static/images/blobs/truncated.png"
+  s3.save(key, io.BytesIO(b"image"))
+  monkeypatch.setattr(s3, "open", lambda key: io.BytesIO(b"ima"))
+
+  with pytest.raises(Exception, match="3 bytes written instead of 5"):
+    write_asset(key)
+
+def test_asset_failing_during_its_copy_fails_the_export(s3, monkeypatch):
+  key = "/static/images/blobs/lost.png"
+  s3.save(key, io.BytesIO(b"image"))
+  class lost_source(io.BytesIO):
+    def read(self, size=-1):
+      raise FileNotFoundError(f"Asset {key} not found.")
+  monkeypatch.setattr(s3, "open", lambda key: lost_source())
+
+  with pytest.raises(FileNotFoundError):
+    write_asset(key)
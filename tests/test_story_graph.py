@@ -0,0 +1,11 @@
+from routes.stories.story_graph import load_story_graph
+
+def test_story_graph_stitches_the_pages_and_their_choices(story):
+  graph = load_story_graph(story["id"])
+
+  assert graph["title"] == "The maze"
+  assert [page["title"] for page in graph["pages"]] == ["Entrance", "Left door", "Exit"]
+  assert [[choice["title"] for choice in page["choices"]] for page in graph["pages"]] == [["Go left", "Go right"], ["Follow the corridor"], []]
+
+def test_story_graph_of_a_missing_story(db):
+  assert load_story_graph("0" * 24) is None
@@ -0,0 +1,99 @@
+import time
+
+import fakeredis
+import pytest
+
+import routes.pages.pages_service as pages_service_module
+import routes.stories.story_graph as story_graph
+from routes.stories.story_graph import story_graph_cache, story_graphs
+from utils.cache import cache_backend, memory_cache_backend, redis_cache_backend
+
+def page_titles(graph:dict) -> list[str]:
+  return [page["title"] for page in graph["pages"]]
+
+def test_page_update_invalidates_the_graph(client, story):
+  first = story["pages"][0]
+  assert story_graphs.get(story["id"])["pages_by_id"][first["id"]]["title"] == "Entrance"
+
+  client.put(f"/pages/page/{first['id']}", json={"title": "Hall"}, headers=story["headers"])
+
+  assert story_graphs.get_cached(story["id"]) is None
+  assert story_graphs.get(story["id"])["pages_by_id"][first["id"]]["title"] == "Hall"
+
+def test_choice_writes_invalidate_the_graph(client, story):
+  left, exit_page = story["pages"][1], story["pages"][2]
+  story_graphs.get(story["id"])
+
+  choice = client.post(f"/choices/{exit_page['id']}", json={"pageId": exit_page["id"], "sendToPageId": left["id"], "title": "Go back"}, headers=story["headers"]).get_json()["choice"]
+
+  assert story_graphs.get_cached(story["id"]) is None
+  assert [c["title"] for c in story_graphs.get(story["id"])["pages_by_id"][exit_page["id"]]["choices"]] == ["Go back"]
+
+  client.delete(f"/choices/choice/{choice['id']}", headers=story["headers"])
+
+  assert story_graphs.get(story["id"])["pages_by_id"][exit_page["id"]]["choices"] == []
+
+def test_graph_loaded_during_a_write_is_not_cached(story):
+  cache = story_graph_cache(backend=memory_cache_backend())
+  load = cache._load
+  def load_while_written(story_id):
+    graph = load(story_id)
+    cache.invalidate(story_id)
+    return graph
+  cache._load = load_while_written
+
+  cache.get(story["id"])
+
+  assert cache.get_cached(story["id"]) is None
+  # The loads in progress are forgotten once finished
+  assert cache.loading == {}
+
+def test_graph_loaded_before_the_commit_is_not_served(client, story, monkeypatch):
+  first = story["pages"][0]
+  previous = story_graphs._load(story["id"])
+  def run_in_transaction(callback):
+    result = callback(None)
+    # A request served between the writes and the commit still reads the previous documents
+    with monkeypatch.context() as patch:
+      patch.setattr(story_graphs, "_load", lambda story_id: previous)
+      story_graphs.get(story["id"])
+    return result
+  monkeypatch.setattr(pages_service_module, "run_in_transaction", run_in_transaction)
+
+  client.put(f"/pages/page/{first['id']}", json={"title": "Hall"}, headers=story["headers"])
+
+  assert story_graphs.get(story["id"])["pages_by_id"][first["id"]]["title"] == "Hall"
+
+def test_shared_tier_serves_other_workers_until_invalidated(story, monkeypatch):
+  server = fakeredis.FakeServer()
+  worker_a = story_graph_cache(backend=redis_cache_backend(client=fakeredis.FakeRedis(server=server)))
+  worker_b = story_graph_cache(backend=redis_cache_backend(client=fakeredis.FakeRedis(server=server)))
+  worker_a.get(story["id"])
+
+  def load_from_database(*args, **kwargs):
+    raise AssertionError("The graph should be read from the shared tier")
+  with monkeypatch.context() as patch:
+    patch.setattr(story_graph, "load_pages_with_choices", load_from_database)
+    assert page_titles(worker_b.get(story["id"])) == ["Entrance", "Left door", "Exit"]
+
+  version = worker_a.version(story["id"])
+  worker_a.invalidate(story["id"])
+
+  # The serialized graph of the previous version is not read anymore
+  assert worker_b.version(story["id"]) == version + 1
+  assert worker_b.backend.get(f"ariane:story:{story['id']}:v{version + 1}:graph") is None
+
+def test_memory_backend_honours_the_ttl_and_bounds_its_counters():
+  backend = memory_cache_backend(maxsize=2, ttl=3600)
+  backend.set("graph", b"data", ttl=0.01)
+  time.sleep(0.02)
+  assert backend.get("graph") is None
+
+  for key in ("a", "b", "c"):
+    backend.incr(key)
+  assert backend.get("a") is None
+  assert backend.get("c") == b"1"
+
+def test_cache_backend_is_abstract():
+  with pytest.raises(TypeError):
+    cache_backend()
@@ -0,0 +1,114 @@
+import io
+import json
+import zipfile
+
+from bson.objectid import ObjectId
+from flask import Request
+
+import routes.stories.stories_controller as stories_controller
+from utils.uploads import MULTIPART_OVERHEAD
+
+def archive(story:dict) -> bytes:
+  """
+  Build an .ariane archive holding a story.json.
+  """
+  buffer = io.BytesIO()
+  with zipfile.ZipFile(buffer, "w") as zf:
+    zf.writestr("story.json", json.dumps(story))
+  return buffer.getvalue()
+
+def import_archive(client, data:bytes, dry_run:bool=False):
+  url = "/stories/import_story" + ("?dry_run=1" if dry_run else "")
+  return client.post(url, data={"file": (io.BytesIO(data), "story.ariane")}, content_type="multipart/form-data")
+
+def counts(db) -> tuple[int, int, int]:
+  return db.stories.count_documents({}), db.pages.count_documents({}), db.choices.count_documents({})
+
+def looping_story(user_id:str) -> dict:
+  """
+  A story whose two middle pages lead to the same end, which loops back to the first page, plus an orphan page.
+  """
+  first, left, right, end, orphan = (str(ObjectId()) for _ in range(5))
+  return {"title": "Loops", "userId": user_id, "pages": [
+    {"id": first, "title": "First", "first": True, "choices": [{"title": "Left", "sendToPageId": left}, {"title": "Right", "sendToPageId": right}]},
+    {"id": left, "title": "Left", "choices": [{"title": "On", "sendToPageId": end}]},
+    {"id": right, "title": "Right", "choices": [{"title": "On", "sendToPageId": end}]},
+    {"id": end, "title": "End", "choices": [{"title": "Again", "sendToPageId": first}]},
+    {"id": orphan, "title": "Orphan"},
+  ]}
+
+def test_import_creates_shared_and_looping_pages_once(client, user, db):
+  response = import_archive(client, archive(looping_story(user["id"])))
+
+  assert response.status_code == 200
+  assert response.get_json()["imported"] == {"pages": 4, "choices": 5, "images": 0}
+  story_id = ObjectId(response.get_json()["storyId"])
+  assert sorted(page["title"] for page in db.pages.find({"storyId": story_id})) == ["End", "First", "Left", "Right"]
+  assert db.choices.count_documents({"storyId": story_id}) == 5
+
+def test_dry_run_reports_without_writing(client, user, db):
+  before = counts(db)
+
+  response = import_archive(client, archive(looping_story(user["id"])), dry_run=True)
+
+  report = response.get_json()["report"]
+  assert response.status_code == 200
+  assert report["valid"] is True
+  assert report["reachablePages"] == 4
+  assert report["warnings"] == ["1 page is not reachable from the first page and will not be imported."]
+  assert counts(db) == before
+
+def test_invalid_archive_is_rejected_before_writing(client, user, db):
+  story = looping_story(user["id"])
+  story["pages"][0]["first"] = False
+  story["pages"][1]["choices"].append({"title": "Nowhere", "sendToPageId": str(ObjectId())})
+  before = counts(db)
+
+  response = import_archive(client, archive(story))
+
+  body = response.get_json()
+  assert response.status_code == 400
+  assert body["report"]["valid"] is False
+  errors = " ".join(body["report"]["errors"])
+  assert "no first page" in errors
+  assert "missing from the archive" in errors
+  assert counts(db) == before
+
+def test_missing_image_is_reported(client, user, db):
+  story = looping_story(user["id"])
+  story["pages"][2]["image"] = "/static/images/blobs/missing.png"
+
+  response = import_archive(client, archive(story))
+
+  assert response.status_code == 400
+  assert response.get_json()["report"]["errors"] == ["The image /static/images/blobs/missing.png is missing from the archive."]
+  assert counts(db) == (0, 0, 0)
+
+def test_not_an_archive(client):
+  response = import_archive(client, b"not a zip")
+
+  assert response.status_code == 400
+
+def test_upload_announcing_a_larger_archive_is_rejected(client, user, db, monkeypatch):
+  monkeypatch.setattr(stories_controller, "IMPORT_MAX_BYTES", 10)
+  def load_form_data(self):
+    raise AssertionError("The form should not be read")
+  monkeypatch.setattr(Request, "_load_form_data", load_form_data)
+
+  response = import_archive(client, archive(looping_story(user["id"])) + b"\0" * MULTIPART_OVERHEAD)
+
+  assert response.status_code == 413
+  assert counts(db) == (0, 0, 0)
+
+def test_exported_story_imports_back(client, user, story, db):
+  exported = client.post(f"/stories/upload_story/{story['id']}").get_data()
+
+  response = import_archive(client, exported)
+
+  assert response.status_code == 200
+  assert response.get_json()["imported"] == {"pages": 3, "choices": 3, "images": 0}
+  copy = db.stories.find_one({"_id": ObjectId(response.get_json()["storyId"])})
+  assert copy["title"] == "The maze"
+  # The exported archive does not carry the urls of the responses
+  with zipfile.ZipFile(io.BytesIO(exported)) as zf:
+    assert "coverUrl" not in json.loads(zf.read("story.json"))
@@ -0,0 +1,20 @@
+import io
+
+from flask import Request
+
+import utils.uploads as uploads
+
+def test_upload_announcing_a_larger_image_is_rejected(client, story, monkeypatch):
+  monkeypatch.setattr(uploads, "IMAGE_MAX_BYTES", 1000)
+  page = story["pages"][0]
+  image = b"\x89PNG" + b"\0" * (uploads.MULTIPART_OVERHEAD + 1000)
+  def load_form_data(self):
+    raise AssertionError("The form should not be read")
+  monkeypatch.setattr(Request, "_load_form_data", load_form_data)
+
+  multipart = client.put(f"/pages/page/{page['id']}/image", data={"file": (io.BytesIO(image), "page.png")}, content_type="multipart/form-data", headers=story["headers"])
+  raw = client.put(f"/pages/page/{page['id']}/image", data=image[:1001], content_type="image/png", headers=story["headers"])
+
+  assert multipart.status_code == 413
+  assert raw.status_code == 413
+  assert multipart.get_json() == {"error": "The image exceeds the maximum size of 1000 bytes."}
@@ -0,0 +1,367 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import abc
+import shutil
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.files import local_path
+
+CHUNK_SIZE = 64 * 1024
+
+class asset_store(abc.ABC):
+  """
+  Interface of the storage of the uploaded images and their derivatives.
+
+  Assets are identified by their key, the url stored on the documents, e.g.
+  "/static/images/pages/<id>.png". Reads and writes are streamed, and the
+  renderers get a local file through local_path.
+  """
+  @abc.abstractmethod
+  def open(self, key:str):
+    """
+    Open an asset for reading.
+
+    Args:
+        key (str): The key of the asset.
+
+    Returns:
+        A readable binary stream, to be closed by the caller.
+
+    Raises:
+        FileNotFoundError: If the asset does not exist.
+    """
+
+  @abc.abstractmethod
+  def save(self, key:str, stream) -> None:
+    """
+    Write an asset from a readable binary stream, replacing it if it exists.
+    """
+
+  @abc.abstractmethod
+  def save_file(self, key:str, path:str) -> None:
+    """
+    Move a local file, e.g. a validated upload, to an asset.
+    """
+
+  @abc.abstractmethod
+  def delete(self, key:str) -> bool:
+    """
+    Delete an asset.
+
+    Returns:
+        bool: True if the asset existed.
+    """
+
+  @abc.abstractmethod
+  def stat(self, key:str) -> dict:
+    """
+    Return the size in "bytes" and the "modified" timestamp of an asset, or None if it does not exist.
+    """
+
+  def stat_all(self, keys:list[str]) -> dict:
+    """
+    Return the stat of several assets, e.g. an image and its derivatives, as a dict of key => stat or None.
+    """
+    return {key: self.stat(key) for key in keys}
+
+  @abc.abstractmethod
+  def local_path(self, key:str, version:str=None) -> str:
+    """
+    Return a local file with the content of an asset, for the libraries reading files (fpdf, Pillow).
+
+    Args:
+        key (str): The key of the asset.
+        version (str, optional): What changes with the content of the asset, e.g. the sha256 recorded
+            on the document of an image, so the store does not have to be asked for it.
+
+    Raises:
+        FileNotFoundError: If the asset does not exist.
+    """
+
+  def cached_path(self, key:str, version:str) -> str:
+    """
+    Return the local file of a version of an asset if local_path already fetched it, without reading the store.
+
+    Returns:
+        str: The path of the file, or None if it is not cached.
+    """
+    return None
+
+  @abc.abstractmethod
+  def url(self, key:str) -> str:
+    """
+    Return the url the clients download an asset from.
+    """
+
+class local_asset_store(asset_store):
+  """
+  Asset store of the files of the static directory, served by flask with ETags.
+  """
+  def _path(self, key:str) -> str:
+    path = local_path(key)
+    if not path:
+      raise FileNotFoundError(f"Asset {key} not found.")
+    return path
+
+  def open(self, key:str):
+    return open(self._path(key), "rb")
+
+  def save(self, key:str, stream) -> None:
+    path = self._path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+      with open(temporary_path, "wb") as f:
+        shutil.copyfileobj(stream, f, CHUNK_SIZE)
+      os.replace(temporary_path, path)
+    except BaseException:
+      if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+      raise
+
+  def save_file(self, key:str, path:str) -> None:
+    target = self._path(key)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+      os.replace(path, target)
+    except OSError:
+      # The file is on another file system
+      with open(path, "rb") as f:
+        self.save(key, f)
+      os.remove(path)
+
+  def delete(self, key:str) -> bool:
+    try:
+      os.remove(self._path(key))
+      return True
+    except FileNotFoundError:
+      return False
+
+  def stat(self, key:str) -> dict:
+    try:
+      stat = os.stat(self._path(key))
+    except FileNotFoundError:
+      return None
+    return {"bytes": stat.st_size, "modified": stat.st_mtime_ns / 1e9}
+
+  def local_path(self, key:str, version:str=None) -> str:
+    path = self._path(key)
+    if not os.path.isfile(path):
+      raise FileNotFoundError(f"Asset {key} not found.")
+    return path
+
+  def url(self, key:str) -> str:
+    return key
+
+class s3_asset_store(asset_store):
+  """
+  Asset store of an S3 protocol bucket (AWS, MinIO...), shared by all the nodes.
+
+  Clients download the assets from presigned urls, and the renderers from a
+  local copy kept in a cache directory until the object changes. A copy named
+  after the version recorded on the document is used without any request.
+  """
+  def __init__(self, bucket:str, prefix:str="", endpoint_url:str=None, url_ttl:int=3600, cache_dir:str=None, client=None):
+    """
+    Initialize a new s3_asset_store object.
+
+    Args:
+        bucket (str): The name of the bucket.
+        prefix (str): The prefix of the object names, e.g. "ariane/".
+        endpoint_url (str, optional): The url of the server, e.g. "http://localhost:9000" for MinIO.
+        url_ttl (int): The number of seconds a presigned url stays valid.
+        cache_dir (str, optional): The directory of the local copies, a temporary one by default.
+        client (optional): An already created boto3 client, e.g. a moto one.
+    """
+    if client is None:
+      try:
+        import boto3
+      except ImportError as e:
+        raise ImportError("The s3 asset store requires the boto3 package (pip install boto3).") from e
+      client = boto3.client("s3", endpoint_url=endpoint_url)
+    self.client = client
+    self.bucket = bucket
+    self.prefix = prefix
+    self.url_ttl = url_ttl
+    self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), "ariane-assets")
+
+  def _name(self, key:str) -> str:
+    return self.prefix + key.lstrip("/")
+
+  def _not_found(self, error) -> bool:
+    return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+  def open(self, key:str):
+    try:
+      return self.client.get_object(Bucket=self.bucket, Key=self._name(key))["Body"]
+    except self.client.exceptions.ClientError as e:
+      if self._not_found(e):
+        raise FileNotFoundError(f"Asset {key} not found.") from e
+      raise
+
+  def save(self, key:str, stream) -> None:
+    # upload_fileobj sends large streams as a multipart upload
+    self.client.upload_fileobj(stream, self.bucket, self._name(key))
+
+  def save_file(self, key:str, path:str) -> None:
+    self.client.upload_file(path, self.bucket, self._name(key))
+    os.remove(path)
+
+  def delete(self, key:str) -> bool:
+    existed = self.stat(key) is not None
+    self.client.delete_object(Bucket=self.bucket, Key=self._name(key))
+    return existed
+
+  def _head(self, key:str) -> dict:
+    try:
+      return self.client.head_object(Bucket=self.bucket, Key=self._name(key))
+    except self.client.exceptions.ClientError as e:
+      if self._not_found(e):
+        return None
+      raise
+
+  def stat(self, key:str) -> dict:
+    head = self._head(key)
+    if head is None:
+      return None
+    return {"bytes": head["ContentLength"], "modified": head["LastModified"].timestamp()}
+
+  def stat_all(self, keys:list[str]) -> dict:
+    names = {self._name(key): key for key in keys}
+    prefix = os.path.commonprefix(list(names))
+    if len(names) < 2 or not os.path.basename(prefix):
+      # Not variants of the same asset, a listing could return the whole directory
+      return super().stat_all(keys)
+    # A single listing of the keys starting like the asset, instead of one request per key
+    stats = dict.fromkeys(keys)
+    paginator = self.client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+      for item in page.get("Contents", []):
+        if item["Key"] in names:
+          stats[names[item["Key"]]] = {"bytes": item["Size"], "modified": item["LastModified"].timestamp()}
+    return stats
+
+  def _copy_path(self, key:str, version:str) -> str:
+    return os.path.join(self.cache_dir, hashlib.sha1(f"{key}:{version}".encode()).hexdigest() + os.path.splitext(key)[1])
+
+  def cached_path(self, key:str, version:str) -> str:
+    path = self._copy_path(key, version)
+    return path if os.path.exists(path) else None
+
+  def local_path(self, key:str, version:str=None) -> str:
+    if version is None:
+      head = self._head(key)
+      if head is None:
+        raise FileNotFoundError(f"Asset {key} not found.")
+      # The ETag changes with the content, so an outdated copy is never used
+      version = head["ETag"]
+    path = self._copy_path(key, version)
+    if not os.path.exists(path):
+      os.makedirs(self.cache_dir, exist_ok=True)
+      temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+      try:
+        self.client.download_file(self.bucket, self._name(key), temporary_path)
+      except self.client.exceptions.ClientError as e:
+        if os.path.exists(temporary_path):
+          os.remove(temporary_path)
+        if self._not_found(e):
+          raise FileNotFoundError(f"Asset {key} not found.") from e
+        raise
+      os.replace(temporary_path, path)
+    return path
+
+  def url(self, key:str) -> str:
+    return self.client.generate_presigned_url("get_object", Params={"Bucket": self.bucket, "Key": self._name(key)}, ExpiresIn=self.url_ttl)
+
+# Store selected with ASSET_STORE=local|s3, and for s3 ASSET_S3_BUCKET, ASSET_S3_PREFIX,
+# ASSET_S3_ENDPOINT_URL (e.g. MinIO), ASSET_URL_TTL and ASSET_CACHE_DIR
+ASSET_STORE = os.environ.get("ASSET_STORE", "local")
+
+_store = None
+
+def get_asset_store() -> asset_store:
+  """
+  Return the asset store configured for the deployment, created on first use.
+
+  Returns:
+      asset_store: The asset store.
+  """
+  global _store
+  if _store is None:
+    if ASSET_STORE == "s3":
+      _store = s3_asset_store(
+        os.environ["ASSET_S3_BUCKET"],
+        prefix=os.environ.get("ASSET_S3_PREFIX", ""),
+        endpoint_url=os.environ.get("ASSET_S3_ENDPOINT_URL"),
+        url_ttl=int(os.environ.get("ASSET_URL_TTL", 3600)),
+        cache_dir=os.environ.get("ASSET_CACHE_DIR"),
+      )
+    else:
+      _store = local_asset_store()
+  return _store
+
+def set_asset_store(store:asset_store) -> None:
+  """
+  Replace the asset store, e.g. with one using a moto client.
+
+  Args:
+      store (asset_store): The store to use.
+  """
+  global _store
+  _store = store
+
+def temporary_path(suffix:str="") -> str:
+  """
+  Create a temporary file to write an asset to before moving it to the store with save_file.
+
+  Args:
+      suffix (str): The extension of the file, e.g. ".jpg".
+
+  Returns:
+      str: The path of the empty file, readable by everyone like the other static files.
+  """
+  fd, path = tempfile.mkstemp(suffix=suffix, prefix="asset-")
+  os.close(fd)
+  os.chmod(path, 0o644)
+  return path
+
+# A single thread is enough to delete assets without blocking the requests
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="assets")
+
+def delete_assets(keys:list[str]) -> int:
+  """
+  Delete assets, missing ones are ignored.
+
+  Args:
+      keys (list[str]): The keys of the assets to delete.
+
+  Returns:
+      int: The number of assets deleted.
+  """
+  store = get_asset_store()
+  deleted = 0
+  for key in keys:
+    try:
+      deleted += store.delete(key)
+    except FileNotFoundError:
+      pass
+    except Exception as e:
+      print(f"Failed to delete {key}: {e}")
+  return deleted
+
+def delete_assets_in_background(keys:list[str]):
+  """
+  Delete assets in a background thread.
+
+  Args:
+      keys (list[str]): The keys of the assets to delete.
+
+  Returns:
+      Future: The future of the number of assets deleted.
+  """
+  return _executor.submit(delete_assets, list(keys))
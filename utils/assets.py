@@ -0,0 +1,48 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from utils.asset_store import get_asset_store
+from utils.images import current_derivative, derivative_url
+
+def asset_key(url:str, variant:str=None) -> str:
+  """
+  Return the key of the asset a renderer uses for an image.
+
+  Args:
+      url (str): The url of the image, e.g. "/static/images/pages/<id>.png".
+      variant (str, optional): The derivative to use when it is up to date, e.g. "print".
+
+  Returns:
+      str: The key of the derivative if requested and available, of the original otherwise.
+  """
+  if variant:
+    return current_derivative(url, variant) or url
+  return url
+
+def resolve_asset(url:str, variant:str=None, info:dict=None) -> str:
+  """
+  Resolve a stored asset url to a file readable by the renderers.
+
+  With the metadata recorded on the document, the local copy of the image or
+  of its derivative is named after the sha256 of the image, so the store is
+  only read the first time a version is rendered.
+
+  Args:
+      url (str): The url of the asset, e.g. "/static/images/pages/<id>.png".
+      variant (str, optional): The derivative to use when it is up to date, e.g. "print".
+      info (dict, optional): The metadata of the image stored on its document, with its "sha256".
+
+  Returns:
+      str: The path of a local file with the content of the asset, the derivative if requested and available.
+
+  Raises:
+      FileNotFoundError: If the asset does not exist.
+  """
+  store = get_asset_store()
+  version = info.get("sha256") if info else None
+  if variant and version:
+    path = store.cached_path(derivative_url(url, variant), version)
+    if path:
+      return path
+  return store.local_path(asset_key(url, variant), version)
@@ -0,0 +1,175 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import time
+
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+
+from utils.database import get_db
+
+class assets_repository:
+  """
+  Repository of the content addressed images.
+
+  Each document is identified by the sha256 of an image and counts the page
+  and story documents referencing it, so identical uploads are stored once and
+  the file is only deleted when its last reference goes away.
+
+  An image without reference keeps its document until its files are deleted.
+  The deletion is claimed with a token on the document while the refcount is
+  still zero, and an upload referencing the image again in the meantime waits
+  for the files to be gone before storing them again.
+  """
+  # Every query is on _id
+  indexes = []
+  queries = [
+    {"filter": {"_id": "0" * 64}},
+  ]
+
+  def __init__(self):
+    """
+    Initialize a new assets_repository object.
+    """
+    self.collection_name = "assets"
+
+  @property
+  def collection(self):
+    """
+    Return the assets collection of the shared MongoDB client.
+    """
+    return get_db()[self.collection_name]
+
+  def acquire(self, digest:str, key:str, info:dict) -> bool:
+    """
+    Add a reference to an image, recording it on its first upload.
+
+    Args:
+        digest (str): The sha256 of the image.
+        key (str): The key of the image in the asset store.
+        info (dict): The metadata of the image ("width", "height" and "bytes").
+
+    Returns:
+        bool: True if the image was not referenced yet, so its file has to be stored.
+
+    Raises:
+        Exception: If an error occurs while updating the reference count.
+    """
+    try:
+      previous = self.collection.find_one_and_update(
+        {"_id": digest},
+        {
+          "$inc": {"refs": 1},
+          "$setOnInsert": {"key": key, "width": info.get("width"), "height": info.get("height"), "bytes": info.get("bytes")},
+        },
+        upsert=True,
+        return_document=ReturnDocument.BEFORE,
+      )
+      if previous is not None and previous.get("deleting"):
+        # The files are being deleted, store them again once it is done
+        self._wait_deletion(digest, previous["deleting"])
+      return previous is None or previous.get("refs", 0) <= 0
+    except Exception as e:
+      raise Exception(f"Failed to reference image {key}: {e}") from e
+
+  def _wait_deletion(self, digest:str, token:ObjectId, timeout:float=30) -> None:
+    """
+    Wait until the deletion of the files of an image claimed with token is finished.
+
+    A claim older than timeout seconds is considered abandoned, e.g. by a crashed worker, and released.
+    """
+    while self.collection.find_one({"_id": digest, "deleting": token}, {"_id": 1}) is not None:
+      if time.time() - token.generation_time.timestamp() > timeout:
+        self.collection.update_one({"_id": digest, "deleting": token}, {"$unset": {"deleting": ""}})
+        return
+      time.sleep(0.05)
+
+  def retain(self, digest:str) -> bool:
+    """
+    Add a reference to an image already stored, e.g. when a document is created with the url of another one.
+
+    Args:
+        digest (str): The sha256 of the image.
+
+    Returns:
+        bool: True if the image is known.
+
+    Raises:
+        Exception: If an error occurs while updating the reference count.
+    """
+    try:
+      result = self.collection.update_one({"_id": digest, "refs": {"$gt": 0}}, {"$inc": {"refs": 1}})
+      return result.matched_count == 1
+    except Exception as e:
+      raise Exception(f"Failed to reference image {digest}: {e}") from e
+
+  def release(self, digest:str) -> bool:
+    """
+    Remove a reference to an image.
+
+    Args:
+        digest (str): The sha256 of the image.
+
+    Returns:
+        bool: True if no document references the image anymore, so its files can be deleted with claim_deletion.
+
+    Raises:
+        Exception: If an error occurs while updating the reference count.
+    """
+    try:
+      asset = self.collection.find_one_and_update(
+        {"_id": digest, "refs": {"$gt": 0}},
+        {"$inc": {"refs": -1}},
+        return_document=ReturnDocument.AFTER,
+      )
+      return asset is not None and asset["refs"] <= 0
+    except Exception as e:
+      raise Exception(f"Failed to release image {digest}: {e}") from e
+
+  def claim_deletion(self, digest:str) -> tuple[str, ObjectId]:
+    """
+    Claim the deletion of the files of an image, if it is still not referenced.
+
+    Args:
+        digest (str): The sha256 of the image.
+
+    Returns:
+        tuple[str, ObjectId]: The key of the image and the token to pass to finish_deletion, or None if
+        the image was referenced again or its deletion is already claimed.
+
+    Raises:
+        Exception: If an error occurs while updating the image.
+    """
+    token = ObjectId()
+    try:
+      asset = self.collection.find_one_and_update(
+        {"_id": digest, "refs": {"$lte": 0}, "deleting": None},
+        {"$set": {"deleting": token}},
+        return_document=ReturnDocument.AFTER,
+      )
+      return (asset["key"], token) if asset else None
+    except Exception as e:
+      raise Exception(f"Failed to claim the deletion of image {digest}: {e}") from e
+
+  def finish_deletion(self, digest:str, token:ObjectId) -> bool:
+    """
+    Forget an image once its files are deleted, unless it was referenced again meanwhile.
+
+    Args:
+        digest (str): The sha256 of the image.
+        token (ObjectId): The token returned by claim_deletion.
+
+    Returns:
+        bool: True if the image was forgotten, False if an upload referenced it again and stores it anew.
+
+    Raises:
+        Exception: If an error occurs while updating the image.
+    """
+    try:
+      if self.collection.delete_one({"_id": digest, "refs": {"$lte": 0}, "deleting": token}).deleted_count:
+        return True
+      self.collection.update_one({"_id": digest, "deleting": token}, {"$unset": {"deleting": ""}})
+      return False
+    except Exception as e:
+      raise Exception(f"Failed to forget image {digest}: {e}") from e
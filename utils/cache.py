@@ -0,0 +1,445 @@
+import abc
+import os
+import threading
+import time
+from collections import OrderedDict
+
+class ttl_lru_cache:
+  """
+  Thread safe LRU cache whose entries also expire after a time to live.
+
+  The cache keeps hit, miss, eviction, expiration and invalidation counters.
+  """
+  def __init__(self, maxsize:int=128, ttl:float=60, on_remove=None):
+    """
+    Initialize a new ttl_lru_cache object.
+
+    Args:
+        maxsize (int): The maximum number of entries, the least recently used one is evicted beyond it.
+        ttl (float): The number of seconds an entry stays valid, 0 to never expire.
+        on_remove (callable, optional): Called with (key, value) whenever an entry leaves the cache.
+    """
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.on_remove = on_remove
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.expirations = 0
+    self.invalidations = 0
+
+  def _remove(self, key) -> None:
+    """
+    Remove an entry, the lock must be held.
+    """
+    value, _ = self._entries.pop(key)
+    if self.on_remove:
+      self.on_remove(key, value)
+
+  def get(self, key, default=None):
+    """
+    Return the value cached for a key.
+
+    Args:
+        key: The key of the entry.
+        default: The value returned when the key is missing or expired.
+
+    Returns:
+        The cached value, or default.
+    """
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        self.misses += 1
+        return default
+      value, expires_at = entry
+      if expires_at and expires_at < time.monotonic():
+        self._remove(key)
+        self.expirations += 1
+        self.misses += 1
+        return default
+      self._entries.move_to_end(key)
+      self.hits += 1
+      return value
+
+  def peek(self, key, default=None):
+    """
+    Return the value cached for a key without updating the counters nor the LRU order.
+    """
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None or (entry[1] and entry[1] < time.monotonic()):
+        return default
+      return entry[0]
+
+  def set(self, key, value, ttl:float=None) -> None:
+    """
+    Cache a value, evicting the least recently used entries beyond maxsize.
+
+    Args:
+        key: The key of the entry.
+        value: The value to cache.
+        ttl (float, optional): The number of seconds the entry stays valid, the ttl of the cache by default.
+    """
+    ttl = self.ttl if ttl is None else ttl
+    with self._lock:
+      if key in self._entries:
+        self._remove(key)
+      expires_at = time.monotonic() + ttl if ttl else None
+      self._entries[key] = (value, expires_at)
+      while len(self._entries) > self.maxsize:
+        oldest = next(iter(self._entries))
+        self._remove(oldest)
+        self.evictions += 1
+
+  def delete(self, key) -> bool:
+    """
+    Invalidate the entry of a key.
+
+    Args:
+        key: The key of the entry.
+
+    Returns:
+        bool: True if an entry was removed.
+    """
+    with self._lock:
+      if key not in self._entries:
+        return False
+      self._remove(key)
+      self.invalidations += 1
+      return True
+
+  def clear(self) -> None:
+    """
+    Invalidate every entry.
+    """
+    with self._lock:
+      for key in list(self._entries):
+        self._remove(key)
+        self.invalidations += 1
+
+  def stats(self) -> dict:
+    """
+    Return the counters of the cache.
+
+    Returns:
+        dict: The size and the hit, miss, eviction, expiration and invalidation counters.
+    """
+    with self._lock:
+      return {
+        "size": len(self._entries),
+        "maxSize": self.maxsize,
+        "ttl": self.ttl,
+        "hits": self.hits,
+        "misses": self.misses,
+        "evictions": self.evictions,
+        "expirations": self.expirations,
+        "invalidations": self.invalidations,
+      }
+
+class disk_lru_cache:
+  """
+  Cache of files in a directory, evicting the least recently used ones beyond a total size.
+
+  The modification time of a file is its last use, so the cache is shared by
+  every worker of the node and survives restarts.
+  """
+  def __init__(self, directory:str, max_bytes:int, suffix:str=""):
+    """
+    Initialize a new disk_lru_cache object.
+
+    Args:
+        directory (str): The directory of the cached files.
+        max_bytes (int): The total size of the files beyond which the least recently used ones are evicted.
+        suffix (str): The extension of the cached files, e.g. ".pdf".
+    """
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self.suffix = suffix
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._lock = threading.Lock()
+
+  def path(self, key:str) -> str:
+    """
+    Return the path of the file of a key, whether it is cached or not.
+    """
+    return os.path.join(self.directory, f"{key}{self.suffix}")
+
+  def get(self, key:str) -> str:
+    """
+    Return the path of the cached file of a key and mark it as recently used.
+
+    Args:
+        key (str): The key of the file.
+
+    Returns:
+        str: The path of the file, or None if it is not cached.
+    """
+    path = self.path(key)
+    try:
+      os.utime(path)
+    except FileNotFoundError:
+      self.misses += 1
+      return None
+    self.hits += 1
+    return path
+
+  def add(self, key:str) -> None:
+    """
+    Register the file written at path(key) and evict the least recently used files beyond max_bytes.
+
+    Args:
+        key (str): The key of the file.
+    """
+    with self._lock:
+      files = []
+      total = 0
+      for entry in os.scandir(self.directory):
+        if not entry.name.endswith(self.suffix) or not entry.is_file():
+          continue
+        stat = entry.stat()
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+        total += stat.st_size
+      files.sort()
+      for _, size, path in files:
+        if total <= self.max_bytes or path == self.path(key):
+          continue
+        try:
+          os.remove(path)
+          self.evictions += 1
+        except FileNotFoundError:
+          pass
+        total -= size
+
+  def stats(self) -> dict:
+    """
+    Return the counters of the cache.
+
+    Returns:
+        dict: The maximum size and the hit, miss and eviction counters.
+    """
+    return {
+      "maxBytes": self.max_bytes,
+      "hits": self.hits,
+      "misses": self.misses,
+      "evictions": self.evictions,
+    }
+
+class cache_backend(abc.ABC):
+  """
+  Interface of the cache tier shared by the workers.
+
+  Values are bytes. Counters and publish/subscribe are used to version the
+  cached entries and to broadcast invalidations to every worker.
+  """
+  # Whether the values are visible to the other workers
+  shared = False
+
+  @abc.abstractmethod
+  def get(self, key:str) -> bytes:
+    """
+    Return the value of a key, or None if it is missing or expired.
+    """
+
+  @abc.abstractmethod
+  def set(self, key:str, value:bytes, ttl:float=None) -> None:
+    """
+    Set the value of a key, expiring after ttl seconds or the default ttl of the backend.
+    """
+
+  @abc.abstractmethod
+  def add(self, key:str, value) -> bool:
+    """
+    Set a value only if the key does not exist yet, without expiration.
+    """
+
+  @abc.abstractmethod
+  def delete(self, key:str) -> None:
+    """
+    Delete a key.
+    """
+
+  @abc.abstractmethod
+  def incr(self, key:str) -> int:
+    """
+    Increment the counter of a key, created at 0 if missing, and return its new value.
+    """
+
+  @abc.abstractmethod
+  def publish(self, channel:str, message:str) -> None:
+    """
+    Send a message to the subscribers of a channel.
+    """
+
+  @abc.abstractmethod
+  def subscribe(self, channel:str, callback) -> None:
+    """
+    Call callback(message) for every message published on a channel, by any worker.
+    """
+
+class memory_cache_backend(cache_backend):
+  """
+  Cache backend kept in the memory of the worker, for single process deployments and development.
+  """
+  def __init__(self, maxsize:int=256, ttl:float=3600):
+    """
+    Initialize a new memory_cache_backend object.
+
+    Args:
+        maxsize (int): The maximum number of cached values, and of counters.
+        ttl (float): The default number of seconds a value is kept.
+    """
+    self.values = ttl_lru_cache(maxsize, ttl)
+    # Counters do not expire but the least recently used ones are evicted beyond maxsize
+    self.counters = ttl_lru_cache(maxsize, 0)
+    self.subscribers = {}
+    self._lock = threading.Lock()
+
+  def get(self, key:str) -> bytes:
+    counter = self.counters.get(key)
+    if counter is not None:
+      return str(counter).encode()
+    return self.values.get(key)
+
+  def set(self, key:str, value:bytes, ttl:float=None) -> None:
+    self.values.set(key, value, ttl)
+
+  def add(self, key:str, value) -> bool:
+    with self._lock:
+      if self.counters.peek(key) is not None:
+        return False
+      self.counters.set(key, int(value))
+      return True
+
+  def delete(self, key:str) -> None:
+    self.counters.delete(key)
+    self.values.delete(key)
+
+  def incr(self, key:str) -> int:
+    with self._lock:
+      counter = self.counters.peek(key, 0) + 1
+      self.counters.set(key, counter)
+      return counter
+
+  def publish(self, channel:str, message:str) -> None:
+    for callback in self.subscribers.get(channel, []):
+      callback(message)
+
+  def subscribe(self, channel:str, callback) -> None:
+    self.subscribers.setdefault(channel, []).append(callback)
+
+class redis_cache_backend(cache_backend):
+  """
+  Cache backend stored in a Redis protocol server, shared by all the workers.
+  """
+  shared = True
+
+  def __init__(self, url:str="redis://localhost:6379/0", ttl:float=3600, client=None):
+    """
+    Initialize a new redis_cache_backend object.
+
+    Args:
+        url (str): The url of the server.
+        ttl (float): The default number of seconds a value is kept.
+        client (optional): An already created client, e.g. a fakeredis one.
+    """
+    if client is None:
+      try:
+        import redis
+      except ImportError as e:
+        raise ImportError("The redis cache backend requires the redis package (pip install redis).") from e
+      client = redis.Redis.from_url(url)
+    self.client = client
+    self.ttl = ttl
+    self.subscribers = {}
+    self._pubsub_pid = None
+    self._pubsub_thread = None
+    self._lock = threading.Lock()
+
+  def _ensure_subscribed(self) -> None:
+    """
+    Listen to the subscribed channels in the current process.
+
+    The listening thread does not survive a fork, so it is started lazily by each worker.
+    """
+    if not self.subscribers or self._pubsub_pid == os.getpid():
+      return
+    with self._lock:
+      if self._pubsub_pid == os.getpid():
+        return
+      pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+      handlers = {}
+      for channel, callbacks in self.subscribers.items():
+        def handler(message, callbacks=callbacks):
+          data = message["data"]
+          for callback in callbacks:
+            callback(data.decode() if isinstance(data, bytes) else data)
+        handlers[channel] = handler
+      pubsub.subscribe(**handlers)
+      self._pubsub_thread = pubsub.run_in_thread(sleep_time=1, daemon=True)
+      self._pubsub_pid = os.getpid()
+
+  def get(self, key:str) -> bytes:
+    self._ensure_subscribed()
+    return self.client.get(key)
+
+  def set(self, key:str, value:bytes, ttl:float=None) -> None:
+    self.client.set(key, value, ex=int(ttl or self.ttl) or None)
+
+  def add(self, key:str, value) -> bool:
+    return bool(self.client.set(key, value, nx=True))
+
+  def delete(self, key:str) -> None:
+    self.client.delete(key)
+
+  def incr(self, key:str) -> int:
+    return self.client.incr(key)
+
+  def publish(self, channel:str, message:str) -> None:
+    self._ensure_subscribed()
+    self.client.publish(channel, message)
+
+  def subscribe(self, channel:str, callback) -> None:
+    with self._lock:
+      self.subscribers.setdefault(channel, []).append(callback)
+      # Listen again with the new channel list
+      if self._pubsub_thread is not None and self._pubsub_pid == os.getpid():
+        self._pubsub_thread.stop()
+      self._pubsub_thread = None
+      self._pubsub_pid = None
+
+# Backend selected with CACHE_BACKEND=memory|redis, CACHE_URL and CACHE_TTL
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory")
+CACHE_URL = os.environ.get("CACHE_URL", "redis://localhost:6379/0")
+CACHE_TTL = float(os.environ.get("CACHE_TTL", 3600))
+
+_backend = None
+
+def get_cache_backend() -> cache_backend:
+  """
+  Return the cache backend configured for the deployment, created on first use.
+
+  Returns:
+      cache_backend: The shared cache backend.
+  """
+  global _backend
+  if _backend is None:
+    if CACHE_BACKEND == "redis":
+      _backend = redis_cache_backend(CACHE_URL, CACHE_TTL)
+    else:
+      _backend = memory_cache_backend(ttl=CACHE_TTL)
+  return _backend
+
+def set_cache_backend(backend:cache_backend) -> None:
+  """
+  Replace the cache backend, e.g. with one using a fakeredis client.
+
+  Args:
+      backend (cache_backend): The backend to use.
+  """
+  global _backend
+  _backend = backend
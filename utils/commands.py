@@ -0,0 +1,64 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import click
+
+from utils.indexes import ensure_indexes, verify_indexes
+from utils.images import generate_missing_derivatives
+from routes.choices.choices_repository import choices_repository
+from routes.pages.pages_repository import pages_repository
+from routes.stories.stories_repository import stories_repository
+
+def register_commands(server) -> None:
+  """
+  Register the maintenance commands on the flask CLI.
+
+  Usage: flask --app app <command>
+
+  Args:
+      server (Flask): The flask application.
+  """
+  @server.cli.command("ensure-indexes")
+  def ensure_indexes_command():
+    """Create the indexes required by the repositories."""
+    for collection, names in ensure_indexes().items():
+      click.echo(f"{collection}: {', '.join(names)}")
+
+  @server.cli.command("verify-indexes")
+  def verify_indexes_command():
+    """Fail when a repository query does a collection scan."""
+    failed = False
+    for report in verify_indexes():
+      status = "COLLSCAN" if report["collscan"] else "ok"
+      click.echo(f"[{status}] {report['collection']} {report['filter']} -> {' > '.join(report['stages'])}")
+      failed = failed or report["collscan"]
+    if failed:
+      raise click.ClickException("Some queries are not covered by an index.")
+
+  @server.cli.command("backfill-choice-story-ids")
+  def backfill_choice_story_ids_command():
+    """Store the owning storyId on the choices created before it existed."""
+    modified = choices_repository().backfill_story_ids()
+    click.echo(f"{modified} choices updated")
+
+  @server.cli.command("repair-story-counters")
+  def repair_story_counters_command():
+    """Recompute the page, character, end and open node counters of every story."""
+    updated = stories_repository().recompute_counters()
+    click.echo(f"{updated} stories updated")
+
+  @server.cli.command("generate-image-derivatives")
+  @click.option("--force", is_flag=True, help="Regenerate the derivatives that are up to date.")
+  def generate_image_derivatives_command(force):
+    """Generate the print and thumbnail derivatives of the uploaded images."""
+    generated, failed = generate_missing_derivatives(force)
+    click.echo(f"{generated} images processed, {failed} failed")
+
+  @server.cli.command("backfill-image-info")
+  @click.option("--force", is_flag=True, help="Read the metadata of the images that already have it again.")
+  def backfill_image_info_command(force):
+    """Store the dimensions, size and hash of the images uploaded before they were recorded."""
+    covers, missing_covers = stories_repository().backfill_cover_info(force)
+    pages, missing_pages = pages_repository().backfill_image_info(force)
+    click.echo(f"{covers} stories and {pages} pages updated, {missing_covers + missing_pages} images not found")
@@ -0,0 +1,262 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import threading
+import time
+from collections import deque
+
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+from pymongo.monitoring import ConnectionPoolListener
+
+from configs.config_database import mongodb_uri
+
+DATABASE_NAME = "ariane"
+
+# Pool settings, overridable per deployment so workers can be sized against the Atlas connection limit
+MAX_POOL_SIZE = int(os.environ.get("MONGODB_MAX_POOL_SIZE", 50))
+MIN_POOL_SIZE = int(os.environ.get("MONGODB_MIN_POOL_SIZE", 0))
+WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGODB_WAIT_QUEUE_TIMEOUT_MS", 5000))
+MAX_IDLE_TIME_MS = int(os.environ.get("MONGODB_MAX_IDLE_TIME_MS", 60000))
+COMPRESSORS = os.environ.get("MONGODB_COMPRESSORS", "")
+
+class pool_metrics(ConnectionPoolListener):
+  """
+  Connection pool listener collecting checkout wait times.
+
+  The listener is registered on the shared client and keeps running totals
+  plus a window of the most recent samples to compute percentiles.
+  """
+  def __init__(self, window:int=1024):
+    """
+    Initialize a new pool_metrics object.
+
+    Args:
+        window (int): The number of recent checkout samples kept for percentiles.
+    """
+    self._lock = threading.Lock()
+    self._local = threading.local()
+    self._samples = deque(maxlen=window)
+    self.reset()
+
+  def reset(self) -> None:
+    """
+    Reset all counters.
+    """
+    with self._lock:
+      self.checkouts = 0
+      self.checkout_failures = 0
+      self.total_wait = 0.0
+      self.max_wait = 0.0
+      self.connections_created = 0
+      self.connections_closed = 0
+      self.checked_out = 0
+      self._samples.clear()
+
+  def _record_wait(self, event, failed:bool) -> None:
+    """
+    Record the time a thread waited for a connection.
+
+    Recent pymongo versions report the duration on the event itself, older ones
+    only tell when the checkout started so the start time is kept per thread.
+    """
+    wait = getattr(event, "duration", None)
+    started = getattr(self._local, "started", None)
+    if wait is None and started is not None:
+      wait = time.perf_counter() - started
+    self._local.started = None
+    with self._lock:
+      if failed:
+        self.checkout_failures += 1
+      else:
+        self.checkouts += 1
+        self.checked_out += 1
+      if wait is not None:
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self._samples.append(wait)
+
+  def snapshot(self) -> dict:
+    """
+    Return the current metrics.
+
+    Returns:
+        dict: Checkout counters and wait times in milliseconds.
+    """
+    with self._lock:
+      samples = sorted(self._samples)
+      checkouts = self.checkouts
+      def percentile(p):
+        if not samples:
+          return 0.0
+        return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+      return {
+        "maxPoolSize": MAX_POOL_SIZE,
+        "checkouts": checkouts,
+        "checkoutFailures": self.checkout_failures,
+        "checkedOut": self.checked_out,
+        "connectionsCreated": self.connections_created,
+        "connectionsClosed": self.connections_closed,
+        "waitAvgMs": (self.total_wait / checkouts * 1000) if checkouts else 0.0,
+        "waitMaxMs": self.max_wait * 1000,
+        "waitP50Ms": percentile(0.50),
+        "waitP95Ms": percentile(0.95),
+        "waitP99Ms": percentile(0.99),
+      }
+
+  def connection_check_out_started(self, event):
+    self._local.started = time.perf_counter()
+
+  def connection_checked_out(self, event):
+    self._record_wait(event, failed=False)
+
+  def connection_check_out_failed(self, event):
+    self._record_wait(event, failed=True)
+
+  def connection_checked_in(self, event):
+    with self._lock:
+      self.checked_out = max(0, self.checked_out - 1)
+
+  def connection_created(self, event):
+    with self._lock:
+      self.connections_created += 1
+
+  def connection_closed(self, event):
+    with self._lock:
+      self.connections_closed += 1
+
+  def connection_ready(self, event):
+    pass
+
+  def pool_created(self, event):
+    pass
+
+  def pool_ready(self, event):
+    pass
+
+  def pool_cleared(self, event):
+    pass
+
+  def pool_closed(self, event):
+    pass
+
+# Shared metrics for the whole process
+metrics = pool_metrics()
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+def _client_options() -> dict:
+  """
+  Build the keyword arguments used to create the shared MongoClient.
+
+  Returns:
+      dict: The MongoClient options.
+  """
+  options = {
+    "server_api": ServerApi('1'),
+    "maxPoolSize": MAX_POOL_SIZE,
+    "minPoolSize": MIN_POOL_SIZE,
+    "waitQueueTimeoutMS": WAIT_QUEUE_TIMEOUT_MS,
+    "maxIdleTimeMS": MAX_IDLE_TIME_MS,
+    "event_listeners": [metrics],
+  }
+  if COMPRESSORS:
+    options["compressors"] = COMPRESSORS
+  return options
+
+def get_client() -> MongoClient:
+  """
+  Return the MongoClient shared by every repository of the process.
+
+  The client is created on first use. A process forked after the client was
+  created (gunicorn/uwsgi pre-fork workers) gets its own client instead of
+  reusing the sockets inherited from the parent.
+
+  Returns:
+      MongoClient: The shared client.
+  """
+  global _client, _client_pid
+  pid = os.getpid()
+  if _client is None or _client_pid != pid:
+    with _client_lock:
+      if _client is None or _client_pid != pid:
+        _client = MongoClient(mongodb_uri, **_client_options())
+        _client_pid = pid
+  return _client
+
+def get_db():
+  """
+  Return the ariane database of the shared client.
+
+  Returns:
+      Database: The "ariane" database.
+  """
+  return get_client()[DATABASE_NAME]
+
+def close_client() -> None:
+  """
+  Close the shared client if it was created by the current process.
+  """
+  global _client, _client_pid
+  with _client_lock:
+    if _client is not None and _client_pid == os.getpid():
+      _client.close()
+    _client = None
+    _client_pid = None
+
+def _reset_after_fork() -> None:
+  """
+  Drop the inherited client in a forked child without closing the parent's sockets.
+  """
+  global _client, _client_pid, _client_lock
+  _client = None
+  _client_pid = None
+  _client_lock = threading.Lock()
+  metrics._lock = threading.Lock()
+  metrics.reset()
+
+if hasattr(os, "register_at_fork"):
+  os.register_at_fork(after_in_child=_reset_after_fork)
+
+_transactions_supported = {}
+
+def supports_transactions() -> bool:
+  """
+  Tell whether the deployment accepts multi-document transactions.
+
+  Transactions need a replica set or a sharded cluster, a standalone server
+  (usual in development) does not support them.
+
+  Returns:
+      bool: True if transactions can be started.
+  """
+  client = get_client()
+  key = id(client)
+  if key not in _transactions_supported:
+    hello = client.admin.command("hello")
+    _transactions_supported[key] = bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+  return _transactions_supported[key]
+
+def run_in_transaction(callback):
+  """
+  Run callback(session) in a transaction when the deployment supports it.
+
+  The transaction is committed when the callback returns and aborted if it
+  raises. It is retried by ClientSession.with_transaction on the errors
+  labelled TransientTransactionError (e.g. a write conflict or an election),
+  and its commit on UnknownTransactionCommitResult, so the callback may run
+  several times and must only have side effects on the database.
+
+  Args:
+      callback (callable): Called with the session to pass to the operations, or None without transaction support.
+
+  Returns:
+      The value returned by the callback.
+  """
+  if not supports_transactions():
+    return callback(None)
+  with get_client().start_session() as session:
+    return session.with_transaction(callback)
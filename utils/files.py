@@ -0,0 +1,22 @@
+import os
+
+# Root of the project, the stored image urls (/static/images/...) are relative to it
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+STATIC_DIR = os.path.join(ROOT_DIR, "static")
+
+def local_path(url:str) -> str:
+  """
+  Convert a stored static url to the path of the file on disk.
+
+  Args:
+      url (str): The url of the file, e.g. "/static/images/pages/<id>.png".
+
+  Returns:
+      str: The absolute path of the file, or None if the url points outside of the static directory.
+  """
+  if not url:
+    return None
+  path = os.path.realpath(os.path.join(ROOT_DIR, url.lstrip("/")))
+  if not path.startswith(STATIC_DIR + os.sep):
+    return None
+  return path
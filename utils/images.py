@@ -0,0 +1,213 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import hashlib
+
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from utils.asset_store import get_asset_store, temporary_path
+from utils.cache import ttl_lru_cache
+from utils.database import get_db
+
+# Maximum width in pixels of each derivative: A5 width at 300dpi for the PDF, and a web thumbnail
+DERIVATIVES = {
+  "print": 1748,
+  "thumbnail": 480,
+}
+JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", 85))
+
+# Derivatives found by variant_url, so the responses do not stat the asset store once they exist
+_current_variants = ttl_lru_cache(maxsize=4096, ttl=300)
+
+# Pillow releases the GIL while decoding, resizing and encoding, so threads are enough
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("IMAGE_WORKERS", 2)), thread_name_prefix="images")
+
+def derivative_url(url:str, variant:str) -> str:
+  """
+  Return the url of a derivative of an image, whether it exists or not.
+
+  Args:
+      url (str): The url of the original image, e.g. "/static/images/pages/<id>.png".
+      variant (str): The derivative, "print" or "thumbnail".
+
+  Returns:
+      str: The url of the derivative, e.g. "/static/images/pages/<id>.print.jpg".
+  """
+  return f"{os.path.splitext(url)[0]}.{variant}.jpg"
+
+def current_derivative(url:str, variant:str) -> str:
+  """
+  Return the url of the derivative of an image if it is up to date with the original.
+
+  Args:
+      url (str): The url of the original image.
+      variant (str): The derivative, "print" or "thumbnail".
+
+  Returns:
+      str: The url of the derivative, or None if it was not generated since the original was saved.
+  """
+  if not url:
+    return None
+  variant_key = derivative_url(url, variant)
+  try:
+    stats = get_asset_store().stat_all([url, variant_key])
+  except FileNotFoundError:
+    return None
+  return variant_key if _is_current(stats[url], stats[variant_key]) else None
+
+def _is_current(original:dict, derivative:dict) -> bool:
+  return bool(original and derivative and derivative["modified"] >= original["modified"])
+
+def image_info(url:str) -> dict:
+  """
+  Read the metadata of an image, stored on the page or story document so the layout does not reopen the file.
+
+  Args:
+      url (str): The url of the image.
+
+  Returns:
+      dict: The "width" and "height" in pixels, the size in "bytes" and the "sha256" of the file.
+
+  Raises:
+      FileNotFoundError: If the image does not exist.
+  """
+  path = get_asset_store().local_path(url)
+  with Image.open(path) as image:
+    width, height = image.size
+  digest = hashlib.sha256()
+  with open(path, "rb") as f:
+    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+      digest.update(chunk)
+  return {"width": width, "height": height, "bytes": os.path.getsize(path), "sha256": digest.hexdigest()}
+
+def variant_url(url:str, variant:str) -> str:
+  """
+  Return the url of the derivative of an image to serve, or of the original until the derivative is generated.
+
+  Args:
+      url (str): The url of the original image.
+      variant (str): The derivative, "print" or "thumbnail".
+
+  Returns:
+      str: The url of the derivative or of the original, None if there is no image.
+  """
+  if not url:
+    return None
+  derivative = _current_variants.get((url, variant))
+  if derivative is None:
+    derivative = current_derivative(url, variant)
+    if derivative is None:
+      # Checked again on the next request, until the background worker generates it
+      return url
+    _current_variants.set((url, variant), derivative)
+  return derivative
+
+def with_derivatives(urls:list[str]) -> list[str]:
+  """
+  Return the urls of images followed by the urls of all their derivatives, e.g. to delete them.
+  """
+  return list(urls) + [derivative_url(url, variant) for url in urls for variant in DERIVATIVES]
+
+def generate_derivatives(url:str) -> list[str]:
+  """
+  Generate the downscaled JPEG derivatives of an image.
+
+  Transparent areas are flattened on white, images smaller than a derivative are not upscaled.
+
+  Args:
+      url (str): The url of the original image.
+
+  Returns:
+      list[str]: The urls of the generated derivatives.
+
+  Raises:
+      FileNotFoundError: If the image does not exist.
+  """
+  store = get_asset_store()
+  urls = []
+  with Image.open(store.local_path(url)) as original:
+    original.load()
+    image = original.convert("RGBA") if original.mode in ("P", "LA", "RGBA") else original.convert("RGB")
+    if image.mode == "RGBA":
+      background = Image.new("RGB", image.size, (255, 255, 255))
+      background.paste(image, mask=image.getchannel("A"))
+      image = background
+
+  for variant, max_width in DERIVATIVES.items():
+    derivative = image
+    if image.width > max_width:
+      derivative = image.resize((max_width, round(image.height * max_width / image.width)), Image.LANCZOS)
+    path = temporary_path(".jpg")
+    try:
+      derivative.save(path, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=variant == "thumbnail")
+      store.save_file(derivative_url(url, variant), path)
+    finally:
+      if os.path.exists(path):
+        os.remove(path)
+    urls.append(derivative_url(url, variant))
+  return urls
+
+def _generate_logged(url:str) -> list[str]:
+  try:
+    return generate_derivatives(url)
+  except Exception as e:
+    print(f"Failed to generate the derivatives of {url}: {e}")
+    return []
+
+def generate_derivatives_in_background(url:str):
+  """
+  Generate the derivatives of an image in the image worker pool.
+
+  Until they are ready, the renderers and the responses fall back to the original image.
+
+  Args:
+      url (str): The url of the original image.
+
+  Returns:
+      Future: The future of the urls of the generated derivatives.
+  """
+  return _executor.submit(_generate_logged, url)
+
+def _uploaded_images():
+  """
+  Iterate over the urls of the covers and page images of the documents, each once.
+  """
+  db = get_db()
+  seen = set()
+  for collection, field in (("stories", "cover"), ("pages", "image")):
+    for document in db[collection].find({field: {"$nin": [None, ""]}}, {field: 1}):
+      url = document[field]
+      if url.startswith("/static/images/") and url not in seen:
+        seen.add(url)
+        yield url
+
+def generate_missing_derivatives(force:bool=False) -> tuple[int, int]:
+  """
+  Generate the derivatives of the uploaded images that are missing or stale.
+
+  Only the images used by a story or a page are processed, each checked with
+  the stat of its own derivatives rather than by listing the whole store.
+
+  Args:
+      force (bool): Regenerate the derivatives even when they are up to date.
+
+  Returns:
+      tuple[int, int]: The number of images processed and of images that failed.
+  """
+  store = get_asset_store()
+  generated = failed = 0
+  for url in _uploaded_images():
+    if not force:
+      stats = store.stat_all([url] + [derivative_url(url, variant) for variant in DERIVATIVES])
+      if all(_is_current(stats[url], stats[derivative_url(url, variant)]) for variant in DERIVATIVES):
+        continue
+    try:
+      generate_derivatives(url)
+      generated += 1
+    except Exception as e:
+      print(f"Failed to generate the derivatives of {url}: {e}")
+      failed += 1
+  return generated, failed
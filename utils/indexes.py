@@ -0,0 +1,82 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from utils.database import get_db
+from utils.assets_repository import assets_repository
+from routes.stories.stories_repository import stories_repository
+from routes.pages.pages_repository import pages_repository
+from routes.choices.choices_repository import choices_repository
+from routes.users.users_repository import users_repository
+
+# Repositories declaring the indexes and queries of each collection
+repositories = [stories_repository, pages_repository, choices_repository, users_repository, assets_repository]
+
+def ensure_indexes() -> dict:
+  """
+  Create the indexes declared by every repository.
+
+  create_indexes is idempotent, existing indexes with the same definition are left untouched.
+
+  Returns:
+      dict: The names of the indexes of each collection.
+  """
+  db = get_db()
+  created = {}
+  for repository in repositories:
+    repo = repository()
+    if repository.indexes:
+      created[repo.collection_name] = db[repo.collection_name].create_indexes(repository.indexes)
+  return created
+
+def _plan_stages(plan) -> list[str]:
+  """
+  Collect every stage name of an explain() plan.
+
+  Args:
+      plan: The plan, or a part of it.
+
+  Returns:
+      list[str]: The stage names found in the plan.
+  """
+  stages = []
+  if isinstance(plan, dict):
+    if "stage" in plan:
+      stages.append(plan["stage"])
+    for value in plan.values():
+      stages.extend(_plan_stages(value))
+  elif isinstance(plan, list):
+    for value in plan:
+      stages.extend(_plan_stages(value))
+  return stages
+
+def verify_indexes() -> list[dict]:
+  """
+  Run explain() on the queries declared by every repository.
+
+  The declared queries are built with the filter builders of utils.queries and
+  the keyset pagination of utils.pagination, as the repository methods, with
+  placeholder identifiers. Maintenance scans (backfills and counter repair)
+  read whole collections on purpose and are not declared.
+
+  Returns:
+      list[dict]: One report per query with the winning plan stages and whether it scans the collection.
+  """
+  db = get_db()
+  reports = []
+  for repository in repositories:
+    repo = repository()
+    for query in repository.queries:
+      cursor = db[repo.collection_name].find(query["filter"])
+      if query.get("sort"):
+        cursor = cursor.sort(query["sort"])
+      explain = cursor.explain()
+      stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+      reports.append({
+        "collection": repo.collection_name,
+        "filter": query["filter"],
+        "sort": query.get("sort"),
+        "stages": stages,
+        "collscan": "COLLSCAN" in stages,
+      })
+  return reports
@@ -0,0 +1,115 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from bisect import bisect_right
+from urllib.parse import urlencode
+
+from bson.objectid import ObjectId
+from flask import request
+from marshmallow import Schema, fields, validate, ValidationError
+from pymongo import ASCENDING
+
+# Number of items returned by the list endpoints when no limit is given, and the largest limit accepted
+PAGE_DEFAULT_LIMIT = int(os.environ.get("PAGE_DEFAULT_LIMIT", 50))
+PAGE_MAX_LIMIT = int(os.environ.get("PAGE_MAX_LIMIT", 500))
+# Order of the listings, the cursors being identifiers
+KEYSET_SORT = [("_id", ASCENDING)]
+
+def _validate_cursor(value:str) -> None:
+  if not ObjectId.is_valid(value):
+    raise ValidationError("Invalid cursor.")
+
+# Define a schema for the query string of the list endpoints
+class pagination_args(Schema):
+  limit = fields.Integer(load_default=PAGE_DEFAULT_LIMIT, validate=validate.Range(min=1, max=PAGE_MAX_LIMIT))
+  after = fields.String(load_default=None, validate=_validate_cursor)
+
+def keyset_filter(query:dict, after:str=None) -> dict:
+  """
+  Return the filter of a listing restricted to the documents following a cursor.
+
+  Args:
+      query (dict): The filter of the listing.
+      after (str, optional): The cursor returned with the previous page.
+
+  Returns:
+      dict: The filter of the page.
+  """
+  if after:
+    return {**query, "_id": {"$gt": ObjectId(after)}}
+  return query
+
+def find_page(collection, query:dict, limit:int, after:str=None, projection:dict=None) -> tuple[list[dict], str]:
+  """
+  Read the documents following a cursor, in the order of their identifiers.
+
+  The cursor is the _id of the last document of the previous page, so each
+  page is read with a bounded range scan of the index on the filtered fields
+  and _id, however far the listing goes.
+
+  Args:
+      collection (Collection): The collection to read.
+      query (dict): The filter of the listing.
+      limit (int): The maximum number of documents returned.
+      after (str, optional): The cursor returned with the previous page.
+      projection (dict, optional): The fields to return.
+
+  Returns:
+      tuple[list[dict], str]: The documents, and the cursor of the next page or None if this page is the last one.
+  """
+  # One more document tells whether a next page exists
+  documents = list(collection.find(keyset_filter(query, after), projection).sort(KEYSET_SORT).limit(limit + 1))
+  if len(documents) > limit:
+    documents = documents[:limit]
+    return documents, str(documents[-1]["_id"])
+  return documents, None
+
+def slice_page(documents:list[dict], limit:int, after:str=None) -> tuple[list[dict], str]:
+  """
+  Cut the page following a cursor out of documents already in memory, sorted by _id.
+
+  Args:
+      documents (list[dict]): The documents, e.g. the pages of a cached story graph.
+      limit (int): The maximum number of documents returned.
+      after (str, optional): The cursor returned with the previous page.
+
+  Returns:
+      tuple[list[dict], str]: The documents, and the cursor of the next page or None if this page is the last one.
+  """
+  start = bisect_right(documents, ObjectId(after), key=lambda document: document["_id"]) if after else 0
+  page = documents[start:start + limit]
+  if start + limit < len(documents):
+    return page, str(page[-1]["_id"])
+  return page, None
+
+def next_link(cursor:str, limit:int) -> str:
+  """
+  Build the url of the next page of the current list request.
+
+  Args:
+      cursor (str): The cursor of the next page.
+      limit (int): The limit of the current request.
+
+  Returns:
+      str: The path and query string of the next page, or None if there is no next page.
+  """
+  if cursor is None:
+    return None
+  args = {key: value for key, value in request.args.items() if key not in ("limit", "after")}
+  return f"{request.path}?{urlencode({**args, 'limit': limit, 'after': cursor})}"
+
+def paginated(name:str, items:list[dict], cursor:str, limit:int) -> dict:
+  """
+  Build the response of a list endpoint.
+
+  Args:
+      name (str): The key of the items, e.g. "stories".
+      items (list[dict]): The items of the page.
+      cursor (str): The cursor of the next page, None on the last page.
+      limit (int): The limit of the current request.
+
+  Returns:
+      dict: The items with the "nextCursor" and the "next" url to request the following page.
+  """
+  return {name: items, "nextCursor": cursor, "next": next_link(cursor, limit)}
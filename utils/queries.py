@@ -0,0 +1,63 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from bson.objectid import ObjectId
+
+# Filters of the queries issued by the repositories and the story graph loader.
+# The repositories also build the queries they declare for utils.indexes with
+# them, so verify_indexes explains the filters actually sent to the database.
+
+def by_id(document_id) -> dict:
+  """
+  Return the filter of a document by its identifier.
+  """
+  return {"_id": ObjectId(document_id)}
+
+def stories_of_user(user_id) -> dict:
+  """
+  Return the filter of the stories of a user.
+  """
+  return {"userId": ObjectId(user_id)}
+
+def pages_of_story(story_id) -> dict:
+  """
+  Return the filter of the pages of a story.
+  """
+  return {"storyId": ObjectId(story_id)}
+
+def choices_of_story(story_id) -> dict:
+  """
+  Return the filter of the choices of a story.
+  """
+  return {"storyId": ObjectId(story_id)}
+
+def choices_of_page(page_id) -> dict:
+  """
+  Return the filter of the choices starting from a page.
+  """
+  return {"pageId": ObjectId(page_id)}
+
+def choices_of_pages(page_ids:list) -> dict:
+  """
+  Return the filter of the choices starting from any of the given pages.
+  """
+  return {"pageId": {"$in": [ObjectId(page_id) for page_id in page_ids]}}
+
+def choices_leading_to(page_ids:list) -> dict:
+  """
+  Return the filter of the choices leading to any of the given pages.
+  """
+  return {"sendToPageId": {"$in": [ObjectId(page_id) for page_id in page_ids]}}
+
+def choice_leading_to(page_id) -> dict:
+  """
+  Return the filter of the choices leading to a page.
+  """
+  return {"sendToPageId": ObjectId(page_id)}
+
+def user_by_email(email:str) -> dict:
+  """
+  Return the filter of a user by its email.
+  """
+  return {"email": email}
@@ -0,0 +1,267 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import io
+import base64
+import hashlib
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from PIL import Image
+
+from utils.asset_store import get_asset_store, temporary_path, delete_assets, delete_assets_in_background
+from utils.images import with_derivatives, generate_derivatives_in_background
+from utils.assets_repository import assets_repository
+
+# Maximum size of an uploaded image
+IMAGE_MAX_BYTES = int(os.environ.get("IMAGE_MAX_BYTES", 10 * 1024 * 1024))
+CHUNK_SIZE = 64 * 1024
+# Room left around an uploaded file for the boundaries and headers of a multipart form
+MULTIPART_OVERHEAD = 64 * 1024
+# Formats accepted by the PDF renderer, with the extension of the stored file
+IMAGE_FORMATS = {"PNG": "png", "JPEG": "jpg", "GIF": "gif"}
+# Directory of the images, named after the sha256 of their content
+BLOB_URL = "/static/images/blobs"
+
+# Deletes the images released by their last document, one at a time
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="blobs")
+
+class upload_too_large(ValueError):
+  """
+  Raised when an upload exceeds the maximum size.
+  """
+
+def check_content_length(request, max_bytes:int, name:str="image") -> None:
+  """
+  Reject a request announcing a body larger than an upload of max_bytes, before werkzeug reads or spools it.
+
+  Args:
+      request (Request): The flask request.
+      max_bytes (int): The maximum size of the uploaded file.
+      name (str): What is uploaded, for the error message.
+
+  Raises:
+      upload_too_large: If the announced size of the body exceeds max_bytes, plus MULTIPART_OVERHEAD for a multipart form.
+  """
+  limit = max_bytes + (MULTIPART_OVERHEAD if request.mimetype == "multipart/form-data" else 0)
+  if request.content_length is not None and request.content_length > limit:
+    raise upload_too_large(f"The {name} exceeds the maximum size of {max_bytes} bytes.")
+
+def upload_stream(request):
+  """
+  Return the stream of the image sent in a request, either as the file of a multipart form or as the raw body.
+
+  Args:
+      request (Request): The flask request.
+
+  Returns:
+      The readable stream of the image.
+
+  Raises:
+      upload_too_large: If the announced size of the body exceeds IMAGE_MAX_BYTES.
+      ValueError: If the request has no body.
+  """
+  # Checked before request.files, which reads the whole form
+  check_content_length(request, IMAGE_MAX_BYTES)
+  if request.files:
+    return (request.files.get("file") or next(iter(request.files.values()))).stream
+  if not request.content_length and not request.headers.get("Transfer-Encoding"):
+    raise ValueError("The request has no image.")
+  return request.stream
+
+def blob_digest(url:str) -> str:
+  """
+  Return the sha256 of a content addressed image from its url.
+
+  Args:
+      url (str): The url of the image.
+
+  Returns:
+      str: The sha256, or None for an image stored under the identifier of its document before content addressing.
+  """
+  if not url or not url.startswith(BLOB_URL + "/"):
+    return None
+  digest = os.path.splitext(url[len(BLOB_URL) + 1:])[0]
+  if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+    return None
+  return digest
+
+def save_image(stream, max_bytes:int=IMAGE_MAX_BYTES) -> tuple[str, dict]:
+  """
+  Stream an uploaded image to the asset store, named after its content, and reference it.
+
+  The image is written in chunks to a temporary file while being hashed, then
+  checked with Pillow. It is only moved to BLOB_URL/<sha256>.<ext> the first
+  time these bytes are uploaded, another upload of the same image only adds a
+  reference to it. The derivatives of a new image are generated in the background.
+
+  Args:
+      stream: The readable stream of the image.
+      max_bytes (int): The maximum size of the image.
+
+  Returns:
+      tuple[str, dict]: The url of the stored image and its metadata ("width", "height", "bytes" and "sha256").
+
+  Raises:
+      upload_too_large: If the image exceeds max_bytes.
+      ValueError: If the upload is empty or not a PNG, JPEG or GIF image.
+  """
+  path = temporary_path(".upload")
+  digest = hashlib.sha256()
+  size = 0
+  try:
+    with open(path, "wb") as f:
+      for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+        size += len(chunk)
+        if size > max_bytes:
+          raise upload_too_large(f"The image exceeds the maximum size of {max_bytes} bytes.")
+        digest.update(chunk)
+        f.write(chunk)
+    if not size:
+      raise ValueError("The image is empty.")
+
+    try:
+      with Image.open(path) as image:
+        image_format = image.format
+        width, height = image.size
+    except Exception as e:
+      raise ValueError("The upload is not a valid image.") from e
+    if image_format not in IMAGE_FORMATS:
+      raise ValueError(f"Unsupported image format {image_format}, use PNG, JPEG or GIF.")
+
+    info = {"width": width, "height": height, "bytes": size, "sha256": digest.hexdigest()}
+    url = f"{BLOB_URL}/{info['sha256']}.{IMAGE_FORMATS[image_format]}"
+    store = get_asset_store()
+    created = assets_repository().acquire(info["sha256"], url, info)
+    try:
+      # The file is stored again if it went missing, e.g. deleted while the image was uploaded again
+      if created or store.stat(url) is None:
+        store.save_file(url, path)
+        generate_derivatives_in_background(url)
+    except BaseException:
+      release_images([url])
+      raise
+  finally:
+    if os.path.exists(path):
+      os.remove(path)
+  return url, info
+
+def save_data_url(data_url:str, max_bytes:int=IMAGE_MAX_BYTES) -> tuple[str, dict]:
+  """
+  Store an image sent as a base64 data url, the format of the legacy json updates.
+
+  Args:
+      data_url (str): The image, e.g. "data:image/png;base64,...".
+      max_bytes (int): The maximum size of the image.
+
+  Returns:
+      tuple[str, dict]: The url of the stored image and its metadata.
+
+  Raises:
+      upload_too_large: If the image exceeds max_bytes.
+      ValueError: If the data url is malformed or not a supported image.
+  """
+  try:
+    data = base64.b64decode(data_url.split(',', 1)[1])
+  except Exception as e:
+    raise ValueError("The image is not a valid base64 data url.") from e
+  return save_image(io.BytesIO(data), max_bytes)
+
+def retain_images(urls:list[str]) -> None:
+  """
+  Reference the images a new document was created with, e.g. a copy of another page.
+
+  Args:
+      urls (list[str]): The urls of the images, the ones not content addressed are ignored.
+  """
+  repository = assets_repository()
+  for url in urls:
+    digest = blob_digest(url)
+    if digest:
+      repository.retain(digest)
+
+def delete_unused_image(digest:str) -> int:
+  """
+  Delete the files of a content addressed image if no document references it anymore.
+
+  The deletion is claimed on the assets document first, so an upload of the
+  same image arriving meanwhile either keeps the files or stores them again
+  once they are deleted.
+
+  Args:
+      digest (str): The sha256 of the image.
+
+  Returns:
+      int: The number of files deleted, the image and its derivatives.
+  """
+  repository = assets_repository()
+  try:
+    claim = repository.claim_deletion(digest)
+    if claim is None:
+      return 0
+    key, token = claim
+    try:
+      return delete_assets(with_derivatives([key]))
+    finally:
+      repository.finish_deletion(digest, token)
+  except Exception as e:
+    print(f"Failed to delete image {digest}: {e}")
+    return 0
+
+def release_images(urls:list[str]) -> int:
+  """
+  Remove the references of documents to images, and delete in the background the images no document uses anymore.
+
+  Images stored before content addressing belong to a single document and are deleted directly.
+
+  Args:
+      urls (list[str]): The urls of the images, one per reference.
+
+  Returns:
+      int: The number of images scheduled for deletion with their derivatives.
+  """
+  repository = assets_repository()
+  unused = []
+  released = 0
+  for url in urls:
+    if not url:
+      continue
+    digest = blob_digest(url)
+    if digest is None:
+      unused.append(url)
+    elif repository.release(digest):
+      _executor.submit(delete_unused_image, digest)
+      released += 1
+  if unused:
+    delete_assets_in_background(with_derivatives(unused))
+  return len(unused) + released
+
+@contextmanager
+def release_on_error():
+  """
+  Release the references save_image added to images if the update storing them on their document fails.
+
+  The images are saved inside the block, so no failure between the upload and
+  the update can leave a reference behind.
+
+  Yields:
+      list: The urls of the saved images, appended by the block as soon as save_image returns them.
+  """
+  uploaded = []
+  try:
+    yield uploaded
+  except BaseException:
+    release_images(uploaded)
+    raise
+
+def discard_replaced(previous_url:str) -> None:
+  """
+  Release the image a document referenced before an upload replaced or removed it.
+
+  Args:
+      previous_url (str): The url of the image before the update, if any.
+  """
+  if previous_url:
+    release_images([previous_url])